@@ -0,0 +1,263 @@
+"""
+In-process API key validation cache.
+
+Validating a key on every authenticated borrow used to SELECT it and then
+UPDATE its last_used_at, turning every read into a write transaction. Now:
+
+- validated keys (tenant, scopes, expiry) are cached for
+  LICENSE_API_KEY_CACHE_SECONDS (LRU-bounded by LICENSE_API_KEY_CACHE_SIZE)
+  and dropped immediately when revoked or their tenant is deleted;
+- a Bloom filter of every stored key hash answers "definitely not a key",
+  so floods of bogus keys are rejected without the key lookup (a filter
+  false positive just falls through to it). Before rejecting, a miss
+  re-reads the api_keys stamp (two indexed MAX lookups) and reloads the
+  filter if keys were added by another process;
+- last_used_at is coalesced per key in memory and written every
+  LICENSE_API_KEY_FLUSH_SECONDS in one batched UPDATE.
+
+Revocations by another process are picked up at the latest after the cache TTL.
+"""
+
+import collections
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import Counter
+
+from . import db
+
+logger = logging.getLogger("license-server")
+
+API_KEY_CACHE_SECONDS = float(os.getenv("LICENSE_API_KEY_CACHE_SECONDS", "60"))
+API_KEY_CACHE_SIZE = int(os.getenv("LICENSE_API_KEY_CACHE_SIZE", "10000"))
+API_KEY_FLUSH_SECONDS = float(os.getenv("LICENSE_API_KEY_FLUSH_SECONDS", "5"))
+API_KEY_FILTER_BITS = int(os.getenv("LICENSE_API_KEY_FILTER_BITS", str(1 << 20)))
+
+api_key_lookups_total = Counter(
+    "license_api_key_lookups_total",
+    "API key validations by how they were answered",
+    ["result"],  # cached, filtered, db_valid, db_invalid
+)
+
+
+def hash_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class KeyFilter:
+    """
+    Bloom filter over API key hashes: no false negatives, so a miss means
+    the key does not exist. Bit positions are slices of the (already
+    uniformly distributed) SHA-256 hex digest.
+    """
+
+    HASHES = 4
+
+    def __init__(self, bits: int = API_KEY_FILTER_BITS):
+        self.bits = max(64, bits)
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key_hash: str):
+        for i in range(self.HASHES):
+            yield int(key_hash[i * 8:(i + 1) * 8], 16) % self.bits
+
+    def add(self, key_hash: str) -> None:
+        for pos in self._positions(key_hash):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key_hash: str) -> bool:
+        return all(self._array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key_hash))
+
+
+class _KeyIndex:
+    """Cache, filter and pending last_used_at writes for one catalog database."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # key_hash -> (details, expires_at, cached_at)
+        self.cache: "collections.OrderedDict[str, Tuple[dict, Optional[str], float]]" = collections.OrderedDict()
+        self.filter: Optional[KeyFilter] = None
+        self.filter_stamp: Optional[tuple] = None
+        # One reload at a time; keys added while it reads api_keys are replayed into the new filter
+        self.load_lock = threading.Lock()
+        self.added_during_load: Optional[list] = None
+        self.last_used: Dict[str, str] = {}
+
+
+_index: Optional[_KeyIndex] = None
+_index_lock = threading.Lock()
+
+
+def _current_index() -> _KeyIndex:
+    """The index for the configured database (replaced if LICENSE_DB_PATH changes)."""
+    global _index
+    db_path = db.get_db_path()
+    with _index_lock:
+        if _index is None or _index.db_path != db_path:
+            _index = _KeyIndex(db_path)
+        return _index
+
+
+def _filter_stamp(cur) -> tuple:
+    """Changes whenever a key is inserted; separate subqueries so each MAX is an index lookup."""
+    cur.execute("SELECT (SELECT MAX(rowid) FROM api_keys), (SELECT MAX(created_at) FROM api_keys)")
+    return tuple(cur.fetchone())
+
+
+def _load_filter(index: _KeyIndex) -> None:
+    with index.load_lock:
+        with index.lock:
+            index.added_during_load = []
+        key_filter = KeyFilter()
+        try:
+            with db.get_connection(True, catalog=True) as conn:
+                cur = conn.cursor()
+                stamp = _filter_stamp(cur)
+                cur.execute("SELECT key_hash FROM api_keys WHERE status = 'active'")
+                for row in cur:
+                    key_filter.add(row[0])
+        finally:
+            with index.lock:
+                added, index.added_during_load = index.added_during_load, None
+                for key_hash in added:
+                    key_filter.add(key_hash)
+        with index.lock:
+            index.filter, index.filter_stamp = key_filter, stamp
+
+
+def might_exist(key_hash: str) -> bool:
+    """False only if no active key has this hash (see KeyFilter)."""
+    index = _current_index()
+    if index.filter is None:
+        _load_filter(index)
+    if key_hash in index.filter:
+        return True
+    # Keys created by another process are not in the filter until it is reloaded
+    with db.get_connection(True, catalog=True) as conn:
+        changed = _filter_stamp(conn.cursor()) != index.filter_stamp
+    if changed:
+        _load_filter(index)
+        if key_hash in index.filter:
+            return True
+    api_key_lookups_total.labels(result="filtered").inc()
+    return False
+
+
+def add_key(key_hash: str) -> None:
+    """Make a newly created key visible to the filter."""
+    index = _current_index()
+    with index.lock:
+        if index.filter is not None:
+            index.filter.add(key_hash)
+        if index.added_during_load is not None:
+            index.added_during_load.append(key_hash)
+
+
+def get_cached(key_hash: str, now: str) -> Optional[dict]:
+    index = _current_index()
+    with index.lock:
+        entry = index.cache.get(key_hash)
+        if entry is None:
+            return None
+        details, expires_at, cached_at = entry
+        if time.monotonic() - cached_at > API_KEY_CACHE_SECONDS or (expires_at and expires_at < now):
+            del index.cache[key_hash]
+            return None
+        index.cache.move_to_end(key_hash)
+    api_key_lookups_total.labels(result="cached").inc()
+    return details
+
+
+def remember(key_hash: str, details: Optional[dict], expires_at: Optional[str] = None) -> None:
+    """Cache a database lookup (details None = invalid key, counted but not cached)."""
+    api_key_lookups_total.labels(result="db_valid" if details else "db_invalid").inc()
+    if details is None or API_KEY_CACHE_SECONDS <= 0:
+        return
+    index = _current_index()
+    with index.lock:
+        index.cache[key_hash] = (details, expires_at, time.monotonic())
+        index.cache.move_to_end(key_hash)
+        while len(index.cache) > API_KEY_CACHE_SIZE:
+            index.cache.popitem(last=False)
+
+
+def invalidate(key_id: Optional[str] = None, tenant_id: Optional[str] = None) -> None:
+    """Drop cached keys by key id or by tenant (revocation, tenant deletion)."""
+    index = _current_index()
+    with index.lock:
+        stale = [
+            key_hash for key_hash, (details, _, _) in index.cache.items()
+            if (key_id is not None and details["key_id"] == key_id)
+            or (tenant_id is not None and details["tenant_id"] == tenant_id)
+        ]
+        for key_hash in stale:
+            del index.cache[key_hash]
+
+
+def record_use(key_id: str, now: str) -> None:
+    index = _current_index()
+    with index.lock:
+        index.last_used[key_id] = now
+
+
+def flush() -> int:
+    """
+    Write coalesced last_used_at values in one transaction and reload the
+    filter if api_keys changed. Returns the number of keys updated.
+    """
+    index = _current_index()
+    with index.lock:
+        pending, index.last_used = index.last_used, {}
+    if pending:
+        try:
+            with db.get_connection(False, catalog=True) as conn:
+                with db.immediate_transaction(conn) as cur:
+                    cur.executemany(
+                        "UPDATE api_keys SET last_used_at = ? WHERE id = ? AND (last_used_at IS NULL OR last_used_at < ?)",
+                        [(used_at, key_id, used_at) for key_id, used_at in pending.items()]
+                    )
+        except Exception:
+            with index.lock:
+                for key_id, used_at in pending.items():
+                    index.last_used.setdefault(key_id, used_at)
+            raise
+    if index.filter is not None:
+        with db.get_connection(True, catalog=True) as conn:
+            changed = _filter_stamp(conn.cursor()) != index.filter_stamp
+        if changed:
+            _load_filter(index)
+    return len(pending)
+
+
+class LastUsedFlusher:
+    """Background thread running flush() every LICENSE_API_KEY_FLUSH_SECONDS."""
+
+    def __init__(self, interval: float = API_KEY_FLUSH_SECONDS):
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="api-key-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        try:
+            flush()
+        except Exception as e:
+            logger.error("api key last_used_at flush failed on shutdown: %s", e)
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            try:
+                flush()
+            except Exception as e:
+                logger.error("api key last_used_at flush failed: %s", e)
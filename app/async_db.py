@@ -0,0 +1,96 @@
+"""
+Awaitable wrappers around the synchronous helpers in app/db.py.
+
+sqlite3 calls block, so async route handlers must not call db.py directly on
+the event loop. These wrappers run the same helpers on a dedicated, bounded
+thread pool (LICENSE_DB_EXECUTOR_WORKERS, default 8) so a slow admin query or
+hard delete cannot stall SSE streams or other requests. The caller's context
+is copied into the worker, so the request's unit of work (and its pooled
+connection) is reused. Password hashing is CPU-bound rather than blocking and
+goes to the process pool in app/passwords.py instead.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from . import db
+from . import passwords
+
+DB_EXECUTOR_WORKERS = int(os.getenv("LICENSE_DB_EXECUTOR_WORKERS", "8"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, DB_EXECUTOR_WORKERS), thread_name_prefix="db")
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+async def run_db(fn: Callable, *args, **kwargs):
+    """Run a blocking database call on the db executor and await its result."""
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), call)
+
+
+def _awaitable(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_db(fn, *args, **kwargs)
+    return wrapper
+
+
+# Licensing
+borrow_license = _awaitable(db.borrow_license)
+return_license = _awaitable(db.return_license)
+get_status = _awaitable(db.get_status)
+get_all_status = _awaitable(db.get_all_status)
+get_all_tools = _awaitable(db.get_all_tools)
+
+# Users and sessions
+get_login_user = _awaitable(db.get_login_user)
+record_user_login = _awaitable(db.record_user_login)
+get_pending_user_by_setup_token = _awaitable(db.get_pending_user_by_setup_token)
+
+
+async def verify_user_credentials(username: str, password: str) -> bool:
+    """Look up the hash on the db executor, verify it in the password process pool."""
+    password_hash = await run_db(db.get_password_hash, username)
+    if password_hash is None:
+        return False
+    return await passwords.verify_password_async(password, password_hash)
+
+
+async def activate_user(username: str, password: str) -> None:
+    password_hash = await passwords.hash_password_async(password)
+    await run_db(db.activate_user_with_hash, username, password_hash)
+
+
+# Admin API
+create_tenant = _awaitable(db.create_tenant)
+get_all_tenants = _awaitable(db.get_all_tenants)
+get_tenants_page = _awaitable(db.get_tenants_page)
+delete_tenant = _awaitable(db.delete_tenant)
+create_vendor = _awaitable(db.create_vendor)
+get_all_vendors = _awaitable(db.get_all_vendors)
+get_vendors_page = _awaitable(db.get_vendors_page)
+delete_vendor = _awaitable(db.delete_vendor)
+get_platform_stats = _awaitable(db.get_platform_stats)
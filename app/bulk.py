@@ -0,0 +1,302 @@
+"""
+Bulk provisioning of tenants, license packages and licenses.
+
+POST /api/admin/bulk/provision takes an NDJSON or CSV body with one flat
+record per line:
+
+    tenant_id, company_name, contact_email, crm_id,          (tenant)
+    vendor_id, product_id, product_name, total, commit_qty,  (package + license)
+    max_overage, commit_price, overage_price_per_license, crm_opportunity_id
+
+A record creates its tenant if it does not exist yet (company_name required,
+tenant_id defaults to its slug) and, when product_id is set, provisions a
+package and license to that tenant. Records are validated as the body
+streams in and written in chunks of LICENSE_BULK_CHUNK_ROWS. Each chunk
+takes one transaction: one IN (...) lookup for existing tenants and CRM
+ids, then executemany for each table. If a chunk hits a constraint error it
+is replayed row by row under savepoints so only the offending rows fail.
+Per-row errors are reported with their line numbers.
+"""
+
+import csv
+import json
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import db
+from . import sharding
+from .migrations import table_columns
+
+logger = logging.getLogger("license-server")
+
+BULK_CHUNK_ROWS = int(os.getenv("LICENSE_BULK_CHUNK_ROWS", "1000"))
+BULK_MAX_REPORTED_ERRORS = int(os.getenv("LICENSE_BULK_MAX_REPORTED_ERRORS", "1000"))
+
+_TENANT_ID_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+_INT_FIELDS = ("total", "commit_qty", "max_overage")
+_FLOAT_FIELDS = {"commit_price": 1000.0, "overage_price_per_license": 100.0}
+
+
+class BulkRowError(ValueError):
+    """A record that cannot be provisioned (reported, not raised to the client)."""
+
+
+def validate_record(record: dict, default_vendor: str) -> dict:
+    """Normalize one input record (CSV values arrive as strings). Raises BulkRowError."""
+    if not isinstance(record, dict):
+        raise BulkRowError("record must be an object")
+    rec = {k: (v.strip() if isinstance(v, str) else v) for k, v in record.items()}
+    rec = {k: v for k, v in rec.items() if v not in ("", None)}
+
+    tenant_id = rec.get("tenant_id") or (db.slugify(rec["company_name"]) if rec.get("company_name") else None)
+    if not tenant_id:
+        raise BulkRowError("tenant_id or company_name is required")
+    if not _TENANT_ID_RE.match(tenant_id):
+        raise BulkRowError(f"invalid tenant_id {tenant_id!r}")
+    rec["tenant_id"] = tenant_id
+
+    if "product_id" in rec:
+        rec.setdefault("vendor_id", default_vendor)
+        rec.setdefault("product_name", rec["product_id"])
+        for field in _INT_FIELDS:
+            if field not in rec:
+                raise BulkRowError(f"{field} is required with product_id")
+            try:
+                rec[field] = int(rec[field])
+            except (TypeError, ValueError):
+                raise BulkRowError(f"{field} must be an integer")
+            if rec[field] < 0:
+                raise BulkRowError(f"{field} must be >= 0")
+        if rec["commit_qty"] > rec["total"]:
+            raise BulkRowError("commit_qty cannot exceed total")
+        for field, default in _FLOAT_FIELDS.items():
+            try:
+                rec[field] = float(rec.get(field, default))
+            except (TypeError, ValueError):
+                raise BulkRowError(f"{field} must be a number")
+    return rec
+
+
+def iter_ndjson(lines: Iterator[Tuple[int, str]]) -> Iterator[Tuple[int, object]]:
+    """(line number, parsed record or BulkRowError) per non-blank NDJSON line."""
+    for line_no, line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, BulkRowError(f"invalid JSON: {e}")
+
+
+class CsvRecords:
+    """Stateful CSV line parser (first line is the header; one record per line)."""
+
+    def __init__(self):
+        self.header: Optional[List[str]] = None
+
+    def parse(self, lines: Iterator[Tuple[int, str]]) -> Iterator[Tuple[int, object]]:
+        for line_no, line in lines:
+            if not line.strip():
+                continue
+            values = next(csv.reader([line]))
+            if self.header is None:
+                self.header = [v.strip() for v in values]
+                continue
+            if len(values) > len(self.header):
+                yield line_no, BulkRowError("more values than header columns")
+                continue
+            yield line_no, dict(zip(self.header, values))
+
+
+class BulkProvisioner:
+    """Accumulates validated records and writes them in chunked transactions."""
+
+    def __init__(self, vendor_id: str = "techvendor", chunk_rows: Optional[int] = None):
+        self.vendor_id = vendor_id
+        self.chunk_rows = max(1, chunk_rows or BULK_CHUNK_ROWS)
+        self.pending: List[Tuple[int, dict]] = []
+        self.rows = 0
+        self.failed = 0
+        self.tenants_created: List[dict] = []
+        self.packages_created = 0
+        self.errors: List[dict] = []
+        self._vendors: Optional[set] = None
+        self._tenant_keyed: Optional[bool] = None
+
+    def add(self, line_no: int, record: object) -> bool:
+        """Validate one record. Returns True when a chunk is ready to flush()."""
+        self.rows += 1
+        try:
+            if isinstance(record, Exception):
+                raise record
+            self.pending.append((line_no, validate_record(record, self.vendor_id)))
+        except BulkRowError as e:
+            self._error(line_no, str(e))
+        return len(self.pending) >= self.chunk_rows
+
+    def _error(self, line_no: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < BULK_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_no, "error": message})
+        logger.debug("bulk provision line=%d rejected: %s", line_no, message)
+
+    def flush(self) -> None:
+        """Write the pending chunk (blocking; run it on the db executor)."""
+        rows, self.pending = self.pending, []
+        if not rows:
+            return
+        with db.get_connection(False, catalog=True) as conn:
+            self._load_schema_info(conn.cursor())
+            try:
+                with db.immediate_transaction(conn) as cur:
+                    created, packages, licenses, errors = self._insert(cur, rows)
+            except sqlite3.IntegrityError:
+                with db.immediate_transaction(conn) as cur:
+                    created, packages, licenses, errors = self._insert_row_by_row(cur, rows)
+        for line_no, message in errors:
+            self._error(line_no, message)
+        if sharding.sharding_enabled():
+            self._insert_shard_licenses(created, licenses)
+        self.tenants_created.extend(created)
+        self.packages_created += packages
+
+    def _load_schema_info(self, cur: sqlite3.Cursor) -> None:
+        if self._vendors is None:
+            cur.execute("SELECT vendor_id FROM vendors")
+            self._vendors = {row[0] for row in cur.fetchall()}
+            self._tenant_keyed = "tenant_id" in table_columns(cur, "licenses")
+
+    def _insert_row_by_row(self, cur: sqlite3.Cursor, rows: List[Tuple[int, dict]]):
+        created, packages, licenses, errors = [], 0, [], []
+        for row in rows:
+            cur.execute("SAVEPOINT bulk_row")
+            try:
+                c, p, l, e = self._insert(cur, [row])
+            except sqlite3.IntegrityError as exc:
+                cur.execute("ROLLBACK TO bulk_row")
+                errors.append((row[0], f"constraint violation: {exc}"))
+            else:
+                created += c
+                packages += p
+                licenses += l
+                errors += e
+            cur.execute("RELEASE bulk_row")
+        return created, packages, licenses, errors
+
+    def _insert(self, cur: sqlite3.Cursor, rows: List[Tuple[int, dict]]):
+        """
+        Plan and executemany one chunk.
+
+        Returns (created tenants, package count, shard license rows, row errors);
+        errors are only reported once the chunk's transaction commits.
+        """
+        tenant_ids = list({rec["tenant_id"] for _, rec in rows})
+        crm_ids = list({rec["crm_id"] for _, rec in rows if "crm_id" in rec})
+        cur.execute(f"SELECT tenant_id FROM tenants WHERE tenant_id IN ({','.join('?' * len(tenant_ids))})", tenant_ids)
+        known = {row[0] for row in cur.fetchall()}
+        taken_crm = set()
+        if crm_ids:
+            cur.execute(f"SELECT crm_id FROM tenants WHERE crm_id IN ({','.join('?' * len(crm_ids))})", crm_ids)
+            taken_crm = {row[0] for row in cur.fetchall()}
+
+        now = datetime.utcnow().isoformat()
+        created, tenant_rows, user_rows, package_rows, license_rows, shard_licenses, errors = [], [], [], [], [], [], []
+        for line_no, rec in rows:
+            tenant_id = rec["tenant_id"]
+            if tenant_id not in known:
+                if "company_name" not in rec:
+                    errors.append((line_no, f"tenant {tenant_id} does not exist and no company_name was given"))
+                    continue
+                if rec.get("crm_id") in taken_crm:
+                    errors.append((line_no, f"crm_id {rec['crm_id']} is already used by another tenant"))
+                    continue
+                domain = f"{tenant_id}.permetrix.fly.dev"
+                user_id = f"user_{secrets.token_hex(8)}" if rec.get("contact_email") else None
+                tenant_rows.append((tenant_id, rec["company_name"], domain, rec.get("crm_id"), now, user_id))
+                entry = {"line": line_no, "tenant_id": tenant_id}
+                if user_id:
+                    setup_token = secrets.token_urlsafe(32)
+                    user_rows.append((rec["contact_email"], tenant_id, setup_token, now))
+                    entry["setup_link"] = f"https://{domain}/setup?token={setup_token}"
+                created.append(entry)
+                known.add(tenant_id)
+                if rec.get("crm_id"):
+                    taken_crm.add(rec["crm_id"])
+
+            if "product_id" not in rec:
+                continue
+            if rec["vendor_id"] not in self._vendors:
+                errors.append((line_no, f"unknown vendor {rec['vendor_id']}"))
+                continue
+            package_id = f"pkg-{tenant_id}-{rec['product_id']}-{uuid.uuid4().hex[:8]}"
+            package_rows.append((package_id, tenant_id, rec["vendor_id"], rec["product_id"], rec["product_name"],
+                                 rec.get("crm_opportunity_id"), now))
+            values = (rec["product_name"], rec["total"], rec["commit_qty"], rec["max_overage"],
+                      rec["commit_price"], rec["overage_price_per_license"])
+            if sharding.sharding_enabled():
+                shard_licenses.append((tenant_id, values))
+            elif self._tenant_keyed:
+                license_rows.append((f"lic-{tenant_id}-{rec['product_id']}-{uuid.uuid4().hex[:8]}", tenant_id, package_id) + values)
+            else:
+                license_rows.append(values)
+
+        cur.executemany(
+            "INSERT INTO tenants(tenant_id, company_name, domain, crm_id, status, created_at, admin_user_id) VALUES (?, ?, ?, ?, 'active', ?, ?)",
+            tenant_rows,
+        )
+        cur.executemany(
+            "INSERT OR REPLACE INTO users(username, password_hash, tenant_id, role, status, setup_token, created_at) VALUES (?, 'pending', ?, 'admin', 'pending_verification', ?, ?)",
+            user_rows,
+        )
+        cur.executemany(
+            "INSERT INTO license_packages(package_id, tenant_id, vendor_id, product_id, product_name, crm_opportunity_id, status, provisioned_at) VALUES (?, ?, ?, ?, ?, ?, 'active', ?)",
+            package_rows,
+        )
+        if self._tenant_keyed:
+            cur.executemany(
+                "INSERT INTO licenses(id, tenant_id, package_id, tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
+                license_rows,
+            )
+        else:
+            cur.executemany(
+                "INSERT INTO licenses(tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license) VALUES (?, ?, 0, ?, ?, ?, ?)",
+                license_rows,
+            )
+        return created, len(package_rows), shard_licenses, errors
+
+    def _insert_shard_licenses(self, created: List[dict], licenses: List[tuple]) -> None:
+        """
+        Create shards for new tenants and write their licenses (tool-keyed
+        schema), one transaction per shard. A tool the shard already licenses
+        is left as is.
+        """
+        per_tenant: Dict[str, list] = {entry["tenant_id"]: [] for entry in created}
+        for tenant_id, values in licenses:
+            per_tenant.setdefault(tenant_id, []).append(values)
+        for tenant_id, rows in per_tenant.items():
+            db.ensure_shard(tenant_id)
+            if not rows:
+                continue
+            with sharding.tenant_scope(tenant_id), db.get_connection(False) as conn:
+                with db.immediate_transaction(conn) as cur:
+                    cur.executemany(
+                        "INSERT OR IGNORE INTO licenses(tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license) VALUES (?, ?, 0, ?, ?, ?, ?)",
+                        rows,
+                    )
+
+    def report(self) -> dict:
+        return {
+            "rows": self.rows,
+            "failed": self.failed,
+            "tenants_created": len(self.tenants_created),
+            "packages_created": self.packages_created,
+            "tenants": self.tenants_created,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
@@ -0,0 +1,200 @@
+"""
+Scrape-time Prometheus metrics for license state.
+
+The per-tool gauges (licenses_borrowed, licenses_total, licenses_overage,
+licenses_commit, licenses_max_overage, licenses_at_max_overage) used to be
+set from borrow/return handlers, which cost a get_status per request and
+left them stale after restarts or budget edits. ``LicenseStateCollector``
+instead reads every tool's state once per scrape: the in-memory engine's
+snapshot or one get_all_status query, plus one per tenant shard (with a
+``tenant`` label) when sharding is enabled.
+
+``MetricsCache`` renders /metrics at most once per
+LICENSE_METRICS_CACHE_SECONDS, so several scrapers share one generation.
+
+Label cardinality is bounded: ``label_limiter`` admits the first
+LICENSE_METRIC_LABEL_LIMIT distinct values per label (per-label overrides in
+LICENSE_METRIC_LABEL_LIMITS, e.g. "tool=500,route=100") and maps the rest to
+``__other__``. Per-user counts are not labels on the request counters at
+all; ``TopKCounter`` exports only the heaviest users (Space-Saving sketch).
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from . import db
+from . import sharding
+
+logger = logging.getLogger("license-server")
+
+METRICS_CACHE_SECONDS = float(os.getenv("LICENSE_METRICS_CACHE_SECONDS", "2"))
+METRIC_LABEL_LIMIT = int(os.getenv("LICENSE_METRIC_LABEL_LIMIT", "200"))
+METRIC_LABEL_LIMITS = os.getenv("LICENSE_METRIC_LABEL_LIMITS", "")
+METRIC_TOP_USERS = int(os.getenv("LICENSE_METRIC_TOP_USERS", "20"))
+
+OTHER_LABEL = "__other__"
+
+label_overflow_total = Counter(
+    "license_metric_label_overflow_total",
+    "Label values folded into __other__ by the cardinality limiter",
+    ["label"],
+)
+
+# (metric name, help, value from a get_status dict)
+TOOL_GAUGES = (
+    ("licenses_borrowed", "Currently borrowed licenses per tool", lambda s: s["borrowed"]),
+    ("licenses_total", "Total licenses available per tool", lambda s: s["total"]),
+    ("licenses_overage", "Current overage count per tool", lambda s: s["overage"]),
+    ("licenses_commit", "Commit quantity per tool", lambda s: s["commit"]),
+    ("licenses_max_overage", "Max overage allowed per tool", lambda s: s["max_overage"]),
+    ("licenses_at_max_overage", "Whether tool is at max overage (1) or not (0)",
+     lambda s: 1 if s["overage"] >= s["max_overage"] else 0),
+)
+
+
+def _current_state() -> List[Tuple[Optional[str], dict]]:
+    """(tenant_id, status) for every tool in the main database and, if sharded, every shard."""
+    state = [(None, status) for status in db.get_all_status()]
+    if sharding.sharding_enabled():
+        per_shard = sharding.fan_out(db.get_all_status, sharding.list_shard_tenants(db.get_db_path()))
+        for tenant_id, statuses in per_shard.items():
+            state.extend((tenant_id, status) for status in statuses)
+    return state
+
+
+class LicenseStateCollector:
+    """Custom collector emitting the per-tool gauges from live allocation state."""
+
+    def _families(self) -> List[GaugeMetricFamily]:
+        labels = ["tool", "tenant"] if sharding.sharding_enabled() else ["tool"]
+        return [GaugeMetricFamily(name, doc, labels=labels) for name, doc, _ in TOOL_GAUGES]
+
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        # Without describe() the registry would call collect() (and query the database) at registration
+        return iter(self._families())
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        families = self._families()
+        try:
+            state = _current_state()
+        except Exception as e:
+            logger.warning("license state collection failed: %s", e)
+            state = []
+        sharded = sharding.sharding_enabled()
+        for tenant_id, status in state:
+            label_values = [status["tool"], tenant_id or ""] if sharded else [status["tool"]]
+            for family, (_, _, value) in zip(families, TOOL_GAUGES):
+                family.add_metric(label_values, value(status))
+        return iter(families)
+
+
+class MetricsCache:
+    """/metrics body regenerated at most once per interval (concurrent scrapes wait for one render)."""
+
+    def __init__(self, registry=REGISTRY, interval: float = METRICS_CACHE_SECONDS):
+        self.registry = registry
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._body = b""
+        self._rendered_at: Optional[float] = None
+
+    def render(self) -> bytes:
+        with self._lock:
+            now = time.monotonic()
+            if self._rendered_at is None or now - self._rendered_at >= self.interval:
+                self._body = generate_latest(self.registry)
+                self._rendered_at = now
+            return self._body
+
+
+# ============================================================================
+# Label cardinality
+# ============================================================================
+
+def parse_label_limits(spec: str) -> Dict[str, int]:
+    """Parse "label=limit,label=limit" (LICENSE_METRIC_LABEL_LIMITS)."""
+    limits = {}
+    for part in spec.split(","):
+        if "=" in part:
+            label, limit = part.split("=", 1)
+            limits[label.strip()] = int(limit)
+    return limits
+
+
+class LabelLimiter:
+    """
+    Bounds the distinct values of each label: the first `limit` values seen
+    are kept for the life of the process, later ones become __other__.
+    """
+
+    def __init__(self, default_limit: int = METRIC_LABEL_LIMIT, limits: Optional[Dict[str, int]] = None):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self._seen: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, label: str, value: str) -> str:
+        seen = self._seen.get(label)
+        if seen is not None and value in seen:
+            return value
+        with self._lock:
+            seen = self._seen.setdefault(label, set())
+            if value in seen:
+                return value
+            if len(seen) < self.limits.get(label, self.default_limit):
+                seen.add(value)
+                return value
+        label_overflow_total.labels(label).inc()
+        return OTHER_LABEL
+
+
+label_limiter = LabelLimiter(METRIC_LABEL_LIMIT, parse_label_limits(METRIC_LABEL_LIMITS))
+
+
+class TopKCounter:
+    """
+    Counter exported only for its top `k` keys, in bounded memory.
+
+    Space-Saving: up to 4*k keys are tracked; a new key evicts the smallest
+    and inherits its count, so counts are upper bounds and heavy hitters are
+    never missed. Register with the Prometheus registry as a collector.
+    """
+
+    def __init__(self, name: str, documentation: str, label: str, k: int = METRIC_TOP_USERS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.k = max(1, k)
+        self.capacity = 4 * self.k
+        self._counts: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            if key in self._counts:
+                self._counts[key] += amount
+            elif len(self._counts) < self.capacity:
+                self._counts[key] = amount
+            else:
+                victim = min(self._counts, key=self._counts.__getitem__)
+                self._counts[key] = self._counts.pop(victim) + amount
+
+    def top(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            items = list(self._counts.items())
+        return sorted(items, key=lambda item: item[1], reverse=True)[:self.k]
+
+    def describe(self) -> Iterator[CounterMetricFamily]:
+        return iter([CounterMetricFamily(self.name, self.documentation, labels=[self.label])])
+
+    def collect(self) -> Iterator[CounterMetricFamily]:
+        family = CounterMetricFamily(self.name, self.documentation, labels=[self.label])
+        for key, count in self.top():
+            family.add_metric([key], count)
+        return iter([family])
@@ -1,16 +1,35 @@
 import os
+import queue
 import sqlite3
 import secrets
+import shutil
 import hashlib
+import threading
+import uuid
 from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Iterator, Optional, List
-from passlib.context import CryptContext
-from datetime import datetime
+from typing import Dict, Iterator, Optional, List
+from datetime import datetime, timezone
+
+from . import apikeys
+from . import history
+from . import ledger
+from . import pagination
+from . import passwords
+from . import sharding
+from . import writer
+from .migrations import migrate, table_columns
 
 
 DEFAULT_DB_PATH = "licenses.db"
 
+# Connection pool tuning (overridable via environment)
+DB_POOL_SIZE = int(os.getenv("LICENSE_DB_POOL_SIZE", "8"))
+DB_CACHE_SIZE_KB = int(os.getenv("LICENSE_DB_CACHE_SIZE_KB", "16384"))  # 16 MiB page cache per connection
+DB_MMAP_SIZE = int(os.getenv("LICENSE_DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # 256 MiB memory-mapped I/O
+DB_BUSY_TIMEOUT_MS = int(os.getenv("LICENSE_DB_BUSY_TIMEOUT_MS", "5000"))
+
 
 def get_db_path() -> str:
     env_path = os.getenv("LICENSE_DB_PATH")
@@ -23,18 +42,224 @@ def ensure_parent_dir(path: str) -> None:
         p.parent.mkdir(parents=True, exist_ok=True)
 
 
-@contextmanager
-def get_connection(readonly: bool = False) -> Iterator[sqlite3.Connection]:
-    db_path = get_db_path()
+def _open_connection(db_path: str, readonly: bool) -> sqlite3.Connection:
+    """Open a new tuned SQLite connection (WAL, page cache, mmap I/O)."""
     if db_path != ":memory:":
         ensure_parent_dir(db_path)
     uri = f"file:{db_path}?mode={'ro' if readonly else 'rwc'}"
-    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=DB_BUSY_TIMEOUT_MS / 1000.0)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    if not readonly:
+        # journal_mode is persistent in the file; readers pick it up automatically
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute(f"PRAGMA synchronous={writer.get_durability_profile().synchronous}")
+    cur.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    cur.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.close()
+    return conn
+
+
+class ConnectionPool:
+    """
+    Pool of long-lived SQLite connections for one database file and access mode.
+
+    Connections are handed out LIFO so the hottest (best cached) connection is
+    reused first. When the pool is empty an overflow connection is opened; it
+    is closed again on release if the pool is already full, so callers never
+    block on the pool itself.
+    """
+
+    def __init__(self, db_path: str, readonly: bool, max_size: int = DB_POOL_SIZE):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.max_size = max(1, max_size)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=self.max_size)
+        self.closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _open_connection(self.db_path, self.readonly)
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        # Connections checked out from a closed (e.g. evicted shard) pool are not kept
+        if self.closed:
+            conn.close()
+            return
+        # Never hand a connection with a dangling transaction to the next caller
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                conn.close()
+                return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        self.closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools: Dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str, readonly: bool) -> ConnectionPool:
+    # In-memory databases are per-connection, so reads must share the writer pool
+    if db_path == ":memory:":
+        readonly = False
+    key = (db_path, readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(db_path, readonly)
+                _pools[key] = pool
+    return pool
+
+
+def _open_shard_pool(shard_path: str) -> ConnectionPool:
+    """Pool for a tenant shard; the shard's schema is migrated on first open."""
+    pool = ConnectionPool(shard_path, readonly=False)
+    conn = pool.acquire()
+    try:
+        migrate(conn)
+    finally:
+        pool.release(conn)
+    return pool
+
+
+_shard_router = sharding.ShardRouter(_open_shard_pool)
+
+
+def current_db_path(catalog: bool = False) -> tuple[str, bool]:
+    """
+    Database file for the current context: (path, is_shard).
+
+    With LICENSE_DB_SHARDING=tenant and a tenant in scope, licensing data
+    lives in that tenant's shard; catalog data (tenants, vendors, packages,
+    users, API keys) always lives in the main database. Tenants without a
+    shard yet (see ensure_shard) are served from the main database.
+    """
+    catalog_path = get_db_path()
+    tenant_id = sharding.current_tenant()
+    if catalog or not tenant_id or not sharding.sharding_enabled():
+        return catalog_path, False
+    try:
+        path = sharding.shard_path(catalog_path, tenant_id)
+    except ValueError:
+        return catalog_path, False
+    if _shard_router.is_open(path) or os.path.exists(path):
+        return path, True
+    return catalog_path, False
+
+
+def ensure_shard(tenant_id: str) -> str:
+    """Create (and migrate) a tenant's shard file if needed. Returns its path."""
+    path = sharding.shard_path(get_db_path(), tenant_id)
+    _shard_router.pool_for(path)
+    return path
+
+
+def _pool_for(db_path: str, readonly: bool, shard: bool) -> ConnectionPool:
+    return _shard_router.pool_for(db_path) if shard else get_pool(db_path, readonly)
+
+
+def close_all_connections() -> None:
+    """Stop writer actors and close every pooled connection (used on shutdown)."""
+    writer.stop_all_writers()
+    _shard_router.close_all()
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+class UnitOfWork:
+    """
+    Request-scoped connection holder.
+
+    While a unit of work is active, every get_connection() call in the same
+    context reuses one read-write connection per database file instead of
+    checking a connection in and out of the pool for each helper.
+    """
+
+    def __init__(self):
+        self.connections: Dict[str, sqlite3.Connection] = {}
+        self._pools: Dict[str, ConnectionPool] = {}
+        self.closed = False
+
+    def connection_for(self, db_path: str, shard: bool = False) -> sqlite3.Connection:
+        conn = self.connections.get(db_path)
+        if conn is None:
+            pool = _pool_for(db_path, False, shard)
+            conn = pool.acquire()
+            self.connections[db_path] = conn
+            self._pools[db_path] = pool
+        return conn
+
+    def close(self) -> None:
+        self.closed = True
+        for db_path, conn in self.connections.items():
+            self._pools[db_path].release(conn)
+        self.connections.clear()
+        self._pools.clear()
+
+
+_current_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar("license_db_unit_of_work", default=None)
+
+
+@contextmanager
+def unit_of_work() -> Iterator[UnitOfWork]:
+    """Scope a single pooled connection to the current request/context."""
+    uow = UnitOfWork()
+    token = _current_unit_of_work.set(uow)
+    try:
+        yield uow
+    finally:
+        _current_unit_of_work.reset(token)
+        uow.close()
+
+
+@contextmanager
+def get_connection(readonly: bool = False, catalog: bool = False) -> Iterator[sqlite3.Connection]:
+    """
+    Pooled connection for the current context's database.
+
+    catalog=True always targets the main database (see current_db_path).
+    """
+    db_path, shard = current_db_path(catalog)
+    uow = _current_unit_of_work.get()
+    if uow is not None and not uow.closed:
+        conn = uow.connection_for(db_path, shard)
+        # Helpers nest on the shared connection: only the block that opened a
+        # transaction may discard it
+        outer_transaction = conn.in_transaction
+        try:
+            yield conn
+        finally:
+            # Same semantics as closing a private connection: uncommitted work is discarded
+            if conn.in_transaction and not outer_transaction:
+                conn.rollback()
+        return
+    pool = _pool_for(db_path, readonly, shard)
+    conn = pool.acquire()
     try:
-        conn.row_factory = sqlite3.Row
         yield conn
     finally:
-        conn.close()
+        pool.release(conn)
 
 
 def initialize_database(tools_config: Optional[List[dict]] = None, enable_multitenant: bool = False) -> None:
@@ -43,191 +268,13 @@ def initialize_database(tools_config: Optional[List[dict]] = None, enable_multit
     
     Args:
         tools_config: List of dicts with keys: tool, total, commit_qty, max_overage, commit_price (optional), overage_price_per_license (optional)
-        enable_multitenant: If True, add multi-tenant tables and seed data
+        enable_multitenant: If True, a fresh database gets tenant-keyed licensing tables
     """
     with get_connection(readonly=False) as conn:
+        # Schema changes live in app/migrations.py and are applied once here
+        migrate(conn, enable_multitenant=enable_multitenant)
         cur = conn.cursor()
-        
-        # Multi-tenant tables (if enabled)
-        if enable_multitenant:
-            # Tenants (customers like BMW, Mercedes, Audi)
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS tenants (
-                    tenant_id TEXT PRIMARY KEY,
-                    company_name TEXT NOT NULL,
-                    domain TEXT,
-                    crm_id TEXT UNIQUE,
-                    status TEXT DEFAULT 'active',
-                    created_at TEXT NOT NULL
-                )
-                """
-            )
-            
-            # Vendors (like Vector, Greenhills)
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS vendors (
-                    vendor_id TEXT PRIMARY KEY,
-                    vendor_name TEXT NOT NULL,
-                    contact_email TEXT,
-                    api_key_hash TEXT,
-                    created_at TEXT NOT NULL
-                )
-                """
-            )
-            
-            # License packages (vendor → tenant)
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS license_packages (
-                    package_id TEXT PRIMARY KEY,
-                    tenant_id TEXT NOT NULL,
-                    vendor_id TEXT NOT NULL,
-                    product_id TEXT NOT NULL,
-                    product_name TEXT NOT NULL,
-                    crm_opportunity_id TEXT,
-                    status TEXT DEFAULT 'active',
-                    provisioned_at TEXT NOT NULL,
-                    FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id),
-                    FOREIGN KEY(vendor_id) REFERENCES vendors(vendor_id)
-                )
-                """
-            )
-        
-        # Licenses table (now with tenant_id for multi-tenant mode)
-        if enable_multitenant:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS licenses (
-                    id TEXT PRIMARY KEY,
-                    tenant_id TEXT NOT NULL,
-                    package_id TEXT,
-                    tool TEXT NOT NULL,
-                    total INTEGER NOT NULL,
-                    borrowed INTEGER NOT NULL DEFAULT 0,
-                    commit_qty INTEGER DEFAULT 0,
-                    max_overage INTEGER DEFAULT 0,
-                    commit_price REAL DEFAULT 0.0,
-                    overage_price_per_license REAL DEFAULT 0.0,
-                    FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id),
-                    FOREIGN KEY(package_id) REFERENCES license_packages(package_id),
-                    UNIQUE(tenant_id, tool)
-                )
-                """
-            )
-        else:
-            # Original single-tenant schema
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS licenses (
-                    tool TEXT PRIMARY KEY,
-                    total INTEGER NOT NULL,
-                    borrowed INTEGER NOT NULL DEFAULT 0,
-                    commit_qty INTEGER DEFAULT 0,
-                    max_overage INTEGER DEFAULT 0,
-                    commit_price REAL DEFAULT 0.0,
-                    overage_price_per_license REAL DEFAULT 0.0,
-                    vendor_total INTEGER,
-                    vendor_commit_qty INTEGER,
-                    vendor_max_overage INTEGER,
-                    customer_total INTEGER,
-                    customer_commit_qty INTEGER,
-                    customer_max_overage INTEGER
-                )
-                """
-            )
-        # Borrows table (tenant-aware if multi-tenant)
-        if enable_multitenant:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS borrows (
-                    id TEXT PRIMARY KEY,
-                    tenant_id TEXT NOT NULL,
-                    tool TEXT NOT NULL,
-                    user TEXT NOT NULL,
-                    borrowed_at TEXT NOT NULL,
-                    is_overage INTEGER NOT NULL DEFAULT 0,
-                    FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id)
-                )
-                """
-            )
-        else:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS borrows (
-                    id TEXT PRIMARY KEY,
-                    tool TEXT NOT NULL,
-                    user TEXT NOT NULL,
-                    borrowed_at TEXT NOT NULL,
-                    is_overage INTEGER NOT NULL DEFAULT 0,
-                    FOREIGN KEY(tool) REFERENCES licenses(tool)
-                )
-                """
-            )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                username TEXT PRIMARY KEY,
-                password_hash TEXT NOT NULL
-            )
-            """
-        )
-        # Overage charges table (tenant-aware if multi-tenant)
-        if enable_multitenant:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS overage_charges (
-                    id TEXT PRIMARY KEY,
-                    tenant_id TEXT NOT NULL,
-                    tool TEXT NOT NULL,
-                    borrow_id TEXT NOT NULL,
-                    user TEXT NOT NULL,
-                    charged_at TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id),
-                    FOREIGN KEY(borrow_id) REFERENCES borrows(id)
-                )
-                """
-            )
-        else:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS overage_charges (
-                    id TEXT PRIMARY KEY,
-                    tool TEXT NOT NULL,
-                    borrow_id TEXT NOT NULL,
-                    user TEXT NOT NULL,
-                    charged_at TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    FOREIGN KEY(tool) REFERENCES licenses(tool),
-                    FOREIGN KEY(borrow_id) REFERENCES borrows(id)
-                )
-                """
-            )
-        
-        # API Keys table (for tenant authentication)
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS api_keys (
-                id TEXT PRIMARY KEY,
-                tenant_id TEXT,
-                key_hash TEXT NOT NULL UNIQUE,
-                name TEXT,
-                environment TEXT DEFAULT 'live',
-                created_at TEXT NOT NULL,
-                last_used_at TEXT,
-                expires_at TEXT,
-                status TEXT DEFAULT 'active',
-                scopes TEXT DEFAULT 'borrow,return,status',
-                FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id)
-            )
-            """
-        )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_tenant ON api_keys(tenant_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_status ON api_keys(status)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_hash ON api_keys(key_hash)")
-        
+
         if tools_config:
             for config in tools_config:
                 tool = config["tool"]
@@ -244,132 +291,462 @@ def initialize_database(tools_config: Optional[List[dict]] = None, enable_multit
         # seed demo user if empty
         cur.execute("SELECT COUNT(1) AS c FROM users")
         if int(cur.fetchone()["c"]) == 0:
-            pwd = get_password_context().hash("demo123")
+            pwd = passwords.hash_password("demo123")
             cur.execute("INSERT INTO users(username, password_hash) VALUES (?, ?)", ("demo", pwd))
         conn.commit()
 
 
-def borrow_license(tool: str, user: str, borrow_id: str, borrowed_at_iso: str) -> tuple[bool, bool]:
-    """Returns (success, is_overage)"""
-    with get_connection(False) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT total, borrowed, commit_qty, max_overage, overage_price_per_license FROM licenses WHERE tool = ?", (tool,))
-        row = cur.fetchone()
-        if row is None:
-            return False, False
-        total = int(row["total"])
-        borrowed = int(row["borrowed"])
-        commit = int(row["commit_qty"] or 0)
-        max_overage = int(row["max_overage"] or 0)
-        overage_price = float(row["overage_price_per_license"] or 0.0)
-        
-        # Check if we can borrow
-        if borrowed >= total:
-            return False, False
-        
-        # Check if we're in commit range or overage
-        is_overage = borrowed >= commit
-        if is_overage:
-            # Count current overage
-            current_overage = borrowed - commit
-            if current_overage >= max_overage:
-                return False, False  # Max overage reached
-        
-        cur.execute("UPDATE licenses SET borrowed = borrowed + 1 WHERE tool = ?", (tool,))
-        cur.execute(
-            "INSERT INTO borrows(id, tool, user, borrowed_at, is_overage) VALUES (?, ?, ?, ?, ?)",
-            (borrow_id, tool, user, borrowed_at_iso, 1 if is_overage else 0),
-        )
-        
-        # Record overage charge if this is an overage borrow
-        if is_overage and overage_price > 0:
-            import uuid
-            charge_id = str(uuid.uuid4())
-            cur.execute(
-                "INSERT INTO overage_charges(id, tool, borrow_id, user, charged_at, amount) VALUES (?, ?, ?, ?, ?, ?)",
-                (charge_id, tool, borrow_id, user, borrowed_at_iso, overage_price)
-            )
-        
+@contextmanager
+def immediate_transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Cursor]:
+    """
+    Run a write transaction that takes the RESERVED lock up front (BEGIN IMMEDIATE).
+
+    Taking the write lock before the first read avoids the deferred-transaction
+    lock upgrade, which is where concurrent writers hit SQLITE_BUSY.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        yield cur
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
         conn.commit()
-        return True, is_overage
 
 
-def return_license(borrow_id: str) -> Optional[str]:
+# Capacity check, overage guard, spend cap and increment in one statement. The
+# row only matches when a seat is free and, past the commit quantity, overage
+# is left and this period's ledger amount (for the borrowing tenant) plus one
+# more charge stays within the customer's max spend.
+_BORROW_UPDATE_SQL = """
+    UPDATE licenses
+    SET borrowed = borrowed + 1
+    WHERE tool = ?
+      AND borrowed < total
+      AND (borrowed < COALESCE(commit_qty, 0)
+           OR (borrowed - COALESCE(commit_qty, 0) < COALESCE(max_overage, 0)
+               AND (customer_max_spend IS NULL
+                    OR COALESCE((SELECT amount FROM overage_ledger
+                                 WHERE overage_ledger.tool = licenses.tool
+                                   AND overage_ledger.tenant_id = ?
+                                   AND overage_ledger.period = ?), 0.0)
+                       + COALESCE(overage_price_per_license, 0.0) <= customer_max_spend)))
+    RETURNING borrowed, COALESCE(commit_qty, 0) AS commit_qty, COALESCE(overage_price_per_license, 0.0) AS overage_price
+"""
+
+
+def _borrow_failure_reason(cur: sqlite3.Cursor, tool: str) -> str:
+    """Classify a rejected borrow (must run inside the same write transaction)."""
+    cur.execute("SELECT total, borrowed, commit_qty, max_overage FROM licenses WHERE tool = ?", (tool,))
+    row = cur.fetchone()
+    if row is None:
+        return "unknown_tool"
+    borrowed = int(row["borrowed"])
+    if borrowed >= int(row["total"]):
+        return "exhausted"
+    if borrowed - int(row["commit_qty"] or 0) >= int(row["max_overage"] or 0):
+        return "max_overage"
+    return "max_spend"
+
+
+def _ledger_tenant() -> str:
+    """
+    Tenant whose overage_ledger rows the current context charges and reads.
+
+    A shard holds one tenant's data, so it keeps the default tenant's rows;
+    on the main database it is the tenant in scope (the request's subdomain).
+    Resolved by the caller: in actor write mode the transaction runs on the
+    writer thread, outside the request's context.
+    """
+    tenant_id = sharding.current_tenant()
+    if not tenant_id or current_db_path()[1]:
+        return ledger.DEFAULT_TENANT
+    return tenant_id
+
+
+def _borrow_in_txn(cur: sqlite3.Cursor, tool: str, user: str, borrow_id: str, borrowed_at_iso: str,
+                   expires_at: Optional[str] = None, session_id: Optional[str] = None,
+                   host: Optional[str] = None, tenant_id: str = ledger.DEFAULT_TENANT) -> tuple[bool, bool, Optional[str]]:
+    cur.execute(_BORROW_UPDATE_SQL, (tool, tenant_id, ledger.billing_period(borrowed_at_iso)))
+    row = cur.fetchone()
+    if row is None:
+        return False, False, _borrow_failure_reason(cur, tool)
+    # borrowed is the post-increment value: the new seat is overage if the
+    # previous count had already reached the commit quantity
+    is_overage = int(row["borrowed"]) - 1 >= int(row["commit_qty"])
+    overage_price = float(row["overage_price"])
+
+    cur.execute(
+        "INSERT INTO borrows(id, tool, user, borrowed_at, is_overage, expires_at, session_id, host) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (borrow_id, tool, user, borrowed_at_iso, 1 if is_overage else 0, expires_at, session_id, host),
+    )
+
+    # Record overage charge (and its ledger total) if this is an overage borrow
+    if is_overage and overage_price > 0:
+        ledger.record_overage_charge(cur, tool, borrow_id, user, borrowed_at_iso, overage_price, tenant_id)
+    return True, is_overage, None
+
+
+def _execute_write(fn, *args):
+    """
+    Run fn(cursor, *args) in a write transaction and return its result.
+
+    With LICENSE_DB_WRITE_MODE=actor the call is handed to the database's
+    writer thread and group-committed with other writes; otherwise it runs on
+    this thread inside BEGIN IMMEDIATE.
+    """
+    if writer.WRITE_MODE == "actor":
+        db_path, shard = current_db_path()
+        if shard:
+            # Make sure the shard exists and is migrated before the writer opens it
+            _shard_router.pool_for(db_path)
+        return writer.get_writer(db_path, lambda: _open_connection(db_path, False)).execute(fn, *args)
     with get_connection(False) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT tool FROM borrows WHERE id = ?", (borrow_id,))
-        row = cur.fetchone()
-        if row is None:
-            return None
-        tool = row["tool"]
-        cur.execute("DELETE FROM borrows WHERE id = ?", (borrow_id,))
-        cur.execute("UPDATE licenses SET borrowed = borrowed - 1 WHERE tool = ?", (tool,))
-        conn.commit()
-        return tool
+        with immediate_transaction(conn) as cur:
+            return fn(cur, *args)
+
+
+# Optional in-memory allocation engine (see app/engine.py). When one is
+# registered for the active database, borrow/return/status are served from it.
+_allocation_engine = None
+
+
+def set_allocation_engine(engine) -> None:
+    global _allocation_engine
+    _allocation_engine = engine
+
+
+def _active_engine():
+    engine = _allocation_engine
+    if engine is not None and engine.db_path == current_db_path()[0]:
+        return engine
+    return None
+
+
+@contextmanager
+def _engine_synced(tool: str) -> Iterator[None]:
+    """Checkpoint the engine before a config write and reload the tool afterwards."""
+    engine = _active_engine()
+    if engine is not None:
+        engine.checkpoint()
+    try:
+        yield
+    finally:
+        if engine is not None:
+            engine.reload_tool(tool)
+
+
+def borrow_license(tool: str, user: str, borrow_id: str, borrowed_at_iso: str, expires_at: Optional[str] = None,
+                   session_id: Optional[str] = None, host: Optional[str] = None) -> tuple[bool, bool, Optional[str]]:
+    """
+    Atomically borrow one seat.
+
+    expires_at (ISO-8601 UTC) makes the borrow a lease that the sweeper
+    reclaims unless renewed; session_id/host identify the owner for bulk release.
+
+    Returns (success, is_overage, failure_reason) where failure_reason is one of
+    "unknown_tool", "exhausted", "max_overage" or "max_spend" (None on success).
+    """
+    engine = _active_engine()
+    if engine is not None:
+        return engine.borrow(tool, user, borrow_id, borrowed_at_iso, expires_at, session_id, host)
+    return _execute_write(_borrow_in_txn, tool, user, borrow_id, borrowed_at_iso, expires_at, session_id, host,
+                          _ledger_tenant())
+
+
+def _borrow_with_status_in_txn(cur: sqlite3.Cursor, tool: str, user: str, borrow_id: str, borrowed_at_iso: str,
+                               expires_at: Optional[str], session_id: Optional[str], host: Optional[str],
+                               tenant_id: str) -> dict:
+    ok, is_overage, reason = _borrow_in_txn(cur, tool, user, borrow_id, borrowed_at_iso, expires_at, session_id, host,
+                                            tenant_id)
+    return {"ok": ok, "is_overage": is_overage, "reason": reason, "status": _status_in_txn(cur, tool)}
+
+
+def borrow_license_with_status(tool: str, user: str, borrow_id: str, borrowed_at_iso: str,
+                               expires_at: Optional[str] = None, session_id: Optional[str] = None,
+                               host: Optional[str] = None) -> dict:
+    """
+    borrow_license plus the tool's status as of the same transaction.
+
+    Returns {"ok", "is_overage", "reason", "status"}; status (counts, overage
+    and cost, as get_status) is taken after the borrow, or after the failed
+    attempt, so callers need no follow-up status read. It is None for an
+    unknown tool.
+    """
+    engine = _active_engine()
+    if engine is not None:
+        return engine.borrow_with_status(tool, user, borrow_id, borrowed_at_iso, expires_at, session_id, host)
+    return _execute_write(_borrow_with_status_in_txn, tool, user, borrow_id, borrowed_at_iso, expires_at, session_id, host,
+                          _ledger_tenant())
+
+
+def _return_in_txn(cur: sqlite3.Cursor, borrow_id: str) -> Optional[str]:
+    cur.execute(f"DELETE FROM borrows WHERE id = ? RETURNING {history.BORROW_RETURNING}", (borrow_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    tool = row["tool"]
+    cur.execute("UPDATE licenses SET borrowed = borrowed - 1 WHERE tool = ?", (tool,))
+    history.record_completed(cur, [row], datetime.now(timezone.utc).isoformat(), "returned")
+    return tool
+
+
+def return_license(borrow_id: str) -> Optional[str]:
+    engine = _active_engine()
+    if engine is not None:
+        return engine.return_(borrow_id)
+    return _execute_write(_return_in_txn, borrow_id)
+
+
+def _borrow_batch_in_txn(cur: sqlite3.Cursor, items: List[tuple], borrowed_at_iso: str, all_or_nothing: bool,
+                         expires_at: Optional[str], session_id: Optional[str], host: Optional[str],
+                         tenant_id: str) -> List[dict]:
+    # Savepoint so an all-or-nothing batch can be undone without aborting an enclosing group commit
+    cur.execute("SAVEPOINT borrow_batch")
+    results = []
+    for tool, user, quantity in items:
+        result = {"tool": tool, "user": user, "requested": quantity, "granted": [], "reason": None}
+        results.append(result)
+        for _ in range(quantity):
+            borrow_id = str(uuid.uuid4())
+            ok, is_overage, reason = _borrow_in_txn(cur, tool, user, borrow_id, borrowed_at_iso, expires_at, session_id,
+                                                    host, tenant_id)
+            if not ok:
+                result["reason"] = reason
+                break
+            result["granted"].append({"id": borrow_id, "is_overage": is_overage})
+        if result["reason"] and all_or_nothing:
+            cur.execute("ROLLBACK TO borrow_batch")
+            cur.execute("RELEASE borrow_batch")
+            for r in results:
+                r["granted"] = []
+            return results
+    cur.execute("RELEASE borrow_batch")
+    return results
+
+
+def borrow_licenses_batch(items: List[tuple], borrowed_at_iso: str, all_or_nothing: bool = True,
+                          expires_at: Optional[str] = None, session_id: Optional[str] = None,
+                          host: Optional[str] = None) -> List[dict]:
+    """
+    Borrow seats for many (tool, user, quantity) items in one transaction.
+
+    Returns one dict per item: tool, user, requested, granted (list of
+    {"id", "is_overage"}) and reason (why the item stopped short, else None).
+    Items are granted in order, each up to its quantity. With all_or_nothing
+    the batch stops at the first shortfall and nothing is granted.
+    """
+    engine = _active_engine()
+    if engine is not None:
+        return engine.borrow_many(items, borrowed_at_iso, all_or_nothing, expires_at, session_id, host)
+    return _execute_write(_borrow_batch_in_txn, items, borrowed_at_iso, all_or_nothing, expires_at, session_id, host,
+                          _ledger_tenant())
+
+
+def _return_batch_in_txn(cur: sqlite3.Cursor, borrow_ids: List[str]) -> List[Optional[str]]:
+    return [_return_in_txn(cur, borrow_id) for borrow_id in borrow_ids]
+
+
+def return_licenses_batch(borrow_ids: List[str]) -> List[Optional[str]]:
+    """Return many borrows in one transaction. Returns the tool per id (None if not found)."""
+    engine = _active_engine()
+    if engine is not None:
+        return [engine.return_(borrow_id) for borrow_id in borrow_ids]
+    return _execute_write(_return_batch_in_txn, borrow_ids)
+
+
+# ============================================================================
+# Lease expiry, heartbeats and bulk release
+# ============================================================================
+
+def _release_in_txn(cur: sqlite3.Cursor, where: str, params: tuple, end_reason: str) -> List[tuple]:
+    """Delete the borrows matching where and give their seats back. Returns [(id, tool)]."""
+    cur.execute(f"DELETE FROM borrows WHERE {where} RETURNING {history.BORROW_RETURNING}", params)
+    rows = cur.fetchall()
+    history.record_completed(cur, rows, datetime.now(timezone.utc).isoformat(), end_reason)
+    released = [(row["id"], row["tool"]) for row in rows]
+    per_tool: Dict[str, int] = {}
+    for _, tool in released:
+        per_tool[tool] = per_tool.get(tool, 0) + 1
+    for tool, count in per_tool.items():
+        cur.execute("UPDATE licenses SET borrowed = MAX(borrowed - ?, 0) WHERE tool = ?", (count, tool))
+    return released
+
+
+def _renew_in_txn(cur: sqlite3.Cursor, borrow_ids: List[str], expires_at: str) -> List[str]:
+    renewed = []
+    for borrow_id in borrow_ids:
+        cur.execute("UPDATE borrows SET expires_at = ? WHERE id = ? RETURNING id", (expires_at, borrow_id))
+        if cur.fetchone() is not None:
+            renewed.append(borrow_id)
+    return renewed
+
+
+def renew_leases(borrow_ids: List[str], expires_at: str) -> List[str]:
+    """Heartbeat: push expires_at out for many borrows in one transaction. Returns the ids still held."""
+    engine = _active_engine()
+    if engine is not None:
+        return engine.renew(borrow_ids, expires_at)
+    return _execute_write(_renew_in_txn, borrow_ids, expires_at)
+
+
+def release_session(session_id: Optional[str] = None, host: Optional[str] = None) -> List[tuple]:
+    """Release every borrow held by a session and/or host (e.g. after a crash). Returns [(id, tool)]."""
+    if not session_id and not host:
+        raise ValueError("session_id or host is required")
+    engine = _active_engine()
+    if engine is not None:
+        return engine.release_owner(session_id, host)
+    clauses, params = [], []
+    if session_id:
+        clauses.append("session_id = ?")
+        params.append(session_id)
+    if host:
+        clauses.append("host = ?")
+        params.append(host)
+    return _execute_write(_release_in_txn, " AND ".join(clauses), tuple(params), "released")
+
+
+def sweep_expired_leases(now_iso: str, limit: int = 500) -> List[tuple]:
+    """
+    Reclaim up to limit leases whose expires_at has passed. Returns [(id, tool)].
+
+    Expired rows are found through idx_borrows_expires_at (oldest first), so a
+    sweep costs a short index range scan however many leases are active.
+    """
+    engine = _active_engine()
+    if engine is not None:
+        return engine.sweep(now_iso, limit)
+    return _execute_write(
+        _release_in_txn,
+        "id IN (SELECT id FROM borrows WHERE expires_at IS NOT NULL AND expires_at <= ? ORDER BY expires_at LIMIT ?)",
+        (now_iso, limit),
+        "expired",
+    )
+
+
+def _status_in_txn(cur: sqlite3.Cursor, tool: str) -> Optional[dict]:
+    cur.execute("SELECT total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license FROM licenses WHERE tool = ?", (tool,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    total = int(row["total"])
+    borrowed = int(row["borrowed"])
+    commit = int(row["commit_qty"] or 0)
+    max_overage = int(row["max_overage"] or 0)
+    commit_price = float(row["commit_price"] or 0.0)
+    overage_price = float(row["overage_price_per_license"] or 0.0)
+    available = max(total - borrowed, 0)
+    overage = max(borrowed - commit, 0)
+    
+    # Accumulated overage charges from the ledger (persists even after return)
+    overage_charges_count, _ = ledger.lifetime_totals(cur, tool)
+    current_overage_cost = overage_charges_count * overage_price
+    total_cost = commit_price + current_overage_cost
+    
+    return {
+        "tool": tool,
+        "total": total,
+        "borrowed": borrowed,
+        "available": available,
+        "commit": commit,
+        "max_overage": max_overage,
+        "overage": overage,
+        "overage_borrows": overage_charges_count,
+        "in_commit": borrowed <= commit,
+        "commit_price": commit_price,
+        "overage_price_per_license": overage_price,
+        "current_overage_cost": current_overage_cost,
+        "total_cost": total_cost
+    }
 
 
 def get_status(tool: str) -> Optional[dict]:
+    engine = _active_engine()
+    if engine is not None:
+        return engine.status(tool)
     with get_connection(True) as conn:
+        return _status_in_txn(conn.cursor(), tool)
+
+
+def get_password_hash(username: str) -> Optional[str]:
+    with get_connection(True, catalog=True) as conn:
         cur = conn.cursor()
-        cur.execute("SELECT total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license FROM licenses WHERE tool = ?", (tool,))
+        cur.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
         row = cur.fetchone()
-        if row is None:
-            return None
-        total = int(row["total"])
-        borrowed = int(row["borrowed"])
-        commit = int(row["commit_qty"] or 0)
-        max_overage = int(row["max_overage"] or 0)
-        commit_price = float(row["commit_price"] or 0.0)
-        overage_price = float(row["overage_price_per_license"] or 0.0)
-        available = max(total - borrowed, 0)
-        overage = max(borrowed - commit, 0)
-        
-        # Calculate accumulated overage costs from overage_charges table (persists even after return)
-        cur.execute("SELECT COUNT(*) as cnt FROM overage_charges WHERE tool = ?", (tool,))
-        overage_charges_count = int(cur.fetchone()["cnt"] or 0)
-        current_overage_cost = overage_charges_count * overage_price
-        total_cost = commit_price + current_overage_cost
-        
-        return {
-            "tool": tool,
-            "total": total,
-            "borrowed": borrowed,
-            "available": available,
-            "commit": commit,
-            "max_overage": max_overage,
-            "overage": overage,
-            "overage_borrows": overage_charges_count,
-            "in_commit": borrowed <= commit,
-            "commit_price": commit_price,
-            "overage_price_per_license": overage_price,
-            "current_overage_cost": current_overage_cost,
-            "total_cost": total_cost
-        }
+        return row["password_hash"] if row else None
 
 
-_pwd_context: Optional[CryptContext] = None
+def verify_user_credentials(username: str, password: str) -> bool:
+    """Blocking credential check; async handlers use async_db.verify_user_credentials."""
+    password_hash = get_password_hash(username)
+    if password_hash is None:
+        return False
+    return passwords.verify_password(password, password_hash)
 
 
-def get_password_context() -> CryptContext:
-    global _pwd_context
-    if _pwd_context is None:
-        _pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-    return _pwd_context
+def get_login_user(username: str) -> Optional[dict]:
+    """Session fields for a user (username, tenant_id, vendor_id, role, status)."""
+    with get_connection(True, catalog=True) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT username, tenant_id, vendor_id, role, status FROM users WHERE username = ?",
+            (username,)
+        )
+        row = cur.fetchone()
+        return dict(row) if row else None
 
 
-def verify_user_credentials(username: str, password: str) -> bool:
-    with get_connection(True) as conn:
+def record_user_login(username: str) -> None:
+    with get_connection(False, catalog=True) as conn:
         cur = conn.cursor()
-        cur.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
+        cur.execute(
+            "UPDATE users SET last_login_at = ? WHERE username = ?",
+            (datetime.now(timezone.utc).isoformat(), username)
+        )
+        conn.commit()
+
+
+def get_pending_user_by_setup_token(setup_token: str) -> Optional[dict]:
+    with get_connection(True, catalog=True) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT username, tenant_id, vendor_id, role, status
+            FROM users WHERE setup_token = ? AND status = 'pending_verification'
+            """,
+            (setup_token,)
+        )
         row = cur.fetchone()
-        if row is None:
-            return False
-        return get_password_context().verify(password, row["password_hash"])
+        return dict(row) if row else None
+
+
+def activate_user(username: str, password: str) -> None:
+    """Set the user's password and mark the account active (consumes the setup token)."""
+    activate_user_with_hash(username, passwords.hash_password(password))
+
+
+def activate_user_with_hash(username: str, password_hash: str) -> None:
+    """activate_user with the password already hashed (see passwords.hash_password_async)."""
+    with get_connection(False, catalog=True) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE users
+            SET password_hash = ?, status = 'active', setup_token = NULL
+            WHERE username = ?
+            """,
+            (password_hash, username)
+        )
+        conn.commit()
 
 
 def update_budget_config(tool: str, total: int, commit: int, max_overage: int, commit_price: float, overage_price_per_license: float) -> bool:
     """Update total, commit, max_overage, and prices for a tool"""
-    with get_connection(False) as conn:
+    with _engine_synced(tool), get_connection(False) as conn:
         cur = conn.cursor()
         # Ensure total is at least as much as currently borrowed
         cur.execute("SELECT borrowed FROM licenses WHERE tool = ?", (tool,))
@@ -384,6 +761,51 @@ def update_budget_config(tool: str, total: int, commit: int, max_overage: int, c
         return cur.rowcount > 0
 
 
+def get_all_status() -> List[dict]:
+    """Status for every tool in one query (ledger totals joined per tool)."""
+    engine = _active_engine()
+    if engine is not None:
+        return engine.all_status()
+    with get_connection(True) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT l.tool, l.total, l.borrowed, l.commit_qty, l.max_overage, l.commit_price, l.overage_price_per_license,
+                   COALESCE(lg.charge_count, 0) AS charge_count
+            FROM licenses l
+            LEFT JOIN (
+                SELECT tool, SUM(charge_count) AS charge_count FROM overage_ledger GROUP BY tool
+            ) lg ON lg.tool = l.tool
+            ORDER BY l.tool ASC
+            """
+        )
+        result = []
+        for r in cur.fetchall():
+            total = int(r["total"])
+            borrowed = int(r["borrowed"])
+            commit = int(r["commit_qty"] or 0)
+            commit_price = float(r["commit_price"] or 0.0)
+            overage_price = float(r["overage_price_per_license"] or 0.0)
+            overage_charges_count = int(r["charge_count"])
+            current_overage_cost = overage_charges_count * overage_price
+            result.append({
+                "tool": r["tool"],
+                "total": total,
+                "borrowed": borrowed,
+                "available": max(total - borrowed, 0),
+                "commit": commit,
+                "max_overage": int(r["max_overage"] or 0),
+                "overage": max(borrowed - commit, 0),
+                "overage_borrows": overage_charges_count,
+                "in_commit": borrowed <= commit,
+                "commit_price": commit_price,
+                "overage_price_per_license": overage_price,
+                "current_overage_cost": current_overage_cost,
+                "total_cost": commit_price + current_overage_cost
+            })
+        return result
+
+
 def get_all_tools() -> List[dict]:
     """Get all tools with budget info"""
     with get_connection(True) as conn:
@@ -404,6 +826,31 @@ def get_all_tools() -> List[dict]:
         return result
 
 
+def get_borrows_page(user: Optional[str] = None, limit: int = pagination.DEFAULT_PAGE_SIZE,
+                     cursor: Optional[str] = None, fields: Optional[str] = None) -> tuple[List[dict], Optional[str]]:
+    """Active borrows, newest first, one keyset page at a time. Returns (rows, next_cursor)."""
+    columns = {"id": "id", "tool": "tool", "user": "user", "borrowed_at": "borrowed_at"}
+    where, params = ([], []) if user is None else (["user = ?"], [user])
+    with get_connection(True) as conn:
+        return pagination.fetch_page(conn.cursor(), "borrows", columns, ["borrowed_at", "id"], True,
+                                     where, params, limit, cursor, fields)
+
+
+def get_overage_charges_page(tool: Optional[str] = None, limit: int = pagination.DEFAULT_PAGE_SIZE,
+                             cursor: Optional[str] = None, fields: Optional[str] = None) -> tuple[List[dict], Optional[str]]:
+    """Overage charges, newest first, one keyset page at a time. Returns (rows, next_cursor)."""
+    columns = {"id": "id", "tool": "tool", "borrow_id": "borrow_id", "user": "user",
+               "charged_at": "charged_at", "amount": "amount"}
+    where, params = ([], []) if tool is None else (["tool = ?"], [tool])
+    with get_connection(True) as conn:
+        rows, next_cursor = pagination.fetch_page(conn.cursor(), "overage_charges", columns, ["charged_at", "id"], True,
+                                                  where, params, limit, cursor, fields)
+    for row in rows:
+        if "amount" in row:
+            row["amount"] = float(row["amount"])
+    return rows, next_cursor
+
+
 def get_overage_charges(tool: Optional[str] = None) -> List[dict]:
     """Get all overage charges, optionally filtered by tool"""
     with get_connection(True) as conn:
@@ -433,12 +880,34 @@ def get_overage_charges(tool: Optional[str] = None) -> List[dict]:
 # MULTI-TENANT FUNCTIONS
 # ============================================================================
 
+def _insert_tenant_license(cur: sqlite3.Cursor, tenant_id: str, package_id: str, product_id: str, tool: str,
+                           total: int, commit_qty: int, max_overage: int, commit_price: float,
+                           overage_price: float, or_ignore: bool = False) -> None:
+    """Insert a tenant's license row: into the tenant-keyed table, or the tenant's shard when sharded."""
+    verb = "INSERT OR IGNORE" if or_ignore else "INSERT"
+    if sharding.sharding_enabled():
+        # The shard is the tenant, so it uses the tool-keyed licenses table
+        ensure_shard(tenant_id)
+        with sharding.tenant_scope(tenant_id), get_connection(False) as shard_conn:
+            shard_conn.execute(
+                f"{verb} INTO licenses(tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license) VALUES (?, ?, 0, ?, ?, ?, ?)",
+                (tool, total, commit_qty, max_overage, commit_price, overage_price)
+            )
+            shard_conn.commit()
+        return
+    license_id = f"lic-{tenant_id}-{product_id}-{uuid.uuid4().hex[:8]}"
+    cur.execute(
+        f"{verb} INTO licenses(id, tenant_id, package_id, tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
+        (license_id, tenant_id, package_id, tool, total, commit_qty, max_overage, commit_price, overage_price)
+    )
+
+
 def seed_multitenant_demo_data() -> None:
     """Seed database with demo tenants, vendors, and licenses for demo"""
     from datetime import datetime
     import uuid
     
-    with get_connection(False) as conn:
+    with get_connection(False, catalog=True) as conn:
         cur = conn.cursor()
         now = datetime.utcnow().isoformat()
         
@@ -477,10 +946,9 @@ def seed_multitenant_demo_data() -> None:
                 )
                 
                 # Create license for tenant
-                license_id = f"lic-{tenant['id']}-{product['id']}-{uuid.uuid4().hex[:8]}"
-                cur.execute(
-                    "INSERT OR IGNORE INTO licenses(id, tenant_id, package_id, tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
-                    (license_id, tenant["id"], package_id, product["name"], product["total"], product["commit"], product["overage"], product["commit_price"], product["overage_price"])
+                _insert_tenant_license(
+                    cur, tenant["id"], package_id, product["id"], product["name"], product["total"], product["commit"],
+                    product["overage"], product["commit_price"], product["overage_price"], or_ignore=True
                 )
         
         conn.commit()
@@ -488,16 +956,25 @@ def seed_multitenant_demo_data() -> None:
 
 def get_all_tenants() -> List[dict]:
     """Get all tenants"""
-    with get_connection(True) as conn:
+    with get_connection(True, catalog=True) as conn:
         cur = conn.cursor()
         cur.execute("SELECT tenant_id, company_name, domain, crm_id, status, created_at FROM tenants ORDER BY company_name ASC")
         rows = cur.fetchall()
         return [dict(row) for row in rows]
 
 
+def get_tenants_page(limit: int = pagination.DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                     fields: Optional[str] = None) -> tuple[List[dict], Optional[str]]:
+    """Tenants ordered by company name, one keyset page at a time. Returns (rows, next_cursor)."""
+    columns = {c: c for c in ("tenant_id", "company_name", "domain", "crm_id", "status", "created_at")}
+    with get_connection(True, catalog=True) as conn:
+        return pagination.fetch_page(conn.cursor(), "tenants", columns, ["company_name", "tenant_id"],
+                                     limit=limit, cursor=cursor, fields=fields)
+
+
 def get_vendor_customers(vendor_id: str) -> List[dict]:
     """Get all customers (tenants) for a vendor"""
-    with get_connection(True) as conn:
+    with get_connection(True, catalog=True) as conn:
         cur = conn.cursor()
         cur.execute(
             """
@@ -528,8 +1005,48 @@ def get_vendor_customers(vendor_id: str) -> List[dict]:
         return result
 
 
+def _tenant_license_dict(row, vendor_id: Optional[str], vendor_name: Optional[str], license_id: str) -> dict:
+    return {
+        "id": license_id,
+        "tool": row["tool"],
+        "total": int(row["total"]),
+        "borrowed": int(row["borrowed"]),
+        "commit": int(row["commit_qty"] or 0),
+        "max_overage": int(row["max_overage"] or 0),
+        "available": max(int(row["total"]) - int(row["borrowed"]), 0),
+        "commit_price": float(row["commit_price"] or 0.0),
+        "overage_price_per_license": float(row["overage_price_per_license"] or 0.0),
+        "vendor_id": vendor_id,
+        "vendor_name": vendor_name
+    }
+
+
 def get_tenant_licenses(tenant_id: str) -> List[dict]:
     """Get all licenses for a tenant"""
+    if sharding.sharding_enabled():
+        # Packages/vendors come from the catalog, seat counts from the tenant's shard
+        with get_connection(True, catalog=True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT lp.product_name, lp.vendor_id, v.vendor_name
+                FROM license_packages lp
+                LEFT JOIN vendors v ON lp.vendor_id = v.vendor_id
+                WHERE lp.tenant_id = ?
+                """,
+                (tenant_id,)
+            )
+            vendors = {row["product_name"]: (row["vendor_id"], row["vendor_name"]) for row in cur.fetchall()}
+        with sharding.tenant_scope(tenant_id), get_connection(True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license FROM licenses ORDER BY tool ASC"
+            )
+            return [
+                _tenant_license_dict(row, *vendors.get(row["tool"], (None, None)), license_id=f"{tenant_id}:{row['tool']}")
+                for row in cur.fetchall()
+            ]
+    
     with get_connection(True) as conn:
         cur = conn.cursor()
         cur.execute(
@@ -553,23 +1070,7 @@ def get_tenant_licenses(tenant_id: str) -> List[dict]:
             """,
             (tenant_id,)
         )
-        rows = cur.fetchall()
-        result = []
-        for row in rows:
-            result.append({
-                "id": row["id"],
-                "tool": row["tool"],
-                "total": int(row["total"]),
-                "borrowed": int(row["borrowed"]),
-                "commit": int(row["commit_qty"] or 0),
-                "max_overage": int(row["max_overage"] or 0),
-                "available": max(int(row["total"]) - int(row["borrowed"]), 0),
-                "commit_price": float(row["commit_price"] or 0.0),
-                "overage_price_per_license": float(row["overage_price_per_license"] or 0.0),
-                "vendor_id": row["vendor_id"],
-                "vendor_name": row["vendor_name"]
-            })
-        return result
+        return [_tenant_license_dict(row, row["vendor_id"], row["vendor_name"], row["id"]) for row in cur.fetchall()]
 
 
 def provision_license_to_tenant(vendor_id: str, tenant_id: str, product_config: dict) -> str:
@@ -577,7 +1078,7 @@ def provision_license_to_tenant(vendor_id: str, tenant_id: str, product_config:
     from datetime import datetime
     import uuid
     
-    with get_connection(False) as conn:
+    with get_connection(False, catalog=True) as conn:
         cur = conn.cursor()
         now = datetime.utcnow().isoformat()
         
@@ -589,10 +1090,10 @@ def provision_license_to_tenant(vendor_id: str, tenant_id: str, product_config:
         )
         
         # Create license
-        license_id = f"lic-{tenant_id}-{product_config['product_id']}-{uuid.uuid4().hex[:8]}"
-        cur.execute(
-            "INSERT INTO licenses(id, tenant_id, package_id, tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
-            (license_id, tenant_id, package_id, product_config["product_name"], product_config["total"], product_config["commit_qty"], product_config["max_overage"], product_config.get("commit_price", 1000.0), product_config.get("overage_price_per_license", 100.0))
+        _insert_tenant_license(
+            cur, tenant_id, package_id, product_config["product_id"], product_config["product_name"],
+            product_config["total"], product_config["commit_qty"], product_config["max_overage"],
+            product_config.get("commit_price", 1000.0), product_config.get("overage_price_per_license", 100.0)
         )
         
         conn.commit()
@@ -627,13 +1128,13 @@ def generate_api_key(tenant_id: Optional[str] = None, name: str = "Default Key",
         api_key = f"{environment}_pk_{random_part}"
     
     # Hash the key for storage (never store plaintext!)
-    key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    key_hash = apikeys.hash_key(api_key)
     
     # Create key ID
     key_id = f"key_{secrets.token_hex(8)}"
     
     # Store in database
-    with get_connection(False) as conn:
+    with get_connection(False, catalog=True) as conn:
         cur = conn.cursor()
         now = datetime.utcnow().isoformat()
         
@@ -645,6 +1146,7 @@ def generate_api_key(tenant_id: Optional[str] = None, name: str = "Default Key",
             (key_id, tenant_id, key_hash, name, environment, now)
         )
         conn.commit()
+    apikeys.add_key(key_hash)
     
     return (api_key, key_id)
 
@@ -669,60 +1171,62 @@ def validate_api_key(api_key: str) -> Optional[dict]:
         return None
     
     # Hash the provided key
-    key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    key_hash = apikeys.hash_key(api_key)
+    now = datetime.utcnow().isoformat()
     
-    with get_connection(False) as conn:
-        cur = conn.cursor()
-        now = datetime.utcnow().isoformat()
-        
-        # Find key by hash
-        cur.execute(
-            """
-            SELECT id, tenant_id, environment, status, scopes, expires_at
-            FROM api_keys
-            WHERE key_hash = ? AND status = 'active'
-            """,
-            (key_hash,)
-        )
-        row = cur.fetchone()
-        
-        if not row:
+    details = apikeys.get_cached(key_hash, now)
+    if details is None:
+        # Bogus keys are rejected by the in-memory filter before reaching SQLite
+        if not apikeys.might_exist(key_hash):
             return None
+        with get_connection(True, catalog=True) as conn:
+            cur = conn.cursor()
+            
+            # Find key by hash
+            cur.execute(
+                """
+                SELECT id, tenant_id, environment, status, scopes, expires_at
+                FROM api_keys
+                WHERE key_hash = ? AND status = 'active'
+                """,
+                (key_hash,)
+            )
+            row = cur.fetchone()
         
         # Check expiration
-        if row["expires_at"] and row["expires_at"] < now:
+        if not row or (row["expires_at"] and row["expires_at"] < now):
+            apikeys.remember(key_hash, None)
             return None
         
-        # Update last_used_at
-        cur.execute(
-            "UPDATE api_keys SET last_used_at = ? WHERE id = ?",
-            (now, row["id"])
-        )
-        conn.commit()
-        
-        return {
+        details = {
             "key_id": row["id"],
             "tenant_id": row["tenant_id"],
             "environment": row["environment"],
             "scopes": row["scopes"].split(",") if row["scopes"] else []
         }
+        apikeys.remember(key_hash, details, row["expires_at"])
+    
+    # last_used_at is coalesced in memory and written in batches (apikeys.flush)
+    apikeys.record_use(details["key_id"], now)
+    return dict(details, scopes=list(details["scopes"]))
 
 
 def revoke_api_key(key_id: str) -> bool:
     """Revoke an API key by ID"""
-    with get_connection(False) as conn:
+    with get_connection(False, catalog=True) as conn:
         cur = conn.cursor()
         cur.execute(
             "UPDATE api_keys SET status = 'revoked' WHERE id = ?",
             (key_id,)
         )
         conn.commit()
-        return cur.rowcount > 0
+    apikeys.invalidate(key_id=key_id)
+    return cur.rowcount > 0
 
 
 def list_api_keys(tenant_id: Optional[str] = None) -> List[dict]:
     """List all API keys for a tenant (or all keys if tenant_id is None)"""
-    with get_connection(False) as conn:
+    with get_connection(False, catalog=True) as conn:
         cur = conn.cursor()
         
         if tenant_id:
@@ -748,36 +1252,20 @@ def list_api_keys(tenant_id: Optional[str] = None) -> List[dict]:
         return [dict(row) for row in rows]
 
 
+def list_api_keys_page(tenant_id: Optional[str] = None, limit: int = pagination.DEFAULT_PAGE_SIZE,
+                       cursor: Optional[str] = None, fields: Optional[str] = None) -> tuple[List[dict], Optional[str]]:
+    """API keys, newest first, one keyset page at a time. Returns (rows, next_cursor)."""
+    columns = {c: c for c in ("id", "tenant_id", "name", "environment", "created_at", "last_used_at", "status")}
+    where, params = ([], []) if not tenant_id else (["tenant_id = ?"], [tenant_id])
+    with get_connection(True, catalog=True) as conn:
+        return pagination.fetch_page(conn.cursor(), "api_keys", columns, ["created_at", "id"], True,
+                                     where, params, limit, cursor, fields)
+
+
 # ============================================================================
 # Vendor-Controlled Budget Configuration
 # ============================================================================
 
-def _ensure_vendor_customer_columns(conn) -> None:
-    """Ensure vendor_* and customer_* columns exist on licenses table (for existing DBs)."""
-    cur = conn.cursor()
-    cur.execute("PRAGMA table_info(licenses)")
-    cols = {row[1] for row in cur.fetchall()}
-    to_add = []
-    if "vendor_total" not in cols:
-        to_add.append("ALTER TABLE licenses ADD COLUMN vendor_total INTEGER")
-    if "vendor_commit_qty" not in cols:
-        to_add.append("ALTER TABLE licenses ADD COLUMN vendor_commit_qty INTEGER")
-    if "vendor_max_overage" not in cols:
-        to_add.append("ALTER TABLE licenses ADD COLUMN vendor_max_overage INTEGER")
-    if "customer_total" not in cols:
-        to_add.append("ALTER TABLE licenses ADD COLUMN customer_total INTEGER")
-    if "customer_commit_qty" not in cols:
-        to_add.append("ALTER TABLE licenses ADD COLUMN customer_commit_qty INTEGER")
-    if "customer_max_overage" not in cols:
-        to_add.append("ALTER TABLE licenses ADD COLUMN customer_max_overage INTEGER")
-    if "customer_max_spend" not in cols:
-        to_add.append("ALTER TABLE licenses ADD COLUMN customer_max_spend REAL")
-    for stmt in to_add:
-        cur.execute(stmt)
-    if to_add:
-        conn.commit()
-
-
 def set_vendor_budget(tool: str, total: int, commit_qty: int, max_overage: int) -> bool:
     """
     Vendor sets the maximum budget for a tool.
@@ -792,41 +1280,24 @@ def set_vendor_budget(tool: str, total: int, commit_qty: int, max_overage: int)
     Returns:
         True if successful
     """
-    with get_connection(False) as conn:
+    with _engine_synced(tool), get_connection(False) as conn:
         cur = conn.cursor()
-        # Ensure columns exist for older databases
-        _ensure_vendor_customer_columns(conn)
-        try:
-            # Update vendor limits + active
-            cur.execute(
-                """
-                UPDATE licenses
-                SET vendor_total = ?,
-                    vendor_commit_qty = ?,
-                    vendor_max_overage = ?,
-                    total = ?,
-                    commit_qty = ?,
-                    max_overage = ?
-                WHERE tool = ?
-                """,
-                (total, commit_qty, max_overage, total, commit_qty, max_overage, tool)
-            )
-            conn.commit()
-            return cur.rowcount > 0
-        except Exception:
-            # Fallback for legacy schema: update only active fields
-            cur.execute(
-                """
-                UPDATE licenses
-                SET total = ?,
-                    commit_qty = ?,
-                    max_overage = ?
-                WHERE tool = ?
-                """,
-                (total, commit_qty, max_overage, tool)
-            )
-            conn.commit()
-            return cur.rowcount > 0
+        # Update vendor limits + active
+        cur.execute(
+            """
+            UPDATE licenses
+            SET vendor_total = ?,
+                vendor_commit_qty = ?,
+                vendor_max_overage = ?,
+                total = ?,
+                commit_qty = ?,
+                max_overage = ?
+            WHERE tool = ?
+            """,
+            (total, commit_qty, max_overage, total, commit_qty, max_overage, tool)
+        )
+        conn.commit()
+        return cur.rowcount > 0
 
 
 def set_customer_budget_restrictions(tool: str, total: int = None, commit_qty: int = None, max_overage: int = None) -> tuple[bool, str]:
@@ -842,11 +1313,8 @@ def set_customer_budget_restrictions(tool: str, total: int = None, commit_qty: i
     Returns:
         (success, error_message)
     """
-    with get_connection(False) as conn:
+    with _engine_synced(tool), get_connection(False) as conn:
         cur = conn.cursor()
-        # Ensure columns for older databases
-        _ensure_vendor_customer_columns(conn)
-        
         # Get current vendor limits
         cur.execute(
             "SELECT vendor_total, vendor_commit_qty, vendor_max_overage, borrowed FROM licenses WHERE tool = ?",
@@ -888,32 +1356,19 @@ def set_customer_budget_restrictions(tool: str, total: int = None, commit_qty: i
             max_overage = vendor_overage
         
         # Apply customer restrictions
-        try:
-            cur.execute(
-                """
-                UPDATE licenses
-                SET customer_total = ?,
-                    customer_commit_qty = ?,
-                    customer_max_overage = ?,
-                    total = ?,
-                    commit_qty = ?,
-                    max_overage = ?
-                WHERE tool = ?
-                """,
-                (total, commit_qty, max_overage, total, commit_qty, max_overage, tool)
-            )
-        except Exception:
-            # Legacy schema: update only active fields
-            cur.execute(
-                """
-                UPDATE licenses
-                SET total = ?,
-                    commit_qty = ?,
-                    max_overage = ?
-                WHERE tool = ?
-                """,
-                (total, commit_qty, max_overage, tool)
-            )
+        cur.execute(
+            """
+            UPDATE licenses
+            SET customer_total = ?,
+                customer_commit_qty = ?,
+                customer_max_overage = ?,
+                total = ?,
+                commit_qty = ?,
+                max_overage = ?
+            WHERE tool = ?
+            """,
+            (total, commit_qty, max_overage, total, commit_qty, max_overage, tool)
+        )
         
         conn.commit()
         return True, "Success"
@@ -977,8 +1432,7 @@ def get_budget_config(tool: str) -> Optional[dict]:
 
 def set_customer_max_spend(tool: str, amount: float | None) -> bool:
     """Set the customer's max spend protection for a tool (per current period)."""
-    with get_connection(False) as conn:
-        _ensure_vendor_customer_columns(conn)
+    with _engine_synced(tool), get_connection(False) as conn:
         cur = conn.cursor()
         cur.execute(
             "UPDATE licenses SET customer_max_spend = ? WHERE tool = ?",
@@ -998,25 +1452,49 @@ def get_customer_max_spend(tool: str) -> float | None:
         return row[0] if isinstance(row, tuple) else row["customer_max_spend"]
 
 
+def get_budget_overview() -> List[dict]:
+    """
+    Every tool with its spend protection and month-to-date overage cost, from
+    one query joining licenses to this period's ledger rows (see get_all_tools
+    for the other fields). remaining_spend is None without a max spend.
+    """
+    tenant_id = _ledger_tenant()
+    with get_connection(True) as conn:
+        rows = conn.execute(
+            """
+            SELECT l.tool, l.total, l.borrowed, l.commit_qty, l.max_overage, l.commit_price,
+                   l.overage_price_per_license, l.customer_max_spend, COALESCE(g.amount, 0.0) AS mtd_cost
+            FROM licenses l
+            LEFT JOIN overage_ledger g ON g.tool = l.tool AND g.tenant_id = ? AND g.period = ?
+            ORDER BY l.tool ASC
+            """,
+            (tenant_id, ledger.current_period())
+        ).fetchall()
+    result = []
+    for r in rows:
+        max_spend = r["customer_max_spend"]
+        mtd_cost = float(r["mtd_cost"])
+        result.append({
+            "tool": r["tool"],
+            "total": int(r["total"]),
+            "borrowed": int(r["borrowed"]),
+            "commit": int(r["commit_qty"] or 0),
+            "max_overage": int(r["max_overage"] or 0),
+            "commit_price": float(r["commit_price"] or 0.0),
+            "overage_price_per_license": float(r["overage_price_per_license"] or 0.0),
+            "customer_max_spend": max_spend,
+            "month_to_date_overage_cost": mtd_cost,
+            "remaining_spend": None if max_spend is None else max(0.0, float(max_spend) - mtd_cost),
+        })
+    return result
+
+
 def get_month_to_date_overage_cost(tool: str) -> float:
-    """Approximate month-to-date overage cost using current overage price and count of overage borrows this month."""
-    from datetime import datetime
-    now = datetime.utcnow()
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
+    """Overage amount charged for a tool in the current billing period (the tenant's ledger row)."""
+    tenant_id = _ledger_tenant()
     with get_connection(True) as conn:
-        cur = conn.cursor()
-        # Count overage charges this month
-        try:
-            cur.execute("SELECT COUNT(*) as cnt FROM overage_charges WHERE tool = ? AND created_at >= ?", (tool, month_start))
-            cnt = int(cur.fetchone()[0])
-        except Exception:
-            cur.execute("SELECT COUNT(*) as cnt FROM overage_charges WHERE tool = ?", (tool,))
-            cnt = int(cur.fetchone()[0])
-        # Get current overage price
-        cur.execute("SELECT overage_price_per_license FROM licenses WHERE tool = ?", (tool,))
-        price_row = cur.fetchone()
-        price = float(price_row[0]) if isinstance(price_row, tuple) else float(price_row["overage_price_per_license"])
-        return cnt * price
+        _, amount = ledger.period_totals(conn.cursor(), tool, tenant_id=tenant_id)
+        return amount
 
 
 # ============================================================================
@@ -1047,7 +1525,7 @@ def create_tenant(company_name: str, contact_email: str, tenant_id: Optional[str
     if not tenant_id:
         tenant_id = slugify(company_name)
         # Ensure uniqueness
-        with get_connection(True) as conn:
+        with get_connection(True, catalog=True) as conn:
             cur = conn.cursor()
             base_tenant_id = tenant_id
             counter = 1
@@ -1058,14 +1536,15 @@ def create_tenant(company_name: str, contact_email: str, tenant_id: Optional[str
                 tenant_id = f"{base_tenant_id}-{counter}"
                 counter += 1
     
-    # Ensure multi-tenant tables exist
-    initialize_database(enable_multitenant=True)
+    if sharding.sharding_enabled():
+        # Tenant ids name shard files; reject ones that cannot be routed
+        sharding.shard_path(get_db_path(), tenant_id)
     
     domain = f"{tenant_id}.permetrix.fly.dev"
     setup_token = secrets.token_urlsafe(32)
     now = datetime.utcnow().isoformat()
     
-    with get_connection(readonly=False) as conn:
+    with get_connection(readonly=False, catalog=True) as conn:
         cur = conn.cursor()
         
         # Check if tenant already exists
@@ -1092,37 +1571,6 @@ def create_tenant(company_name: str, contact_email: str, tenant_id: Optional[str
         user_id = f"user_{secrets.token_hex(8)}"
         password_hash = "pending"  # User sets on first login
         
-        # Ensure users table has tenant_id column
-        try:
-            cur.execute("ALTER TABLE users ADD COLUMN tenant_id TEXT")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        try:
-            cur.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'admin'")
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cur.execute("ALTER TABLE users ADD COLUMN status TEXT DEFAULT 'pending_verification'")
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cur.execute("ALTER TABLE users ADD COLUMN setup_token TEXT")
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cur.execute("ALTER TABLE users ADD COLUMN created_at TEXT")
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cur.execute("ALTER TABLE users ADD COLUMN last_login_at TEXT")
-        except sqlite3.OperationalError:
-            pass
-        
         # Create user (using email as username for now, but store user_id)
         cur.execute("""
             INSERT OR REPLACE INTO users (
@@ -1140,17 +1588,15 @@ def create_tenant(company_name: str, contact_email: str, tenant_id: Optional[str
         ))
         
         # Update tenant with admin user
-        try:
-            cur.execute("ALTER TABLE tenants ADD COLUMN admin_user_id TEXT")
-        except sqlite3.OperationalError:
-            pass
-        
         cur.execute("""
             UPDATE tenants SET admin_user_id = ? WHERE tenant_id = ?
         """, (user_id, tenant_id))
         
         conn.commit()
     
+    if sharding.sharding_enabled():
+        ensure_shard(tenant_id)
+    
     return {
         "tenant_id": tenant_id,
         "company_name": company_name,
@@ -1177,7 +1623,7 @@ def create_vendor(vendor_name: str, contact_email: str, vendor_id: Optional[str]
     if not vendor_id:
         vendor_id = slugify(vendor_name)
         # Ensure uniqueness
-        with get_connection(True) as conn:
+        with get_connection(True, catalog=True) as conn:
             cur = conn.cursor()
             base_vendor_id = vendor_id
             counter = 1
@@ -1188,9 +1634,6 @@ def create_vendor(vendor_name: str, contact_email: str, vendor_id: Optional[str]
                 vendor_id = f"{base_vendor_id}-{counter}"
                 counter += 1
     
-    # Ensure multi-tenant tables exist
-    initialize_database(enable_multitenant=True)
-    
     # Generate vendor API key
     random_part = secrets.token_urlsafe(32)
     api_key = f"vnd_live_{random_part}"
@@ -1199,7 +1642,7 @@ def create_vendor(vendor_name: str, contact_email: str, vendor_id: Optional[str]
     setup_token = secrets.token_urlsafe(32)
     now = datetime.utcnow().isoformat()
     
-    with get_connection(readonly=False) as conn:
+    with get_connection(readonly=False, catalog=True) as conn:
         cur = conn.cursor()
         
         # Check if vendor already exists
@@ -1207,17 +1650,6 @@ def create_vendor(vendor_name: str, contact_email: str, vendor_id: Optional[str]
         if cur.fetchone():
             raise ValueError(f"Vendor {vendor_id} already exists")
         
-        # Ensure vendors table has required columns
-        try:
-            cur.execute("ALTER TABLE vendors ADD COLUMN status TEXT DEFAULT 'active'")
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cur.execute("ALTER TABLE vendors ADD COLUMN admin_user_id TEXT")
-        except sqlite3.OperationalError:
-            pass
-        
         # Create vendor
         cur.execute("""
             INSERT INTO vendors (
@@ -1237,12 +1669,6 @@ def create_vendor(vendor_name: str, contact_email: str, vendor_id: Optional[str]
         user_id = f"vendor_user_{secrets.token_hex(8)}"
         password_hash = "pending"
         
-        # Ensure users table has vendor_id column
-        try:
-            cur.execute("ALTER TABLE users ADD COLUMN vendor_id TEXT")
-        except sqlite3.OperationalError:
-            pass
-        
         # Create vendor user
         cur.execute("""
             INSERT OR REPLACE INTO users (
@@ -1281,8 +1707,7 @@ def create_vendor(vendor_name: str, contact_email: str, vendor_id: Optional[str]
 
 def get_all_vendors() -> List[dict]:
     """Get all vendors"""
-    initialize_database(enable_multitenant=True)
-    with get_connection(True) as conn:
+    with get_connection(True, catalog=True) as conn:
         cur = conn.cursor()
         try:
             cur.execute("""
@@ -1300,6 +1725,98 @@ def get_all_vendors() -> List[dict]:
             return []
 
 
+def get_vendors_page(limit: int = pagination.DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                     fields: Optional[str] = None) -> tuple[List[dict], Optional[str]]:
+    """Vendors ordered by name, one keyset page at a time. Returns (rows, next_cursor)."""
+    columns = {
+        "vendor_id": "v.vendor_id",
+        "vendor_name": "v.vendor_name",
+        "contact_email": "v.contact_email",
+        "status": "v.status",
+        "created_at": "v.created_at",
+        "admin_email": "u.username",
+    }
+    with get_connection(True, catalog=True) as conn:
+        try:
+            return pagination.fetch_page(conn.cursor(), "vendors v LEFT JOIN users u ON v.admin_user_id = u.username",
+                                         columns, ["vendor_name", "vendor_id"], limit=limit, cursor=cursor, fields=fields)
+        except sqlite3.OperationalError:
+            # Table doesn't exist yet
+            return [], None
+
+
+def _license_counts(catalog: bool = False) -> tuple[int, int]:
+    """(licenses, active borrows) in the current context's database."""
+    with get_connection(True, catalog=catalog) as conn:
+        row = conn.execute("SELECT (SELECT COUNT(*) FROM licenses), (SELECT COUNT(*) FROM borrows)").fetchone()
+        return int(row[0]), int(row[1])
+
+
+def get_platform_stats() -> dict:
+    """Tenant, vendor and license counts for the admin dashboard (fans out across shards)."""
+    with get_connection(True, catalog=True) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT
+                (SELECT COUNT(*) FROM tenants) AS total_tenants,
+                (SELECT COUNT(*) FROM tenants WHERE status = 'active') AS active_tenants,
+                (SELECT COUNT(*) FROM vendors) AS total_vendors,
+                (SELECT COUNT(*) FROM vendors WHERE status = 'active') AS active_vendors
+            """
+        )
+        row = cur.fetchone()
+    total_licenses, active_borrows = _license_counts(catalog=True)
+    if sharding.sharding_enabled():
+        shard_counts = sharding.fan_out(_license_counts, sharding.list_shard_tenants(get_db_path()))
+        total_licenses += sum(c[0] for c in shard_counts.values())
+        active_borrows += sum(c[1] for c in shard_counts.values())
+    return {
+        "tenants": {
+            "total": row["total_tenants"],
+            "active": row["active_tenants"]
+        },
+        "vendors": {
+            "total": row["total_vendors"],
+            "active": row["active_vendors"]
+        },
+        "licenses": {
+            "total_provisioned": total_licenses,
+            "active_borrows": active_borrows
+        }
+    }
+
+
+def drop_tenant_shard(tenant_id: str) -> None:
+    """Close and delete a tenant's shard and its archived history."""
+    shard_db = sharding.shard_path(get_db_path(), tenant_id)
+    _shard_router.drop(shard_db)
+    shutil.rmtree(history.archive_dir(shard_db), ignore_errors=True)
+
+
+def count_tenant_borrows(tenant_id: str, cur: Optional[sqlite3.Cursor] = None) -> int:
+    """
+    Active borrows held by a tenant (in its shard, or tenant-keyed rows in the main database).
+
+    Pass the cursor of a main-database transaction to count its rows inside that transaction.
+    """
+    active_borrows = 0
+    if sharding.sharding_enabled() and os.path.exists(sharding.shard_path(get_db_path(), tenant_id)):
+        with sharding.tenant_scope(tenant_id), get_connection(True) as shard_conn:
+            active_borrows += shard_conn.execute("SELECT COUNT(*) FROM borrows").fetchone()[0]
+    if cur is not None:
+        return active_borrows + _count_main_tenant_borrows(cur, tenant_id)
+    with get_connection(True, catalog=True) as conn:
+        return active_borrows + _count_main_tenant_borrows(conn.cursor(), tenant_id)
+
+
+def _count_main_tenant_borrows(cur: sqlite3.Cursor, tenant_id: str) -> int:
+    if "tenant_id" not in table_columns(cur, "borrows"):
+        return 0  # tool-keyed borrows table (single-tenant mode)
+    cur.execute("SELECT COUNT(*) FROM borrows WHERE tenant_id = ?", (tenant_id,))
+    return cur.fetchone()[0]
+
+
 def delete_tenant(tenant_id: str, hard_delete: bool = False) -> dict:
     """
     Delete a tenant (customer).
@@ -1311,9 +1828,7 @@ def delete_tenant(tenant_id: str, hard_delete: bool = False) -> dict:
     Returns:
         dict with deletion status
     """
-    initialize_database(enable_multitenant=True)
-    
-    with get_connection(readonly=False) as conn:
+    with get_connection(readonly=False, catalog=True) as conn:
         cur = conn.cursor()
         
         # Check if tenant exists
@@ -1328,18 +1843,15 @@ def delete_tenant(tenant_id: str, hard_delete: bool = False) -> dict:
             # Hard delete: Remove all related data
             
             # Check for active borrows
-            try:
-                cur.execute("SELECT COUNT(*) FROM borrows WHERE tenant_id = ?", (tenant_id,))
-                active_borrows = cur.fetchone()[0]
-                if active_borrows > 0:
-                    raise ValueError(f"Cannot delete tenant with {active_borrows} active borrows. Return licenses first.")
-            except sqlite3.OperationalError:
-                pass  # Table might not exist in single-tenant mode
+            active_borrows = count_tenant_borrows(tenant_id, cur)
+            if active_borrows > 0:
+                raise ValueError(f"Cannot delete tenant with {active_borrows} active borrows. Return licenses first.")
             
             # Delete in order (respecting foreign keys)
-            # 1. Overage charges
+            # 1. Overage charges and their ledger totals
             try:
                 cur.execute("DELETE FROM overage_charges WHERE tenant_id = ?", (tenant_id,))
+                cur.execute("DELETE FROM overage_ledger WHERE tenant_id = ?", (tenant_id,))
             except sqlite3.OperationalError:
                 pass
             
@@ -1378,6 +1890,11 @@ def delete_tenant(tenant_id: str, hard_delete: bool = False) -> dict:
             
             conn.commit()
             
+            # 8. Tenant shard (licenses, borrows and charges live there when sharded)
+            if sharding.sharding_enabled():
+                drop_tenant_shard(tenant_id)
+            apikeys.invalidate(tenant_id=tenant_id)
+            
             return {
                 "tenant_id": tenant_id,
                 "company_name": company_name,
@@ -1414,9 +1931,7 @@ def delete_vendor(vendor_id: str, hard_delete: bool = False) -> dict:
     Returns:
         dict with deletion status
     """
-    initialize_database(enable_multitenant=True)
-    
-    with get_connection(readonly=False) as conn:
+    with get_connection(readonly=False, catalog=True) as conn:
         cur = conn.cursor()
         
         # Check if vendor exists
@@ -0,0 +1,534 @@
+"""
+In-memory allocation engine with a write-behind journal (optional).
+
+Enable with LICENSE_ENGINE=memory. Per-tool capacity counters and the active
+lease map live in memory behind striped locks, so borrow/return decisions
+never touch SQLite. Every mutation is appended to a journal file
+(``<db>.journal``) that a background thread writes and fsyncs in batches.
+A second thread periodically rotates the journal and checkpoints it into the
+``licenses``/``borrows``/``overage_charges``/``lease_history`` tables. On
+startup any journal left behind by a crash is replayed into SQLite before
+state is loaded.
+
+Journal records carry a monotonically increasing sequence number and the
+last checkpointed sequence is stored in ``engine_state`` in the same
+transaction as the checkpoint, so replay applies every record exactly once.
+
+Reads that are not served from memory (e.g. GET /borrows) see SQLite, which
+lags the engine by at most one checkpoint interval.
+"""
+
+import heapq
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from . import db
+from . import history
+from . import ledger
+
+logger = logging.getLogger("license-server")
+
+ENGINE_MODE = os.getenv("LICENSE_ENGINE", "sqlite").lower()
+ENGINE_LOCK_STRIPES = int(os.getenv("LICENSE_ENGINE_LOCK_STRIPES", "16"))
+ENGINE_FSYNC_INTERVAL_MS = int(os.getenv("LICENSE_ENGINE_FSYNC_INTERVAL_MS", "5"))
+ENGINE_CHECKPOINT_SECONDS = float(os.getenv("LICENSE_ENGINE_CHECKPOINT_SECONDS", "2"))
+
+
+class ToolState:
+    __slots__ = ("tool", "total", "borrowed", "commit", "max_overage", "commit_price", "overage_price",
+                 "max_spend", "lifetime_charges", "period", "period_amount")
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.total = 0
+        self.borrowed = 0
+        self.commit = 0
+        self.max_overage = 0
+        self.commit_price = 0.0
+        self.overage_price = 0.0
+        self.max_spend: Optional[float] = None
+        self.lifetime_charges = 0
+        self.period = ""
+        self.period_amount = 0.0
+
+    def snapshot(self) -> dict:
+        overage = max(self.borrowed - self.commit, 0)
+        current_overage_cost = self.lifetime_charges * self.overage_price
+        return {
+            "tool": self.tool,
+            "total": self.total,
+            "borrowed": self.borrowed,
+            "available": max(self.total - self.borrowed, 0),
+            "commit": self.commit,
+            "max_overage": self.max_overage,
+            "overage": overage,
+            "overage_borrows": self.lifetime_charges,
+            "in_commit": self.borrowed <= self.commit,
+            "commit_price": self.commit_price,
+            "overage_price_per_license": self.overage_price,
+            "current_overage_cost": current_overage_cost,
+            "total_cost": self.commit_price + current_overage_cost
+        }
+
+
+class Lease:
+    __slots__ = ("id", "tool", "user", "borrowed_at", "is_overage", "expires_at", "session_id", "host")
+
+    def __init__(self, lease_id: str, tool: str, user: str, borrowed_at: str, is_overage: bool,
+                 expires_at: Optional[str] = None, session_id: Optional[str] = None, host: Optional[str] = None):
+        self.id = lease_id
+        self.tool = tool
+        self.user = user
+        self.borrowed_at = borrowed_at
+        self.is_overage = is_overage
+        self.expires_at = expires_at
+        self.session_id = session_id
+        self.host = host
+
+
+class AllocationEngine:
+    """Authoritative in-memory allocation state for one database file."""
+
+    def __init__(self, db_path: str, stripes: int = ENGINE_LOCK_STRIPES,
+                 fsync_interval_ms: int = ENGINE_FSYNC_INTERVAL_MS,
+                 checkpoint_seconds: float = ENGINE_CHECKPOINT_SECONDS):
+        self.db_path = db_path
+        self.journal_path = f"{db_path}.journal"
+        self._locks = [threading.Lock() for _ in range(max(1, stripes))]
+        self._tools: Dict[str, ToolState] = {}
+        self._leases: Dict[str, Lease] = {}
+        # Min-heap of (expires_at, lease id); stale entries are skipped on pop
+        self._expiry_heap: List[tuple] = []
+        self._heap_lock = threading.Lock()
+        self._fsync_interval = fsync_interval_ms / 1000.0
+        self._checkpoint_seconds = checkpoint_seconds
+
+        # Journal: records are sequenced and queued under _pending_lock; the
+        # flusher writes/fsyncs them under _file_lock
+        self._seq = 0
+        self._pending: List[str] = []
+        self._pending_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._journal = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        self._seq = self._replay_journals()
+        self._load_state()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        for target, name in ((self._flush_loop, "engine-journal-flusher"), (self._checkpoint_loop, "engine-checkpointer")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("allocation engine started db=%s tools=%d leases=%d seq=%d",
+                    self.db_path, len(self._tools), len(self._leases), self._seq)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads.clear()
+        self.checkpoint()
+        with self._file_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        logger.info("allocation engine stopped db=%s seq=%d", self.db_path, self._seq)
+
+    def _load_state(self) -> None:
+        period = ledger.current_period()
+        with db.get_connection(True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license, customer_max_spend FROM licenses"
+            )
+            for row in cur.fetchall():
+                state = ToolState(row["tool"])
+                self._apply_config(state, row)
+                state.lifetime_charges, _ = ledger.lifetime_totals(cur, state.tool)
+                state.period = period
+                _, state.period_amount = ledger.period_totals(cur, state.tool, period)
+                self._tools[state.tool] = state
+            cur.execute("SELECT id, tool, user, borrowed_at, is_overage, expires_at, session_id, host FROM borrows")
+            for row in cur.fetchall():
+                self._leases[row["id"]] = Lease(row["id"], row["tool"], row["user"], row["borrowed_at"], bool(row["is_overage"]),
+                                                row["expires_at"], row["session_id"], row["host"])
+                if row["expires_at"]:
+                    self._expiry_heap.append((row["expires_at"], row["id"]))
+        heapq.heapify(self._expiry_heap)
+        # Capacity counters follow the lease map, not the (possibly stale) column
+        for state in self._tools.values():
+            state.borrowed = 0
+        for lease in self._leases.values():
+            state = self._tools.get(lease.tool)
+            if state is not None:
+                state.borrowed += 1
+
+    @staticmethod
+    def _apply_config(state: ToolState, row) -> None:
+        state.total = int(row["total"])
+        state.borrowed = int(row["borrowed"])
+        state.commit = int(row["commit_qty"] or 0)
+        state.max_overage = int(row["max_overage"] or 0)
+        state.commit_price = float(row["commit_price"] or 0.0)
+        state.overage_price = float(row["overage_price_per_license"] or 0.0)
+        state.max_spend = row["customer_max_spend"]
+
+    def reload_tool(self, tool: str) -> None:
+        """Refresh capacity/pricing after a budget change (borrowed stays authoritative in memory)."""
+        with db.get_connection(True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license, customer_max_spend FROM licenses WHERE tool = ?",
+                (tool,)
+            )
+            row = cur.fetchone()
+        with self._lock_for(tool):
+            if row is None:
+                self._tools.pop(tool, None)
+                return
+            state = self._tools.get(tool)
+            if state is None:
+                state = ToolState(tool)
+                self._apply_config(state, row)
+                state.borrowed = 0
+                state.period = ledger.current_period()
+                self._tools[tool] = state
+                return
+            borrowed = state.borrowed
+            self._apply_config(state, row)
+            state.borrowed = borrowed
+
+    # ------------------------------------------------------------------
+    # Allocation
+    # ------------------------------------------------------------------
+
+    def _lock_for(self, tool: str) -> threading.Lock:
+        return self._locks[hash(tool) % len(self._locks)]
+
+    def _reserve(self, tool: str, user: str, borrow_id: str, borrowed_at_iso: str, expires_at: Optional[str] = None,
+                 session_id: Optional[str] = None, host: Optional[str] = None) -> tuple[bool, bool, Optional[str], Optional[list]]:
+        """Apply one borrow to memory (caller holds the tool's lock). Returns the journal record on success."""
+        state = self._tools.get(tool)
+        if state is None:
+            return False, False, "unknown_tool", None
+        if state.borrowed >= state.total:
+            return False, False, "exhausted", None
+        is_overage = state.borrowed >= state.commit
+        charge = 0.0
+        if is_overage:
+            if state.borrowed - state.commit >= state.max_overage:
+                return False, False, "max_overage", None
+            period = ledger.billing_period(borrowed_at_iso)
+            if state.period != period:
+                state.period = period
+                state.period_amount = 0.0
+            if state.max_spend is not None and state.period_amount + state.overage_price > float(state.max_spend):
+                return False, False, "max_spend", None
+            if state.overage_price > 0:
+                charge = state.overage_price
+                state.period_amount += charge
+                state.lifetime_charges += 1
+        state.borrowed += 1
+        self._leases[borrow_id] = Lease(borrow_id, tool, user, borrowed_at_iso, is_overage, expires_at, session_id, host)
+        if expires_at:
+            self._push_expiry(expires_at, borrow_id)
+        return True, is_overage, None, ["B", borrow_id, tool, user, borrowed_at_iso, 1 if is_overage else 0, charge,
+                                        expires_at, session_id, host]
+
+    def _unreserve(self, record: list) -> None:
+        borrow_id, tool, charge = record[1], record[2], record[6]
+        self._leases.pop(borrow_id, None)
+        state = self._tools[tool]
+        state.borrowed -= 1
+        if charge:
+            state.period_amount -= charge
+            state.lifetime_charges -= 1
+
+    def borrow(self, tool: str, user: str, borrow_id: str, borrowed_at_iso: str, expires_at: Optional[str] = None,
+               session_id: Optional[str] = None, host: Optional[str] = None) -> tuple[bool, bool, Optional[str]]:
+        with self._lock_for(tool):
+            ok, is_overage, reason, record = self._reserve(tool, user, borrow_id, borrowed_at_iso, expires_at, session_id, host)
+            if ok:
+                self._journal_append(record)
+        return ok, is_overage, reason
+
+    def borrow_with_status(self, tool: str, user: str, borrow_id: str, borrowed_at_iso: str,
+                           expires_at: Optional[str] = None, session_id: Optional[str] = None,
+                           host: Optional[str] = None) -> dict:
+        """borrow() plus the tool snapshot taken under the same lock (see db.borrow_license_with_status)."""
+        with self._lock_for(tool):
+            ok, is_overage, reason, record = self._reserve(tool, user, borrow_id, borrowed_at_iso, expires_at, session_id, host)
+            if ok:
+                self._journal_append(record)
+            state = self._tools.get(tool)
+            status = state.snapshot() if state is not None else None
+        return {"ok": ok, "is_overage": is_overage, "reason": reason, "status": status}
+
+    def borrow_many(self, items: List[tuple], borrowed_at_iso: str, all_or_nothing: bool = True,
+                    expires_at: Optional[str] = None, session_id: Optional[str] = None,
+                    host: Optional[str] = None) -> List[dict]:
+        """Batch borrow with the same result shape as db.borrow_licenses_batch."""
+        stripes = sorted({hash(tool) % len(self._locks) for tool, _, _ in items})
+        for i in stripes:
+            self._locks[i].acquire()
+        try:
+            results, records = [], []
+            for tool, user, quantity in items:
+                result = {"tool": tool, "user": user, "requested": quantity, "granted": [], "reason": None}
+                results.append(result)
+                for _ in range(quantity):
+                    borrow_id = str(uuid.uuid4())
+                    ok, is_overage, reason, record = self._reserve(tool, user, borrow_id, borrowed_at_iso, expires_at, session_id, host)
+                    if not ok:
+                        result["reason"] = reason
+                        break
+                    result["granted"].append({"id": borrow_id, "is_overage": is_overage})
+                    records.append(record)
+                if result["reason"] and all_or_nothing:
+                    for record in reversed(records):
+                        self._unreserve(record)
+                    for r in results:
+                        r["granted"] = []
+                    return results
+            for record in records:
+                self._journal_append(record)
+            return results
+        finally:
+            for i in reversed(stripes):
+                self._locks[i].release()
+
+    def return_(self, borrow_id: str, end_reason: str = "returned") -> Optional[str]:
+        lease = self._leases.get(borrow_id)
+        if lease is None:
+            return None
+        with self._lock_for(lease.tool):
+            # Re-check under the lock: a concurrent return may have won
+            if self._leases.pop(borrow_id, None) is None:
+                return None
+            state = self._tools.get(lease.tool)
+            if state is not None:
+                state.borrowed = max(state.borrowed - 1, 0)
+            self._journal_append(["R", borrow_id, datetime.now(timezone.utc).isoformat(), end_reason])
+        return lease.tool
+
+    # ------------------------------------------------------------------
+    # Lease expiry
+    # ------------------------------------------------------------------
+
+    def _push_expiry(self, expires_at: str, borrow_id: str) -> None:
+        with self._heap_lock:
+            heapq.heappush(self._expiry_heap, (expires_at, borrow_id))
+
+    def renew(self, borrow_ids: List[str], expires_at: str) -> List[str]:
+        renewed = []
+        for borrow_id in borrow_ids:
+            lease = self._leases.get(borrow_id)
+            if lease is None:
+                continue
+            with self._lock_for(lease.tool):
+                if borrow_id not in self._leases:
+                    continue
+                lease.expires_at = expires_at
+                self._push_expiry(expires_at, borrow_id)
+                self._journal_append(["H", borrow_id, expires_at])
+            renewed.append(borrow_id)
+        return renewed
+
+    def sweep(self, now_iso: str, limit: int = 500) -> List[tuple]:
+        """Return leases whose expiry has passed, oldest first. Returns [(id, tool)]."""
+        released = []
+        while len(released) < limit:
+            with self._heap_lock:
+                if not self._expiry_heap or self._expiry_heap[0][0] > now_iso:
+                    break
+                expires_at, borrow_id = heapq.heappop(self._expiry_heap)
+            lease = self._leases.get(borrow_id)
+            # Entry is stale if the lease was returned or renewed since it was pushed
+            if lease is None or lease.expires_at != expires_at:
+                continue
+            tool = self.return_(borrow_id, "expired")
+            if tool is not None:
+                released.append((borrow_id, tool))
+        return released
+
+    def release_owner(self, session_id: Optional[str] = None, host: Optional[str] = None) -> List[tuple]:
+        matches = [
+            lease.id for lease in list(self._leases.values())
+            if (not session_id or lease.session_id == session_id) and (not host or lease.host == host)
+        ]
+        released = []
+        for borrow_id in matches:
+            tool = self.return_(borrow_id, "released")
+            if tool is not None:
+                released.append((borrow_id, tool))
+        return released
+
+    def status(self, tool: str) -> Optional[dict]:
+        state = self._tools.get(tool)
+        return state.snapshot() if state is not None else None
+
+    def all_status(self) -> List[dict]:
+        return [self._tools[t].snapshot() for t in sorted(self._tools)]
+
+    # ------------------------------------------------------------------
+    # Journal
+    # ------------------------------------------------------------------
+
+    def _journal_append(self, record: list) -> None:
+        with self._pending_lock:
+            self._seq += 1
+            self._pending.append(json.dumps([self._seq] + record, separators=(",", ":")))
+        self._wakeup.set()
+
+    def _write_pending(self) -> None:
+        """Write and fsync queued records (caller holds _file_lock)."""
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if not batch or self._journal is None:
+            return
+        self._journal.write("\n".join(batch) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _flush_loop(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # Let concurrent appends pile up so one fsync covers the batch
+            self._stopping.wait(self._fsync_interval)
+            with self._file_lock:
+                self._write_pending()
+        with self._file_lock:
+            self._write_pending()
+
+    def _checkpoint_loop(self) -> None:
+        while not self._stopping.wait(self._checkpoint_seconds):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                logger.error("allocation engine checkpoint failed: %s", e)
+
+    def checkpoint(self) -> None:
+        """Rotate the journal and apply the rotated segment to SQLite."""
+        with self._checkpoint_lock:
+            segment = f"{self.journal_path}.ckpt"
+            with self._file_lock:
+                self._write_pending()
+                if self._journal is not None and self._journal.tell() > 0:
+                    self._journal.close()
+                    os.replace(self.journal_path, segment)
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+            if os.path.exists(segment):
+                self._apply_segment(segment)
+                os.remove(segment)
+
+    def _replay_journals(self) -> int:
+        """Apply journals left by a previous process. Returns the last sequence number."""
+        for path in (f"{self.journal_path}.ckpt", self.journal_path):
+            if os.path.exists(path):
+                self._apply_segment(path)
+                os.remove(path)
+        with db.get_connection(True) as conn:
+            return _applied_seq(conn.cursor())
+
+    def _apply_segment(self, path: str) -> None:
+        records = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Torn write at the tail of a crashed journal
+                    logger.warning("allocation engine skipped corrupt journal line in %s", path)
+        if records:
+            apply_records(records)
+
+
+def _applied_seq(cur) -> int:
+    cur.execute("SELECT value FROM engine_state WHERE key = 'journal_seq'")
+    row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def apply_records(records: List[list]) -> int:
+    """Apply journal records to SQLite exactly once. Returns the number applied."""
+    with db.get_connection(False) as conn:
+        with db.immediate_transaction(conn) as cur:
+            last = _applied_seq(cur)
+            touched = set()
+            applied = 0
+            for record in records:
+                seq, kind = record[0], record[1]
+                if seq <= last:
+                    continue
+                if kind == "B":
+                    borrow_id, tool, user, borrowed_at, is_overage, charge = record[2:8]
+                    expires_at, session_id, host = (record[8:11] + [None, None, None])[:3]
+                    cur.execute(
+                        "INSERT OR IGNORE INTO borrows(id, tool, user, borrowed_at, is_overage, expires_at, session_id, host) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (borrow_id, tool, user, borrowed_at, is_overage, expires_at, session_id, host)
+                    )
+                    if charge:
+                        ledger.record_overage_charge(cur, tool, borrow_id, user, borrowed_at, charge)
+                    touched.add(tool)
+                elif kind == "H":
+                    cur.execute("UPDATE borrows SET expires_at = ? WHERE id = ?", (record[3], record[2]))
+                elif kind == "R":
+                    borrow_id, returned_at = record[2], record[3]
+                    end_reason = record[4] if len(record) > 4 else "returned"
+                    cur.execute(f"DELETE FROM borrows WHERE id = ? RETURNING {history.BORROW_RETURNING}", (borrow_id,))
+                    row = cur.fetchone()
+                    if row is not None:
+                        touched.add(row["tool"])
+                        history.record_completed(cur, [row], returned_at, end_reason)
+                last = seq
+                applied += 1
+            for tool in touched:
+                cur.execute(
+                    "UPDATE licenses SET borrowed = (SELECT COUNT(*) FROM borrows WHERE borrows.tool = licenses.tool) WHERE tool = ?",
+                    (tool,)
+                )
+            cur.execute(
+                "INSERT INTO engine_state(key, value) VALUES ('journal_seq', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (str(last),)
+            )
+    return applied
+
+
+_engine: Optional[AllocationEngine] = None
+
+
+def start_engine(db_path: Optional[str] = None) -> AllocationEngine:
+    """Start the engine for a database and route db.borrow_license/return_license/get_status to it."""
+    global _engine
+    engine = AllocationEngine(db_path or db.get_db_path())
+    engine.start()
+    _engine = engine
+    db.set_allocation_engine(engine)
+    return engine
+
+
+def stop_engine() -> None:
+    global _engine
+    if _engine is None:
+        return
+    db.set_allocation_engine(None)
+    _engine.stop()
+    _engine = None
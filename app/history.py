@@ -0,0 +1,250 @@
+"""
+Completed-lease history and the compressed cold tier.
+
+Returning a borrow deletes its ``borrows`` row and, in the same transaction,
+appends the completed lease (duration and why it ended) to the append-only
+``lease_history`` table. History is partitioned by the month the lease
+ended, so a month's partition stops growing once the month is over.
+
+``compact_closed_periods`` moves closed months of ``lease_history`` and
+``overage_charges`` out of the hot database into gzip-compressed NDJSON files
+(one per table/month/part under LICENSE_ARCHIVE_DIR, default
+``<db stem>.archive``) listed in ``archive_partitions``. The live tables stay
+small for the allocation path; per-period overage totals remain in the
+ledger, and ``iter_rows`` reads cold partitions and hot rows alike.
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import db
+from . import ledger
+from . import sharding
+
+logger = logging.getLogger("license-server")
+
+# Columns returned by DELETE FROM borrows ... RETURNING for record_completed()
+BORROW_RETURNING = "id, tool, user, borrowed_at, is_overage, session_id, host"
+
+HISTORY_COLUMNS = ("id", "period", "tool", "user", "borrowed_at", "returned_at", "duration_seconds",
+                   "is_overage", "end_reason", "session_id", "host")
+CHARGE_COLUMNS = ("id", "tenant_id", "tool", "borrow_id", "user", "charged_at", "amount")
+
+ARCHIVED_TABLES: Dict[str, Tuple[str, ...]] = {
+    "lease_history": HISTORY_COLUMNS,
+    "overage_charges": CHARGE_COLUMNS,
+}
+
+_compact_lock = threading.Lock()
+
+
+def lease_duration(borrowed_at: str, returned_at: str) -> Optional[float]:
+    try:
+        delta = datetime.fromisoformat(returned_at) - datetime.fromisoformat(borrowed_at)
+    except (TypeError, ValueError):
+        return None
+    return max(delta.total_seconds(), 0.0)
+
+
+def record_completed(cur, rows: list, returned_at: str, end_reason: str) -> None:
+    """
+    Append completed leases to lease_history.
+
+    rows are borrows rows (BORROW_RETURNING columns) just deleted in this
+    transaction; end_reason is "returned", "expired" or "released".
+    """
+    if not rows:
+        return
+    period = ledger.billing_period(returned_at)
+    cur.executemany(
+        """
+        INSERT OR IGNORE INTO lease_history(id, period, tool, user, borrowed_at, returned_at, duration_seconds,
+                                            is_overage, end_reason, session_id, host)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (r["id"], period, r["tool"], r["user"], r["borrowed_at"], returned_at,
+             lease_duration(r["borrowed_at"], returned_at), r["is_overage"], end_reason,
+             r["session_id"], r["host"])
+            for r in rows
+        ],
+    )
+
+
+# ============================================================================
+# Cold tier
+# ============================================================================
+
+def archive_dir(db_path: str) -> str:
+    root, _ = os.path.splitext(db_path)
+    env_dir = os.getenv("LICENSE_ARCHIVE_DIR")
+    if env_dir:
+        return os.path.join(env_dir, os.path.basename(root))
+    return f"{root}.archive"
+
+
+def _next_period(period: str) -> str:
+    year, month = int(period[:4]), int(period[5:7])
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+
+
+def _period_range_sql(table: str, period_from: Optional[str], period_to: Optional[str]) -> Tuple[str, list]:
+    """WHERE clause selecting periods period_from..period_to (inclusive) of a table."""
+    clauses, params = [], []
+    if table == "lease_history":
+        if period_from:
+            clauses.append("period >= ?")
+            params.append(period_from)
+        if period_to:
+            clauses.append("period <= ?")
+            params.append(period_to)
+    else:
+        # overage_charges has no period column; range-scan charged_at instead
+        if period_from:
+            clauses.append("charged_at >= ?")
+            params.append(period_from)
+        if period_to:
+            clauses.append("charged_at < ?")
+            params.append(_next_period(period_to))
+    return (" AND ".join(clauses) or "1"), params
+
+
+def _closed_periods(table: str, before: str) -> List[str]:
+    if table == "lease_history":
+        sql = "SELECT DISTINCT period FROM lease_history WHERE period < ? ORDER BY 1"
+    else:
+        sql = "SELECT DISTINCT substr(charged_at, 1, 7) FROM overage_charges WHERE charged_at < ? ORDER BY 1"
+    with db.get_connection(True) as conn:
+        return [row[0] for row in conn.execute(sql, (before,)).fetchall()]
+
+
+def _write_cold_file(path: str, columns: Tuple[str, ...], cur) -> Tuple[int, int]:
+    """Stream cursor rows into a gzip NDJSON file atomically. Returns (rows, max rowid)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    count, max_rowid = 0, 0
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            while True:
+                rows = cur.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    max_rowid = max(max_rowid, row[0])
+                    gz.write((json.dumps(dict(zip(columns, tuple(row)[1:])), separators=(",", ":")) + "\n").encode("utf-8"))
+                count += len(rows)
+        raw.flush()
+        os.fsync(raw.fileno())
+    if count == 0:
+        os.remove(tmp)
+    else:
+        os.replace(tmp, path)
+    return count, max_rowid
+
+
+def compact_partition(table: str, period: str) -> int:
+    """
+    Move one closed month of table from the hot database into a cold file.
+
+    The file is written from a read snapshot without holding the write lock;
+    only rows up to the highest rowid written are then deleted, so rows that
+    land late (e.g. an engine checkpoint after month end) stay hot and go
+    into the next part. Returns the number of rows archived.
+    """
+    columns = ARCHIVED_TABLES[table]
+    db_path = db.current_db_path()[0]
+    where, params = _period_range_sql(table, period, period)
+    with _compact_lock:
+        with db.get_connection(True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT COUNT(*) FROM archive_partitions WHERE table_name = ? AND period = ?", (table, period)
+            )
+            part = int(cur.fetchone()[0])
+            relpath = os.path.join(table, f"{period}.{part}.ndjson.gz")
+            cur.execute(f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE {where} ORDER BY rowid", params)
+            count, max_rowid = _write_cold_file(os.path.join(archive_dir(db_path), relpath), columns, cur)
+        if count == 0:
+            return 0
+        with db.get_connection(False) as conn:
+            with db.immediate_transaction(conn) as cur:
+                cur.execute(f"DELETE FROM {table} WHERE {where} AND rowid <= ?", params + [max_rowid])
+                cur.execute(
+                    "INSERT INTO archive_partitions(table_name, period, part, path, row_count, archived_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (table, period, part, relpath, count, datetime.now(timezone.utc).isoformat())
+                )
+    logger.info("archived table=%s period=%s part=%d rows=%d db=%s", table, period, part, count, db_path)
+    return count
+
+
+def _compact_current_db(before: str) -> List[dict]:
+    archived = []
+    for table in ARCHIVED_TABLES:
+        for period in _closed_periods(table, before):
+            rows = compact_partition(table, period)
+            if rows:
+                archived.append({"table": table, "period": period, "rows": rows})
+    return archived
+
+
+def compact_closed_periods(before: Optional[str] = None) -> List[dict]:
+    """
+    Archive every month before `before` (YYYY-MM, default: the current month)
+    in the main database and, when sharding is enabled, every tenant shard.
+    """
+    before = before or ledger.current_period()
+    archived = _compact_current_db(before)
+    if sharding.sharding_enabled():
+        per_shard = sharding.fan_out(lambda: _compact_current_db(before), sharding.list_shard_tenants(db.get_db_path()))
+        for tenant_id, entries in per_shard.items():
+            archived.extend(dict(entry, tenant_id=tenant_id) for entry in entries)
+    return archived
+
+
+def cold_partitions(table: str, period_from: Optional[str] = None, period_to: Optional[str] = None) -> List[str]:
+    """Paths of the cold files holding periods period_from..period_to (inclusive), oldest first."""
+    root = archive_dir(db.current_db_path()[0])
+    with db.get_connection(True) as conn:
+        rows = conn.execute(
+            "SELECT path FROM archive_partitions WHERE table_name = ? AND period >= ? AND period <= ? ORDER BY period, part",
+            (table, period_from or "", period_to or "9999-12"),
+        ).fetchall()
+    return [os.path.join(root, row["path"]) for row in rows]
+
+
+def iter_cold_file(path: str) -> Iterator[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_rows(table: str, period_from: Optional[str] = None, period_to: Optional[str] = None,
+              tool: Optional[str] = None) -> Iterator[dict]:
+    """
+    Rows of an archived table for periods period_from..period_to (inclusive),
+    cold partitions first (oldest period first), then the hot table.
+    """
+    columns = ARCHIVED_TABLES[table]
+    for path in cold_partitions(table, period_from, period_to):
+        for record in iter_cold_file(path):
+            if tool is None or record["tool"] == tool:
+                yield record
+
+    where, params = _period_range_sql(table, period_from, period_to)
+    if tool is not None:
+        where += " AND tool = ?"
+        params.append(tool)
+    with db.get_connection(True) as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {where} ORDER BY rowid", params)
+        while True:
+            rows = cur.fetchmany(1000)
+            if not rows:
+                break
+            for r in rows:
+                yield dict(r)
@@ -0,0 +1,228 @@
+"""
+Background jobs: chunked, resumable hard deletes of tenants and vendors.
+
+A hard delete used to remove every related row in one write transaction,
+holding SQLite's write lock (and, from an async handler, the event loop) for
+as long as the biggest tenant took. Now the admin API validates the request,
+records a job in the ``jobs`` table and returns 202. A single worker thread
+deletes each related table in chunks of LICENSE_DELETE_CHUNK_ROWS, one short
+transaction per chunk that also records the job's progress, pausing
+LICENSE_DELETE_CHUNK_PAUSE_MS between chunks so other writers get the lock.
+
+Every step is idempotent (``DELETE ... WHERE tenant_id = ?``), so jobs left
+queued or running by a crash are simply resumed from their recorded step on
+startup.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from . import apikeys
+from . import db
+from . import sharding
+from .migrations import table_columns, table_exists
+
+logger = logging.getLogger("license-server")
+
+DELETE_CHUNK_ROWS = int(os.getenv("LICENSE_DELETE_CHUNK_ROWS", "500"))
+DELETE_CHUNK_PAUSE_MS = float(os.getenv("LICENSE_DELETE_CHUNK_PAUSE_MS", "5"))
+
+# (table, column) deleted in order for each kind of job; the entity row itself goes last
+DELETE_STEPS: Dict[str, List[Tuple[str, str]]] = {
+    "delete_tenant": [
+        ("overage_charges", "tenant_id"),
+        ("overage_ledger", "tenant_id"),
+        ("borrows", "tenant_id"),
+        ("licenses", "tenant_id"),
+        ("license_packages", "tenant_id"),
+        ("api_keys", "tenant_id"),
+        ("users", "tenant_id"),
+        ("tenants", "tenant_id"),
+    ],
+    "delete_vendor": [
+        ("license_packages", "vendor_id"),
+        ("users", "vendor_id"),
+        ("vendors", "vendor_id"),
+    ],
+}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    with db.get_connection(True, catalog=True) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+
+def _prepare_tenant_delete(cur: sqlite3.Cursor, tenant_id: str) -> None:
+    cur.execute("SELECT status FROM tenants WHERE tenant_id = ?", (tenant_id,))
+    if cur.fetchone() is None:
+        raise ValueError(f"Tenant {tenant_id} not found")
+    # Main-database borrows are counted inside this IMMEDIATE transaction, so none can
+    # be added between the check and the 'deleting' mark
+    active_borrows = db.count_tenant_borrows(tenant_id, cur)
+    if active_borrows > 0:
+        raise ValueError(f"Cannot delete tenant with {active_borrows} active borrows. Return licenses first.")
+    # Hide the tenant while its rows are being removed
+    cur.execute("UPDATE tenants SET status = 'deleting' WHERE tenant_id = ?", (tenant_id,))
+
+
+def _prepare_vendor_delete(cur: sqlite3.Cursor, vendor_id: str) -> None:
+    cur.execute("SELECT vendor_id FROM vendors WHERE vendor_id = ?", (vendor_id,))
+    if cur.fetchone() is None:
+        raise ValueError(f"Vendor {vendor_id} not found")
+    cur.execute("SELECT COUNT(*) FROM license_packages WHERE vendor_id = ?", (vendor_id,))
+    active_packages = cur.fetchone()[0]
+    if active_packages > 0:
+        raise ValueError(f"Cannot delete vendor with {active_packages} active license packages. Remove packages first.")
+    cur.execute("UPDATE vendors SET status = 'deleting' WHERE vendor_id = ?", (vendor_id,))
+
+
+def submit_hard_delete(kind: str, target_id: str) -> dict:
+    """
+    Validate a hard delete, record it as a queued job and hand it to the worker.
+
+    Raises:
+        ValueError: unknown target, or it still has active borrows/packages
+    """
+    if kind not in DELETE_STEPS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = f"job_{uuid.uuid4().hex[:12]}"
+    now = _now()
+    with db.get_connection(False, catalog=True) as conn:
+        with db.immediate_transaction(conn) as cur:
+            if kind == "delete_tenant":
+                _prepare_tenant_delete(cur, target_id)
+            else:
+                _prepare_vendor_delete(cur, target_id)
+            cur.execute(
+                "INSERT INTO jobs(job_id, kind, target_id, status, step, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, target_id, DELETE_STEPS[kind][0][0], now, now)
+            )
+    get_runner().enqueue(job_id)
+    logger.info("job queued job_id=%s kind=%s target=%s", job_id, kind, target_id)
+    return get_job(job_id)
+
+
+class JobRunner:
+    """Single worker thread running queued jobs one at a time."""
+
+    def __init__(self):
+        self._queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, job_id: str) -> None:
+        self._queue.put(job_id)
+
+    def stop(self) -> None:
+        """Stop after the current chunk; an unfinished job resumes on next startup."""
+        self._stopping.set()
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            try:
+                self.run_job(job_id)
+            except Exception as e:
+                logger.error("job failed job_id=%s: %s", job_id, e)
+                self._set_status(job_id, "failed", error=str(e))
+
+    @staticmethod
+    def _set_status(job_id: str, status: str, error: Optional[str] = None) -> None:
+        now = _now()
+        finished = now if status in ("succeeded", "failed") else None
+        with db.get_connection(False, catalog=True) as conn:
+            with db.immediate_transaction(conn) as cur:
+                cur.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ?, finished_at = ? WHERE job_id = ?",
+                    (status, error, now, finished, job_id)
+                )
+
+    def run_job(self, job_id: str) -> None:
+        job = get_job(job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        self._set_status(job_id, "running")
+        steps = DELETE_STEPS[job["kind"]]
+        names = [table for table, _ in steps]
+        start = names.index(job["step"]) if job["step"] in names else 0
+        for table, column in steps[start:]:
+            if not self._delete_table(job_id, table, column, job["target_id"]):
+                return  # stopping; resumed on next startup
+        if job["kind"] == "delete_tenant":
+            if sharding.sharding_enabled():
+                db.drop_tenant_shard(job["target_id"])
+            apikeys.invalidate(tenant_id=job["target_id"])
+        self._set_status(job_id, "succeeded")
+        logger.info("job finished job_id=%s kind=%s target=%s", job_id, job["kind"], job["target_id"])
+
+    def _delete_table(self, job_id: str, table: str, column: str, target_id: str) -> bool:
+        """Delete target rows from table chunk by chunk. Returns False if interrupted by stop()."""
+        with db.get_connection(True, catalog=True) as conn:
+            cur = conn.cursor()
+            if not table_exists(cur, table) or column not in table_columns(cur, table):
+                return True  # e.g. tool-keyed licensing tables have no tenant_id
+        while True:
+            with db.get_connection(False, catalog=True) as conn:
+                with db.immediate_transaction(conn) as cur:
+                    cur.execute(
+                        f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {column} = ? LIMIT ?)",
+                        (target_id, DELETE_CHUNK_ROWS)
+                    )
+                    deleted = cur.rowcount
+                    cur.execute(
+                        "UPDATE jobs SET step = ?, rows_deleted = rows_deleted + ?, updated_at = ? WHERE job_id = ?",
+                        (table, deleted, _now(), job_id)
+                    )
+            if deleted < DELETE_CHUNK_ROWS:
+                return True
+            if self._stopping.wait(DELETE_CHUNK_PAUSE_MS / 1000.0):
+                return False
+
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> JobRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
+
+
+def resume_jobs() -> int:
+    """Re-queue jobs a previous process left queued or running. Returns how many."""
+    with db.get_connection(True, catalog=True) as conn:
+        rows = conn.execute(
+            "SELECT job_id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+    for row in rows:
+        get_runner().enqueue(row["job_id"])
+    if rows:
+        logger.info("resuming %d background job(s)", len(rows))
+    return len(rows)
+
+
+def stop_runner() -> None:
+    global _runner
+    with _runner_lock:
+        runner, _runner = _runner, None
+    if runner is not None:
+        runner.stop()
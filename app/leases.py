@@ -0,0 +1,98 @@
+"""
+Lease expiry for borrows.
+
+A borrow made with a TTL (request ttl_seconds, or LICENSE_LEASE_TTL_SECONDS
+as the default) carries an ``expires_at``. Clients renew many leases at once
+via POST /licenses/heartbeat. A background sweeper returns expired leases so
+seats held by crashed tools are reclaimed without manual returns.
+
+The sweeper pulls expired rows through the partial index on
+borrows(expires_at) (or the in-memory engine's min-heap), oldest first and
+in bounded batches, so each pass is cheap however many leases are active.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from prometheus_client import Counter
+
+from . import collectors
+from . import db
+from . import sharding
+
+logger = logging.getLogger("license-server")
+
+LEASE_TTL_SECONDS = int(os.getenv("LICENSE_LEASE_TTL_SECONDS", "0"))  # 0 = borrows never expire
+LEASE_MAX_TTL_SECONDS = int(os.getenv("LICENSE_LEASE_MAX_TTL_SECONDS", "86400"))
+LEASE_SWEEP_SECONDS = float(os.getenv("LICENSE_LEASE_SWEEP_SECONDS", "5"))
+LEASE_SWEEP_BATCH = int(os.getenv("LICENSE_LEASE_SWEEP_BATCH", "500"))
+
+leases_expired_total = Counter(
+    "license_leases_expired_total",
+    "Leases reclaimed by the expiry sweeper",
+    ["tool"],
+)
+
+
+def lease_expiry(now: datetime, ttl_seconds: Optional[int] = None) -> Optional[str]:
+    """expires_at for a lease starting now (None when no TTL applies)."""
+    ttl = LEASE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    if ttl <= 0:
+        return None
+    return (now + timedelta(seconds=min(ttl, LEASE_MAX_TTL_SECONDS))).isoformat()
+
+
+class LeaseSweeper:
+    """Background thread that periodically reclaims expired leases."""
+
+    def __init__(self, interval: float = LEASE_SWEEP_SECONDS, batch: int = LEASE_SWEEP_BATCH,
+                 on_release: Optional[Callable[[str, str], None]] = None):
+        self.interval = interval
+        self.batch = max(1, batch)
+        self.on_release = on_release
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="lease-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            try:
+                self.sweep_once()
+            except Exception as e:
+                logger.error("lease sweep failed: %s", e)
+
+    def _sweep_current_db(self) -> List[tuple]:
+        now = datetime.now(timezone.utc).isoformat()
+        released: List[tuple] = []
+        while True:
+            chunk = db.sweep_expired_leases(now, self.batch)
+            released.extend(chunk)
+            if len(chunk) < self.batch:
+                return released
+
+    def sweep_once(self) -> int:
+        """Reclaim every lease expired as of now (main database and tenant shards)."""
+        released = self._sweep_current_db()
+        if sharding.sharding_enabled():
+            per_shard = sharding.fan_out(self._sweep_current_db, sharding.list_shard_tenants(db.get_db_path()))
+            for chunk in per_shard.values():
+                released.extend(chunk)
+        for borrow_id, tool in released:
+            leases_expired_total.labels(collectors.label_limiter("tool", tool)).inc()
+            if self.on_release is not None:
+                self.on_release(borrow_id, tool)
+        if released:
+            logger.info("lease sweeper reclaimed=%d", len(released))
+        return len(released)
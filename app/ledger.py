@@ -0,0 +1,81 @@
+"""
+Overage ledger: running per-(tenant, tool, billing period) charge totals.
+
+Every overage charge is inserted into ``overage_charges`` and, in the same
+transaction, folded into one ``overage_ledger`` row. Status pages, the budget
+page and max-spend enforcement read that row instead of counting charges.
+
+Rows are keyed by the borrowing tenant on the main database (db passes the
+tenant in scope), so tenants sharing a tool-keyed licenses table each get
+their own period total and spend cap. Shards hold a single tenant and use
+DEFAULT_TENANT, as does the in-memory engine (app/engine.py), which keeps
+one running total per tool for its database.
+
+The helpers here take a cursor so callers control the transaction.
+"""
+
+import sqlite3
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+# Single-tenant databases (and callers without tenant context) use the empty tenant
+DEFAULT_TENANT = ""
+
+
+def billing_period(timestamp_iso: str) -> str:
+    """Billing period (calendar month, YYYY-MM) for an ISO-8601 UTC timestamp."""
+    return timestamp_iso[:7]
+
+
+def current_period() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+
+def record_overage_charge(cur: sqlite3.Cursor, tool: str, borrow_id: str, user: str, charged_at: str,
+                          amount: float, tenant_id: Optional[str] = None) -> str:
+    """Insert an overage charge (tagged with its tenant) and bump its ledger row. Returns the charge id."""
+    charge_id = str(uuid.uuid4())
+    cur.execute(
+        "INSERT INTO overage_charges(id, tenant_id, tool, borrow_id, user, charged_at, amount) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (charge_id, tenant_id or DEFAULT_TENANT, tool, borrow_id, user, charged_at, amount)
+    )
+    add_to_ledger(cur, tool, billing_period(charged_at), 1, amount, tenant_id)
+    return charge_id
+
+
+def add_to_ledger(cur: sqlite3.Cursor, tool: str, period: str, count: int, amount: float,
+                  tenant_id: Optional[str] = None) -> None:
+    cur.execute(
+        """
+        INSERT INTO overage_ledger(tool, tenant_id, period, charge_count, amount)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(tool, tenant_id, period) DO UPDATE SET
+            charge_count = charge_count + excluded.charge_count,
+            amount = amount + excluded.amount
+        """,
+        (tool, tenant_id or DEFAULT_TENANT, period, count, amount)
+    )
+
+
+def period_totals(cur: sqlite3.Cursor, tool: str, period: Optional[str] = None,
+                  tenant_id: Optional[str] = None) -> Tuple[int, float]:
+    """(charge_count, amount) for one tool in one billing period (default: current)."""
+    cur.execute(
+        "SELECT charge_count, amount FROM overage_ledger WHERE tool = ? AND tenant_id = ? AND period = ?",
+        (tool, tenant_id or DEFAULT_TENANT, period or current_period())
+    )
+    row = cur.fetchone()
+    if row is None:
+        return 0, 0.0
+    return int(row[0]), float(row[1])
+
+
+def lifetime_totals(cur: sqlite3.Cursor, tool: str) -> Tuple[int, float]:
+    """(charge_count, amount) for one tool across all tenants and periods."""
+    cur.execute(
+        "SELECT COALESCE(SUM(charge_count), 0), COALESCE(SUM(amount), 0.0) FROM overage_ledger WHERE tool = ?",
+        (tool,)
+    )
+    row = cur.fetchone()
+    return int(row[0]), float(row[1])
@@ -0,0 +1,247 @@
+"""
+Asynchronous, sampled logging for the license-server logger.
+
+Request handlers only enqueue records: a ``QueueHandler`` on the logger puts
+them on a bounded queue and a background ``QueueListener`` formats them and
+fans out to the console and /logs buffer handlers. A full queue drops the
+record (counted) rather than blocking a request.
+
+Before enqueueing, ``SamplingFilter`` thins routine traffic:
+
+- records logged with ``extra={"routine": True}`` (per-request access lines,
+  borrow/return successes) are kept with probability LICENSE_LOG_SAMPLE_RATE;
+- INFO and below are rate limited per logger (token bucket of
+  LICENSE_LOG_RATE_PER_SECOND);
+- warnings and errors, and request lines whose status is >= 400 or that took
+  at least LICENSE_LOG_SLOW_MS, are always kept (tail-based keep).
+
+``LogBuffer`` keeps the last entries for the /logs endpoint. Each entry gets
+a monotonic sequence number and is stored pre-rendered, so a scraper
+polling ``/logs?after=<seq>`` receives only lines it has not seen, at a
+cost proportional to the new lines rather than to the buffer.
+"""
+
+import collections
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter
+
+LOG_ASYNC = os.getenv("LICENSE_LOG_ASYNC", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LICENSE_LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LICENSE_LOG_SAMPLE_RATE", "0.1"))
+LOG_RATE_PER_SECOND = float(os.getenv("LICENSE_LOG_RATE_PER_SECOND", "100"))  # 0 = unlimited
+LOG_SLOW_MS = float(os.getenv("LICENSE_LOG_SLOW_MS", "500"))
+
+log_records_dropped_total = Counter(
+    "license_log_records_dropped_total",
+    "Log records not emitted by the logging pipeline",
+    ["reason"],  # sampled, rate_limited, queue_full
+)
+
+
+class _TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate * 2, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class SamplingFilter(logging.Filter):
+    """Sampling of routine lines and per-logger rate limiting, with tail-based keep."""
+
+    def __init__(self, sample_rate: float = LOG_SAMPLE_RATE, rate_per_second: float = LOG_RATE_PER_SECOND,
+                 slow_ms: float = LOG_SLOW_MS):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate_per_second = rate_per_second
+        self.slow_ms = slow_ms
+        self._buckets: Dict[str, _TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _always_keep(self, record: logging.LogRecord) -> bool:
+        return (
+            record.levelno >= logging.WARNING
+            or getattr(record, "status_code", 0) >= 400
+            or getattr(record, "duration_ms", 0.0) >= self.slow_ms
+        )
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self._always_keep(record):
+            return True
+        if getattr(record, "routine", False) and random.random() >= self.sample_rate:
+            log_records_dropped_total.labels(reason="sampled").inc()
+            return False
+        if self.rate_per_second > 0:
+            with self._lock:
+                bucket = self._buckets.get(record.name)
+                if bucket is None:
+                    bucket = self._buckets[record.name] = _TokenBucket(self.rate_per_second)
+                allowed = bucket.take()
+            if not allowed:
+                log_records_dropped_total.labels(reason="rate_limited").inc()
+                return False
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue records without formatting them and without ever blocking.
+
+    The stock QueueHandler formats the message on the caller's thread; here
+    that is left to the listener (records with exception info are still
+    prepared eagerly, since tracebacks are not safe to format later).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped_total.labels(reason="queue_full").inc()
+
+
+def start_pipeline(logger: logging.Logger, handlers: List[logging.Handler]) -> Optional[logging.handlers.QueueListener]:
+    """
+    Route logger's records to handlers through the sampling filter and, unless
+    LICENSE_LOG_ASYNC=false, a background listener. Returns the listener.
+    """
+    sampling = SamplingFilter()
+    if not LOG_ASYNC:
+        for handler in handlers:
+            handler.addFilter(sampling)
+            logger.addHandler(handler)
+        return None
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(sampling)
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def resume_pipeline(listener: Optional[logging.handlers.QueueListener]) -> None:
+    """Restart a listener stopped by stop_pipeline (app restarted in the same process)."""
+    if listener is not None and listener._thread is None:
+        listener.start()
+
+
+def stop_pipeline(listener: Optional[logging.handlers.QueueListener]) -> None:
+    """Flush queued records and stop the listener thread."""
+    if listener is not None and listener._thread is not None:
+        listener.stop()
+
+
+# ============================================================================
+# /logs ring buffer
+# ============================================================================
+
+class LogEntry:
+    """One buffered log line, rendered once when it is recorded."""
+
+    __slots__ = ("seq", "timestamp", "level", "name", "message", "request_id", "trace_id", "line")
+
+    def __init__(self, seq: int, record: logging.LogRecord):
+        self.seq = seq
+        self.timestamp = datetime.fromtimestamp(record.created, timezone.utc).isoformat()
+        self.level = record.levelname
+        self.name = record.name
+        self.message = record.getMessage()
+        self.request_id = getattr(record, "request_id", None)
+        self.trace_id = getattr(record, "trace_id", None)
+        # Format: timestamp level name message [request_id=...] [trace_id=...]
+        line = f"{self.timestamp} {self.level} {self.name} {self.message}"
+        if self.request_id:
+            line += f" request_id={self.request_id}"
+        if self.trace_id:
+            line += f" trace_id={self.trace_id}"
+        self.line = line
+
+    def to_json(self) -> str:
+        entry = {"seq": self.seq, "timestamp": self.timestamp, "level": self.level,
+                 "name": self.name, "message": self.message}
+        if self.request_id:
+            entry["request_id"] = self.request_id
+        if self.trace_id:
+            entry["trace_id"] = self.trace_id
+        return json.dumps(entry)
+
+
+class LogBuffer:
+    """Last max_size log entries, addressable by sequence number (first entry is 1)."""
+
+    def __init__(self, max_size: int = 1000):
+        self.buffer: "collections.deque[LogEntry]" = collections.deque(maxlen=max_size)
+        self.lock = threading.Lock()
+        self.last_seq = 0
+
+    def append(self, record: logging.LogRecord) -> None:
+        with self.lock:
+            self.last_seq += 1
+            self.buffer.append(LogEntry(self.last_seq, record))
+
+    def read(self, after: Optional[int] = None, limit: int = 100) -> Tuple[List[LogEntry], int, int]:
+        """
+        Entries with seq > after, oldest first, at most limit of them
+        (after=None: the newest limit entries).
+
+        Returns (entries, cursor, missed): cursor is the seq to pass as
+        ``after`` next time, missed how many entries after the cursor had
+        already been evicted from the ring. A cursor ahead of the buffer
+        (the process restarted) reads from the beginning again.
+        """
+        with self.lock:
+            last_seq = self.last_seq
+            if after is not None and (after < 0 or after > last_seq):
+                after = 0
+            if after is None:
+                wanted = min(limit, len(self.buffer))
+            else:
+                wanted = min(last_seq - after, len(self.buffer))
+            # Walk from the newest end: O(new entries), not O(buffer)
+            newest = list(itertools.islice(reversed(self.buffer), wanted))
+        newest.reverse()
+        entries = newest[:limit]
+        if not entries:
+            return entries, last_seq if after is None else after, 0
+        missed = max(entries[0].seq - after - 1, 0) if after is not None else 0
+        return entries, entries[-1].seq, missed
+
+
+class BufferLogHandler(logging.Handler):
+    """Writes records to a LogBuffer."""
+
+    def __init__(self, buffer: LogBuffer):
+        super().__init__()
+        self.buffer = buffer
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.buffer.append(record)
+        except Exception:
+            pass  # Don't fail if buffer append fails
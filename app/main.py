@@ -2,23 +2,37 @@ import os
 import time
 import uuid
 import asyncio
+import ipaddress
+import itertools
 import json
 import urllib.parse
-import sqlite3
-from datetime import datetime, timezone, timedelta
-from typing import Dict, Optional, List
-from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Literal, Optional, List
 
-from fastapi import FastAPI, HTTPException, Request, Depends, Cookie, Form
+from fastapi import FastAPI, HTTPException, Request, Depends, Cookie, Form, Query
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, Field
-from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from fastapi.responses import Response, StreamingResponse
+from prometheus_client import REGISTRY, Counter, Histogram, CONTENT_TYPE_LATEST
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
-from .db import initialize_database, borrow_license, return_license, get_status, update_budget_config, get_all_tools, get_overage_charges, get_all_tenants, get_vendor_customers, provision_license_to_tenant, create_tenant, create_vendor, get_all_vendors, delete_tenant, delete_vendor, get_connection, verify_user_credentials, get_password_context
+from .db import initialize_database, borrow_license_with_status, return_license, borrow_licenses_batch, return_licenses_batch, renew_leases, release_session, get_status, get_all_status, update_budget_config, get_borrows_page, get_overage_charges_page, get_vendor_customers, provision_license_to_tenant, unit_of_work, close_all_connections
+from . import engine as allocation_engine
+from . import apikeys
+from . import async_db
+from . import bulk
+from . import collectors
+from . import exports
+from . import history
+from . import jobs
+from . import logpipeline
+from . import passwords
+from .sharding import current_tenant, sharding_enabled, tenant_scope
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .realtime import REALTIME_RETENTION_SECONDS, RealtimeBroadcasters, RealtimeMetricsBuffer
+from .leases import LEASE_SWEEP_SECONDS, LEASE_TTL_SECONDS, LeaseSweeper, lease_expiry
 
 # App version for observability/journey (surfaced in logs & API)
 APP_VERSION = os.getenv("APP_VERSION", "dev")
@@ -99,67 +113,22 @@ serializer = URLSafeTimedSerializer(SECRET_KEY)
 import logging
 
 # In-memory log buffer for scraping (keeps last 1000 log entries)
-class LogBuffer:
-    def __init__(self, max_size=1000):
-        self.buffer = deque(maxlen=max_size)
-        self.lock = asyncio.Lock()
-    
-    def append(self, record):
-        """Append a log record to the buffer"""
-        log_entry = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "level": record.levelname,
-            "name": record.name,
-            "message": record.getMessage(),
-            "pathname": record.pathname,
-            "lineno": record.lineno,
-        }
-        # Add extra fields if present
-        if hasattr(record, 'request_id'):
-            log_entry['request_id'] = record.request_id
-        if hasattr(record, 'trace_id'):
-            log_entry['trace_id'] = record.trace_id
-        self.buffer.append(log_entry)
-    
-    def get_recent_logs(self, limit=100):
-        """Get recent log entries in Promtail/Loki compatible format"""
-        recent = list(self.buffer)[-limit:]
-        # Format as plain text (one entry per line) for Promtail to scrape
-        lines = []
-        for entry in recent:
-            # Format: timestamp level name message [extra_fields]
-            line = f"{entry['timestamp']} {entry['level']} {entry['name']} {entry['message']}"
-            if 'request_id' in entry:
-                line += f" request_id={entry['request_id']}"
-            if 'trace_id' in entry:
-                line += f" trace_id={entry['trace_id']}"
-            lines.append(line)
-        return "\n".join(lines)
-
-# Global log buffer
-log_buffer = LogBuffer(max_size=1000)
-
-# Custom log handler that writes to buffer
-class BufferLogHandler(logging.Handler):
-    def emit(self, record):
-        try:
-            log_buffer.append(record)
-        except Exception:
-            pass  # Don't fail if buffer append fails
+log_buffer = logpipeline.LogBuffer(max_size=1000)
 
 # Configure logging
 logger = logging.getLogger("license-server")
 logger.setLevel(logging.INFO)
 
 # Buffer handler (for scraping)
-buffer_handler = BufferLogHandler()
-logger.addHandler(buffer_handler)
+buffer_handler = logpipeline.BufferLogHandler(log_buffer)
 
 # Console handler (always active for local development and Fly.io stdout)
 console_handler = logging.StreamHandler()
 console_formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
 console_handler.setFormatter(console_formatter)
-logger.addHandler(console_handler)
+
+# Request threads only enqueue; a background listener formats and fans out (see app/logpipeline.py)
+log_listener = logpipeline.start_pipeline(logger, [buffer_handler, console_handler])
 
 # Logging configured - stdout only (Fly.io captures stdout automatically)
 # View logs at: https://fly-metrics.net/d/fly-logs/fly-logs?orgId=1332768&var-app=license-server-demo
@@ -174,17 +143,20 @@ except Exception:
 
 
 # Prometheus metrics
-borrow_attempts = Counter("license_borrow_attempts_total", "Total borrow attempts", ["tool", "user"]) 
-borrow_successes = Counter("license_borrow_success_total", "Total successful borrows", ["tool", "user"]) 
+# Label values pass through collectors.label_limiter (first N per label, then __other__);
+# per-user counts are exported only for the top users (license_user_checkouts_total)
+borrow_attempts = Counter("license_borrow_attempts_total", "Total borrow attempts", ["tool"]) 
+borrow_successes = Counter("license_borrow_success_total", "Total successful borrows", ["tool"]) 
 borrow_failures = Counter("license_borrow_failure_total", "Total failed borrow attempts", ["tool", "reason"]) 
 borrow_duration = Histogram("license_borrow_duration_seconds", "Borrow operation duration", ["tool"]) 
-borrowed_gauge = Gauge("licenses_borrowed", "Currently borrowed licenses per tool", ["tool"]) 
-total_licenses_gauge = Gauge("licenses_total", "Total licenses available per tool", ["tool"])
-overage_gauge = Gauge("licenses_overage", "Current overage count per tool", ["tool"])
-commit_gauge = Gauge("licenses_commit", "Commit quantity per tool", ["tool"])
-max_overage_gauge = Gauge("licenses_max_overage", "Max overage allowed per tool", ["tool"])
-at_max_overage_gauge = Gauge("licenses_at_max_overage", "Whether tool is at max overage (1) or not (0)", ["tool"])
-overage_checkouts = Counter("license_overage_checkouts_total", "Total overage checkouts", ["tool", "user"]) 
+# Per-tool license gauges (licenses_borrowed, licenses_total, ...) are read at scrape time
+REGISTRY.register(collectors.LicenseStateCollector())
+metrics_cache = collectors.MetricsCache()
+overage_checkouts = Counter("license_overage_checkouts_total", "Total overage checkouts", ["tool"]) 
+user_checkouts = collectors.TopKCounter("license_user_checkouts", "Successful borrows of the top users (approximate)", "user")
+user_overage_checkouts = collectors.TopKCounter("license_user_overage_checkouts", "Overage checkouts of the top users (approximate)", "user")
+REGISTRY.register(user_checkouts)
+REGISTRY.register(user_overage_checkouts)
 # HTTP status code metrics - tracks all responses by route and status code
 http_requests_total = Counter("license_http_requests_total", "Total HTTP requests by route and status code", ["route", "method", "status_code"])
 http_500_total = Counter("license_http_500_total", "Total HTTP 500 responses emitted by the app", ["route"])  # Kept for backward compatibility
@@ -221,17 +193,30 @@ async def tenant_middleware(request: Request, call_next):
     
     # Log tenant context for debugging
     if subdomain:
-        logger.debug(f"tenant_middleware host={host} subdomain={subdomain} context={request.state.context} tenant_id={request.state.tenant_id}")
+        logger.debug("tenant_middleware host=%s subdomain=%s context=%s tenant_id=%s",
+                     host, subdomain, request.state.context, request.state.tenant_id)
     
-    response = await call_next(request)
+    # Route tenant-scoped db helpers to the tenant's shard (LICENSE_DB_SHARDING=tenant)
+    with tenant_scope(request.state.tenant_id):
+        response = await call_next(request)
     return response
 
 
+def _route_label(request: Request) -> str:
+    """Route template of the matched route (/licenses/{tool}/status), not the raw path."""
+    route = request.scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        # Mounts (/static) only set root_path; unmatched paths (404s) collapse into one value
+        template = request.scope.get("root_path") or "__unmatched__"
+    return collectors.label_limiter("route", template)
+
+
 @app.middleware("http")
 async def track_http_responses(request: Request, call_next):
     """Track all HTTP responses by route, method, status code, duration, and request ID."""
     request_id = str(uuid.uuid4())[:8]  # Short request ID for traceability
-    route = request.url.path
+    path = request.url.path
     method = request.method
     start_time = time.perf_counter()
     
@@ -248,21 +233,26 @@ async def track_http_responses(request: Request, call_next):
         response = await call_next(request)
         duration = time.perf_counter() - start_time
         status = response.status_code
+        route = _route_label(request)
         
         # Track all status codes
         http_requests_total.labels(route=route, method=method, status_code=str(status)).inc()
         http_request_duration.labels(route=route, method=method, status_code=str(status)).observe(duration)
         
-        # Log request with trace ID and OpenTelemetry trace context
-        log_msg = f"request route={route} method={method} status={status} duration={duration:.3f} request_id={request_id}"
+        # Log request with trace ID and OpenTelemetry trace context (sampled unless slow or an error)
+        extra = {"request_id": request_id, "routine": True, "status_code": status, "duration_ms": duration * 1000}
         if trace_id:
-            log_msg += f" trace_id={trace_id} span_id={span_id}"
-        logger.info(log_msg, extra={"request_id": request_id, "trace_id": trace_id} if trace_id else {"request_id": request_id})
+            extra["trace_id"] = trace_id
+            logger.info("request route=%s method=%s status=%d duration=%.3f request_id=%s trace_id=%s span_id=%s",
+                        path, method, status, duration, request_id, trace_id, span_id, extra=extra)
+        else:
+            logger.info("request route=%s method=%s status=%d duration=%.3f request_id=%s",
+                        path, method, status, duration, request_id, extra=extra)
         
         # Also track 500s specifically (for backward compatibility and easier alerting)
         if status == 500:
             http_500_total.labels(route=route).inc()
-            logger.warning("500 response route=%s method=%s request_id=%s trace_id=%s", route, method, request_id, trace_id or "none", 
+            logger.warning("500 response route=%s method=%s request_id=%s trace_id=%s", path, method, request_id, trace_id or "none", 
                           extra={"request_id": request_id, "trace_id": trace_id} if trace_id else {"request_id": request_id})
         
         # Add request ID and trace ID to response header for traceability
@@ -273,6 +263,7 @@ async def track_http_responses(request: Request, call_next):
     except Exception as e:
         duration = time.perf_counter() - start_time
         # Catch unhandled exceptions (these become 500s)
+        route = _route_label(request)
         http_requests_total.labels(route=route, method=method, status_code="500").inc()
         http_request_duration.labels(route=route, method=method, status_code="500").observe(duration)
         http_500_total.labels(route=route).inc()
@@ -282,179 +273,26 @@ async def track_http_responses(request: Request, call_next):
         raise
 
 
-# Real-time metrics buffer (keeps last 6 hours)
-# Each event is stored with timestamp for time-based retention
-REALTIME_RETENTION_HOURS = 6
-REALTIME_RETENTION_SECONDS = REALTIME_RETENTION_HOURS * 3600
+@app.middleware("http")
+async def db_unit_of_work(request: Request, call_next):
+    """Reuse one pooled SQLite connection for all db helpers within a request."""
+    with unit_of_work():
+        return await call_next(request)
 
-class RealtimeMetricsBuffer:
-    """Thread-safe buffer for real-time metrics with 6-hour retention"""
-    def __init__(self):
-        self.borrows = deque(maxlen=100000)  # ~28 per second for 6 hours
-        self.returns = deque(maxlen=100000)
-        self.failures = deque(maxlen=10000)
-        
-        # Per-tool aggregated metrics (for charting)
-        # Structure: { tool_name: deque([(timestamp, borrow_count, users_list)]) }
-        self.tool_metrics = {}
-        
-    def add_borrow(self, tool: str, user: str, is_overage: bool, borrow_id: str):
-        """Record a borrow event"""
-        event = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "type": "borrow",
-            "tool": tool,
-            "user": user,
-            "is_overage": is_overage,
-            "id": borrow_id
-        }
-        self.borrows.append(event)
-        self._cleanup_old_events()
-    
-    def add_return(self, borrow_id: str, user: str = None):
-        """Record a return event"""
-        event = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "type": "return",
-            "id": borrow_id,
-            "user": user
-        }
-        self.returns.append(event)
-        self._cleanup_old_events()
-    
-    def add_failure(self, tool: str, user: str, reason: str):
-        """Record a failure event"""
-        event = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "type": "failure",
-            "tool": tool,
-            "user": user,
-            "reason": reason
-        }
-        self.failures.append(event)
-        self._cleanup_old_events()
-    
-    def _cleanup_old_events(self):
-        """Remove events older than 6 hours"""
-        cutoff = datetime.now(timezone.utc) - timedelta(seconds=REALTIME_RETENTION_SECONDS)
-        cutoff_iso = cutoff.isoformat()
-        
-        # Clean borrows
-        while self.borrows and self.borrows[0]["timestamp"] < cutoff_iso:
-            self.borrows.popleft()
-        
-        # Clean returns
-        while self.returns and self.returns[0]["timestamp"] < cutoff_iso:
-            self.returns.popleft()
-        
-        # Clean failures
-        while self.failures and self.failures[0]["timestamp"] < cutoff_iso:
-            self.failures.popleft()
-    
-    def get_recent_events(self, seconds: int = 60):
-        """Get events from the last N seconds (max 6 hours)"""
-        # Limit to retention period
-        seconds = min(seconds, REALTIME_RETENTION_SECONDS)
-        cutoff = datetime.now(timezone.utc) - timedelta(seconds=seconds)
-        cutoff_iso = cutoff.isoformat()
-        
-        recent_borrows = [e for e in self.borrows if e["timestamp"] >= cutoff_iso]
-        recent_returns = [e for e in self.returns if e["timestamp"] >= cutoff_iso]
-        recent_failures = [e for e in self.failures if e["timestamp"] >= cutoff_iso]
-        
-        return {
-            "borrows": recent_borrows,
-            "returns": recent_returns,
-            "failures": recent_failures
-        }
-    
-    def get_stats_summary(self):
-        """Get summary statistics"""
-        return {
-            "total_events": len(self.borrows) + len(self.returns) + len(self.failures),
-            "borrow_count": len(self.borrows),
-            "return_count": len(self.returns),
-            "failure_count": len(self.failures),
-            "retention_hours": REALTIME_RETENTION_HOURS,
-            "oldest_event": self.borrows[0]["timestamp"] if self.borrows else None
-        }
-    
-    def aggregate_tool_metrics(self, window_seconds: int = 60):
-        """Aggregate borrow events into per-tool, per-minute data points for charting
-        
-        This creates time-series data that persists when users switch tool views.
-        Aggregates events into 1-minute buckets.
-        """
-        cutoff = datetime.now(timezone.utc) - timedelta(seconds=window_seconds)
-        cutoff_iso = cutoff.isoformat()
-        
-        # Get recent borrows within window
-        recent_borrows = [e for e in self.borrows if e["timestamp"] >= cutoff_iso]
-        
-        # Group by tool and minute
-        tool_data = {}
-        for event in recent_borrows:
-            tool = event["tool"]
-            if tool not in tool_data:
-                tool_data[tool] = {}
-            
-            # Round timestamp to minute
-            event_time = datetime.fromisoformat(event["timestamp"])
-            minute_key = event_time.replace(second=0, microsecond=0).isoformat()
-            
-            if minute_key not in tool_data[tool]:
-                tool_data[tool][minute_key] = {
-                    "count": 0,
-                    "users": set(),
-                    "overage_count": 0
-                }
-            
-            tool_data[tool][minute_key]["count"] += 1
-            tool_data[tool][minute_key]["users"].add(event["user"])
-            if event.get("is_overage"):
-                tool_data[tool][minute_key]["overage_count"] += 1
-        
-        # Convert to sorted list format
-        result = {}
-        for tool, minutes in tool_data.items():
-            result[tool] = [
-                {
-                    "timestamp": ts,
-                    "count": data["count"],
-                    "users": list(data["users"]),
-                    "overage_count": data["overage_count"]
-                }
-                for ts, data in sorted(minutes.items())
-            ]
-        
-        return result
-    
-    def get_tool_history(self, tool: str, window_seconds: int = 1800):
-        """Get aggregated history for a specific tool
-        
-        Returns time-series data suitable for charting
-        """
-        all_metrics = self.aggregate_tool_metrics(window_seconds)
-        return all_metrics.get(tool, [])
 
-# Global instance
+# Real-time metrics buffer (keeps last 6 hours, see app/realtime.py)
 realtime_buffer = RealtimeMetricsBuffer()
 
 
 class BorrowRequest(BaseModel):
     tool: str = Field(..., min_length=1)
     user: str = Field(..., min_length=1)
-
-
-class BorrowResponse(BaseModel):
-    id: str
-    tool: str
-    user: str
-    borrowed_at: str
-
-
-class ReturnRequest(BaseModel):
-    id: str = Field(..., min_length=1)
+    # Lease options: TTL (default LICENSE_LEASE_TTL_SECONDS, 0 = never expires) and owner ids for bulk release
+    ttl_seconds: Optional[int] = Field(None, ge=0)
+    session_id: Optional[str] = None
+    host: Optional[str] = None
+    # Return the tool's post-borrow status with the borrow (saves a /licenses/status call)
+    include_status: bool = False
 
 
 class StatusResponse(BaseModel):
@@ -472,11 +310,109 @@ class StatusResponse(BaseModel):
     total_cost: float = 0.0
 
 
-class BorrowRecord(BaseModel):
+class BorrowResponse(BaseModel):
     id: str
     tool: str
     user: str
     borrowed_at: str
+    expires_at: Optional[str] = None
+    status: Optional[StatusResponse] = None
+
+
+class ReturnRequest(BaseModel):
+    id: str = Field(..., min_length=1)
+
+
+# Upper bound on seats per batch call (sum of item quantities)
+BATCH_MAX_SEATS = int(os.getenv("LICENSE_BATCH_MAX_SEATS", "500"))
+
+
+class BatchBorrowItem(BaseModel):
+    tool: str = Field(..., min_length=1)
+    user: str = Field(..., min_length=1)
+    quantity: int = Field(1, ge=1)
+
+
+class BatchBorrowRequest(BaseModel):
+    items: List[BatchBorrowItem] = Field(..., min_length=1)
+    # all_or_nothing: every seat or none; partial: grant what is available per item
+    mode: Literal["all_or_nothing", "partial"] = "all_or_nothing"
+    ttl_seconds: Optional[int] = Field(None, ge=0)
+    session_id: Optional[str] = None
+    host: Optional[str] = None
+
+
+class BatchBorrowFailure(BaseModel):
+    tool: str
+    user: str
+    requested: int
+    granted: int
+    reason: str
+
+
+class BatchBorrowResponse(BaseModel):
+    mode: str
+    borrows: List[BorrowResponse]
+    failures: List[BatchBorrowFailure] = []
+
+
+class BatchReturnRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1)
+
+
+class BatchReturnResponse(BaseModel):
+    returned: List[Dict[str, str]]
+    not_found: List[str] = []
+
+
+class HeartbeatRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1)
+    ttl_seconds: Optional[int] = Field(None, gt=0)
+
+
+class HeartbeatResponse(BaseModel):
+    renewed: List[str]
+    expired: List[str] = []
+    expires_at: str
+
+
+class ReleaseSessionRequest(BaseModel):
+    session_id: Optional[str] = None
+    host: Optional[str] = None
+
+
+class PageParams:
+    """Keyset pagination and fields= projection shared by list endpoints."""
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.fields = fields
+
+
+def _fetch_page(fetch, *args, page: PageParams):
+    try:
+        return fetch(*args, limit=page.limit, cursor=page.cursor, fields=page.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+
+class BorrowRecord(BaseModel):
+    # Optional so fields= projections can omit columns (unset fields are excluded)
+    id: Optional[str] = None
+    tool: Optional[str] = None
+    user: Optional[str] = None
+    borrowed_at: Optional[str] = None
 
 
 class FrontendError(BaseModel):
@@ -528,8 +464,18 @@ class ProvisionLicenseRequest(BaseModel):
     crm_opportunity_id: Optional[str] = None
 
 
+lease_sweeper: Optional[LeaseSweeper] = None
+api_key_flusher: Optional[apikeys.LastUsedFlusher] = None
+
+
+def _on_lease_expired(borrow_id: str, tool: str) -> None:
+    realtime_buffer.add_return(borrow_id)
+    logger.info("lease expired id=%s tool=%s", borrow_id, tool)
+
+
 @app.on_event("startup")
 def startup_event() -> None:
+    logpipeline.resume_pipeline(log_listener)
     # Seed some tools unless running tests
     if os.getenv("LICENSE_DB_SEED", "true").lower() == "true":
         # Seed with automotive software development tools
@@ -545,13 +491,43 @@ def startup_event() -> None:
     else:
         initialize_database()
         logger.info("database initialized without seed data")
+    if allocation_engine.ENGINE_MODE == "memory":
+        allocation_engine.start_engine()
+    global lease_sweeper, api_key_flusher
+    if LEASE_SWEEP_SECONDS > 0:
+        lease_sweeper = LeaseSweeper(on_release=_on_lease_expired)
+        lease_sweeper.start()
+    api_key_flusher = apikeys.LastUsedFlusher()
+    api_key_flusher.start()
+    # Finish hard deletes a previous process left half done
+    jobs.resume_jobs()
     logger.info("app_version=%s", APP_VERSION)
 
 
-@app.post("/licenses/borrow", response_model=BorrowResponse)
-def borrow(req: BorrowRequest, request: Request):
-    # Validate HMAC signature
-    from app.security import validate_signature
+@app.on_event("shutdown")
+def shutdown_event() -> None:
+    global lease_sweeper, api_key_flusher
+    if lease_sweeper is not None:
+        lease_sweeper.stop()
+        lease_sweeper = None
+    if api_key_flusher is not None:
+        api_key_flusher.stop()
+        api_key_flusher = None
+    jobs.stop_runner()
+    # Drain the engine journal into SQLite before the pools go away
+    allocation_engine.stop_engine()
+    async_db.shutdown_executor()
+    passwords.shutdown_pool()
+    close_all_connections()
+    logpipeline.stop_pipeline(log_listener)
+
+
+def _authorize_client_request(request: Request, validate) -> str:
+    """
+    Check the API key and HMAC signature of a licensing call; returns the API key.
+
+    validate(api_key) runs the signature check for the specific payload.
+    """
     # Extract API key from Authorization header (Bearer <key>)
     auth_header = request.headers.get("Authorization", "")
     api_key = ""
@@ -586,7 +562,7 @@ def borrow(req: BorrowRequest, request: Request):
     
     if has_signature_headers:
         # API client with signature - validate it
-        is_valid, error_msg = validate_signature(request, req.tool, req.user, api_key=api_key, require=True)
+        is_valid, error_msg = validate(api_key)
         if not is_valid:
             logger.warning("Security check failed: %s", error_msg)
             raise HTTPException(status_code=403, detail=f"Security validation failed: {error_msg}")
@@ -595,73 +571,68 @@ def borrow(req: BorrowRequest, request: Request):
         logger.debug("Browser request detected, skipping signature validation")
     else:
         # Non-browser request without signature - require it
-        is_valid, error_msg = validate_signature(request, req.tool, req.user, api_key=api_key, require=True)
+        is_valid, error_msg = validate(api_key)
         if not is_valid:
             logger.warning("Security check failed: %s", error_msg)
             raise HTTPException(status_code=403, detail=f"Security validation failed: {error_msg}")
     
+    return api_key
+
+
+def _tool_label(tool: str, known: bool) -> str:
+    """Metric label for a borrowed tool; names matching no license never take a limiter slot."""
+    return collectors.label_limiter("tool", tool) if known else collectors.OTHER_LABEL
+
+
+@app.post("/licenses/borrow", response_model=BorrowResponse, response_model_exclude_unset=True)
+def borrow(req: BorrowRequest, request: Request):
+    # Validate HMAC signature
+    from app.security import validate_signature
+    _authorize_client_request(
+        request, lambda api_key: validate_signature(request, req.tool, req.user, api_key=api_key, require=True)
+    )
+    
     start = time.perf_counter()
-    borrow_attempts.labels(req.tool, req.user).inc()
     borrow_id = str(uuid.uuid4())
-    borrowed_at = datetime.now(timezone.utc).isoformat()
-    # Enforce spend protection before attempting overage borrows
-    # Check current status
-    status_snapshot = get_status(req.tool)
-    if status_snapshot:
-        borrowed_now = int(status_snapshot["borrowed"])
-        commit_now = int(status_snapshot["commit"])
-        overage_now = max(borrowed_now - commit_now, 0)
-        will_be_overage = borrowed_now >= commit_now
-        if will_be_overage:
-            from .db import get_customer_max_spend, get_month_to_date_overage_cost
-            max_spend = get_customer_max_spend(req.tool)
-            if max_spend is not None:
-                current_cost = get_month_to_date_overage_cost(req.tool)
-                # Estimated next overage cost
-                next_cost = float(status_snapshot.get("overage_price_per_license", 0.0))
-                if current_cost + next_cost > max_spend:
-                    logger.warning("borrow blocked by max spend tool=%s user=%s cost=%.2f next=%.2f cap=%.2f", req.tool, req.user, current_cost, next_cost, max_spend)
-                    raise HTTPException(status_code=403, detail="Customer max spend reached for this period")
-
-    ok, is_overage = borrow_license(req.tool, req.user, borrow_id, borrowed_at)
+    now = datetime.now(timezone.utc)
+    borrowed_at = now.isoformat()
+    expires_at = lease_expiry(now, req.ttl_seconds)
+    # One transaction: the borrow, its failure reason and the resulting tool status
+    result = borrow_license_with_status(req.tool, req.user, borrow_id, borrowed_at, expires_at, req.session_id, req.host)
     duration = time.perf_counter() - start
-    borrow_duration.labels(req.tool).observe(duration)
-    if not ok:
-        # record failure reason
-        status = get_status(req.tool)
-        reason = "unknown"
-        if status is None:
-            reason = "unknown_tool"
-        elif status["borrowed"] >= status["total"]:
-            reason = "exhausted"
-        elif status["overage"] >= status["max_overage"]:
-            reason = "max_overage"
-        borrow_failures.labels(req.tool, reason).inc()
+    status = result["status"]
+    tool_label = _tool_label(req.tool, status is not None)
+    borrow_attempts.labels(tool_label).inc()
+    borrow_duration.labels(tool_label).observe(duration)
+    if not result["ok"]:
+        reason = result["reason"]
+        # record failure reason (classified inside the borrow transaction)
+        borrow_failures.labels(tool_label, reason).inc()
         # Record failure in real-time buffer
         realtime_buffer.add_failure(req.tool, req.user, reason)
+        if reason == "max_spend":
+            # Spend cap is enforced atomically against this period's ledger total
+            logger.warning("borrow blocked by max spend tool=%s user=%s", req.tool, req.user)
+            raise HTTPException(status_code=403, detail="Customer max spend reached for this period")
         logger.warning("borrow failed tool=%s user=%s reason=%s", req.tool, req.user, reason)
         raise HTTPException(status_code=409, detail=f"No licenses available for {req.tool}")
-    # update gauges
-    status = get_status(req.tool)
-    if status:
-        borrowed_gauge.labels(req.tool).set(status["borrowed"])
-        total_licenses_gauge.labels(req.tool).set(status["total"])
-        overage_gauge.labels(req.tool).set(status["overage"])
-        commit_gauge.labels(req.tool).set(status["commit"])
-        max_overage_gauge.labels(req.tool).set(status["max_overage"])
-        at_max_overage_gauge.labels(req.tool).set(1 if status["overage"] >= status["max_overage"] else 0)
-    borrow_successes.labels(req.tool, req.user).inc()
+    is_overage = result["is_overage"]
+    borrow_successes.labels(tool_label).inc()
+    user_checkouts.inc(req.user)
     
     # Track overage checkouts
     if is_overage:
-        overage_checkouts.labels(req.tool, req.user).inc()
+        overage_checkouts.labels(tool_label).inc()
+        user_overage_checkouts.inc(req.user)
     
     # Record in real-time buffer
     realtime_buffer.add_borrow(req.tool, req.user, is_overage, borrow_id)
     
     overage_str = " (overage)" if is_overage else ""
-    logger.info("borrow success tool=%s user=%s id=%s borrowed=%d/%d%s", req.tool, req.user, borrow_id, status["borrowed"], status["total"] if status else -1, overage_str)
-    return BorrowResponse(id=borrow_id, tool=req.tool, user=req.user, borrowed_at=borrowed_at)
+    logger.info("borrow success tool=%s user=%s id=%s borrowed=%d/%d%s", req.tool, req.user, borrow_id, status["borrowed"], status["total"], overage_str,
+                extra={"routine": True})
+    extra = {"status": StatusResponse(**status)} if req.include_status else {}
+    return BorrowResponse(id=borrow_id, tool=req.tool, user=req.user, borrowed_at=borrowed_at, expires_at=expires_at, **extra)
 
 
 @app.get("/faulty")
@@ -682,18 +653,118 @@ def return_(req: ReturnRequest) -> Dict[str, str]:
     # Record in real-time buffer
     realtime_buffer.add_return(req.id)
     
-    status = get_status(tool)
-    if status:
-        borrowed_gauge.labels(tool).set(status["borrowed"])
-        total_licenses_gauge.labels(tool).set(status["total"])
-        overage_gauge.labels(tool).set(status["overage"])
-        commit_gauge.labels(tool).set(status["commit"])
-        max_overage_gauge.labels(tool).set(status["max_overage"])
-        at_max_overage_gauge.labels(tool).set(1 if status["overage"] >= status["max_overage"] else 0)
-    logger.info("return success id=%s tool=%s borrowed=%d/%d", req.id, tool, status["borrowed"] if status else -1, status["total"] if status else -1)
+    logger.info("return success id=%s tool=%s", req.id, tool, extra={"routine": True})
     return {"status": "ok", "tool": tool}
 
 
+@app.post("/licenses/borrow:batch", response_model=BatchBorrowResponse, response_model_exclude_unset=True)
+def borrow_batch(req: BatchBorrowRequest, request: Request):
+    """Borrow many seats with one signature and one transaction (CI farms, bulk checkout)."""
+    from app.security import validate_batch_signature
+    items = [(item.tool, item.user, item.quantity) for item in req.items]
+    if sum(quantity for _, _, quantity in items) > BATCH_MAX_SEATS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {BATCH_MAX_SEATS} seats")
+    _authorize_client_request(
+        request, lambda api_key: validate_batch_signature(request, items, req.mode, api_key=api_key, require=True,
+                                                          ttl_seconds=req.ttl_seconds, session_id=req.session_id,
+                                                          host=req.host)
+    )
+    
+    start = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    borrowed_at = now.isoformat()
+    expires_at = lease_expiry(now, req.ttl_seconds)
+    results = borrow_licenses_batch(items, borrowed_at, req.mode == "all_or_nothing", expires_at, req.session_id, req.host)
+    duration = time.perf_counter() - start
+    
+    borrows, failures = [], []
+    for result in results:
+        tool, user = result["tool"], result["user"]
+        tool_label = _tool_label(tool, result["reason"] != "unknown_tool")
+        borrow_attempts.labels(tool_label).inc(result["requested"])
+        borrow_duration.labels(tool_label).observe(duration)
+        for seat in result["granted"]:
+            borrow_successes.labels(tool_label).inc()
+            user_checkouts.inc(user)
+            if seat["is_overage"]:
+                overage_checkouts.labels(tool_label).inc()
+                user_overage_checkouts.inc(user)
+            realtime_buffer.add_borrow(tool, user, seat["is_overage"], seat["id"])
+            borrows.append(BorrowResponse(id=seat["id"], tool=tool, user=user, borrowed_at=borrowed_at, expires_at=expires_at))
+        if result["reason"]:
+            borrow_failures.labels(tool_label, result["reason"]).inc()
+            realtime_buffer.add_failure(tool, user, result["reason"])
+            failures.append(BatchBorrowFailure(
+                tool=tool, user=user, requested=result["requested"],
+                granted=len(result["granted"]), reason=result["reason"]
+            ))
+    
+    if failures and req.mode == "all_or_nothing":
+        failure = failures[0]
+        logger.warning("batch borrow rejected items=%d tool=%s user=%s reason=%s", len(items), failure.tool, failure.user, failure.reason)
+        status_code = 403 if failure.reason == "max_spend" else 409
+        raise HTTPException(status_code=status_code, detail={
+            "message": f"Batch rejected: {failure.tool} unavailable ({failure.reason})",
+            "failures": [f.model_dump() for f in failures],
+        })
+    logger.info("batch borrow success mode=%s items=%d granted=%d short=%d", req.mode, len(items), len(borrows), len(failures))
+    return BatchBorrowResponse(mode=req.mode, borrows=borrows, failures=failures)
+
+
+@app.post("/licenses/return:batch", response_model=BatchReturnResponse)
+def return_batch(req: BatchReturnRequest):
+    """Return many borrows in one transaction; unknown ids are reported, not fatal."""
+    tools = return_licenses_batch(req.ids)
+    returned, not_found = [], []
+    for borrow_id, tool in zip(req.ids, tools):
+        if tool is None:
+            not_found.append(borrow_id)
+            continue
+        realtime_buffer.add_return(borrow_id)
+        returned.append({"id": borrow_id, "tool": tool})
+    logger.info("batch return success returned=%d not_found=%d", len(returned), len(not_found))
+    return BatchReturnResponse(returned=returned, not_found=not_found)
+
+
+@app.post("/licenses/heartbeat", response_model=HeartbeatResponse)
+def heartbeat(req: HeartbeatRequest, request: Request):
+    """Renew many leases in one call; ids that already expired or were returned are listed as expired."""
+    from app.security import validate_lease_signature
+    # Signed like borrow: ttl_seconds, then the ids in request order
+    _authorize_client_request(
+        request, lambda api_key: validate_lease_signature(request, "heartbeat", [req.ttl_seconds] + req.ids,
+                                                          api_key=api_key, require=True)
+    )
+    ttl = req.ttl_seconds or LEASE_TTL_SECONDS
+    if ttl <= 0:
+        raise HTTPException(status_code=400, detail="ttl_seconds is required when no default lease TTL is configured")
+    expires_at = lease_expiry(datetime.now(timezone.utc), ttl)
+    renewed = renew_leases(req.ids, expires_at)
+    held = set(renewed)
+    expired = [borrow_id for borrow_id in req.ids if borrow_id not in held]
+    logger.debug("heartbeat renewed=%d expired=%d", len(renewed), len(expired))
+    return HeartbeatResponse(renewed=renewed, expired=expired, expires_at=expires_at)
+
+
+@app.post("/licenses/release")
+def release(req: ReleaseSessionRequest, request: Request) -> Dict[str, object]:
+    """Release every lease held by a session and/or host (e.g. after a crash)."""
+    from app.security import validate_lease_signature
+    # Host names are guessable: only signed licensing clients may free a machine's seats
+    _authorize_client_request(
+        request, lambda api_key: validate_lease_signature(request, "release", [req.session_id, req.host],
+                                                          api_key=api_key, require=True)
+    )
+    try:
+        released = release_session(req.session_id, req.host)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for borrow_id, _ in released:
+        realtime_buffer.add_return(borrow_id)
+    logger.info("session release session_id=%s host=%s released=%d", req.session_id, req.host, len(released))
+    return {"status": "ok", "released": [{"id": borrow_id, "tool": tool} for borrow_id, tool in released]}
+
+
 @app.get("/licenses/{tool}/status", response_model=StatusResponse)
 def status(tool: str):
     s = get_status(tool)
@@ -704,67 +775,42 @@ def status(tool: str):
 
 @app.get("/licenses/status", response_model=List[StatusResponse])
 def status_all():
-    from .db import get_connection
-    with get_connection(True) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT tool, total, borrowed, commit_qty, max_overage, commit_price, overage_price_per_license FROM licenses ORDER BY tool ASC")
-        rows = cur.fetchall()
-        result: List[StatusResponse] = []
-        for r in rows:
-            total = int(r["total"])
-            borrowed = int(r["borrowed"])
-            commit = int(r["commit_qty"] or 0)
-            max_overage = int(r["max_overage"] or 0)
-            commit_price = float(r["commit_price"] or 0.0)
-            overage_price = float(r["overage_price_per_license"] or 0.0)
-            overage = max(borrowed - commit, 0)
-            
-            # Calculate accumulated overage costs from overage_charges table (persists even after return)
-            cur.execute("SELECT COUNT(*) as cnt FROM overage_charges WHERE tool = ?", (r["tool"],))
-            overage_charges_count = int(cur.fetchone()["cnt"] or 0)
-            current_overage_cost = overage_charges_count * overage_price
-            total_cost = commit_price + current_overage_cost
-            
-            result.append(StatusResponse(
-                tool=r["tool"],
-                total=total,
-                borrowed=borrowed,
-                available=max(total - borrowed, 0),
-                commit=commit,
-                max_overage=max_overage,
-                overage=overage,
-                in_commit=borrowed <= commit,
-                commit_price=commit_price,
-                overage_price_per_license=overage_price,
-                current_overage_cost=current_overage_cost,
-                total_cost=total_cost
-            ))
-        return result
+    return [StatusResponse(**s) for s in get_all_status()]
 
 
 @app.get("/metrics")
 def metrics():
-    data = generate_latest()
-    return Response(content=data, media_type=CONTENT_TYPE_LATEST)
+    return Response(content=metrics_cache.render(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/logs")
-def logs(limit: int = 100):
-    """Get recent logs in plain text format for Promtail scraping
+def logs(limit: int = 100, after: Optional[int] = None, format: Literal["text", "ndjson"] = "text"):
+    """Get recent logs for Promtail scraping
     
     Args:
         limit: Maximum number of log entries to return (default 100, max 1000)
+        after: Only return entries with a sequence number greater than this
+            (pass the previous response's X-Log-Last-Seq to read incrementally)
+        format: "text" (one line per entry) or "ndjson" (one JSON object per entry)
     
     Returns:
-        Plain text log entries, one per line, in format suitable for Promtail scraping
+        Log entries, oldest first, in format suitable for Promtail scraping
     """
     limit = min(max(limit, 1), 1000)  # Clamp between 1 and 1000
-    log_data = log_buffer.get_recent_logs(limit=limit)
+    entries, cursor, missed = log_buffer.read(after=after, limit=limit)
+    if format == "ndjson":
+        content = "".join(entry.to_json() + "\n" for entry in entries)
+        media_type = "application/x-ndjson"
+    else:
+        content = "\n".join(entry.line for entry in entries)
+        media_type = "text/plain"
     return Response(
-        content=log_data,
-        media_type="text/plain",
+        content=content,
+        media_type=media_type,
         headers={
-            "X-Log-Entries": str(limit),
+            "X-Log-Entries": str(len(entries)),
+            "X-Log-Last-Seq": str(cursor),
+            "X-Log-Missed": str(missed),
             "Cache-Control": "no-cache"
         }
     )
@@ -782,79 +828,68 @@ def realtime_stats(window: int = 60):
     
     return {
         **realtime_buffer.get_stats_summary(),
+        "rates": realtime_buffer.rates(),
         f"recent_{window}s": realtime_buffer.get_recent_events(window),
         "window_seconds": window
     }
 
 
+def _realtime_key(tenant_id: Optional[str]) -> Optional[str]:
+    """Broadcaster key: the tenant when each tenant has its own shard, else one shared stream."""
+    return tenant_id if sharding_enabled() else None
+
+
+async def _realtime_snapshot(tenant_id: Optional[str]) -> str:
+    """One /realtime/stream payload, serialized once for all of a tenant's subscribers"""
+    # Get current status for all tools (the broadcaster task has no request scope of its own)
+    status_all_tools = []
+    try:
+        with tenant_scope(tenant_id):
+            status_all_tools = await async_db.get_all_status()
+    except Exception as e:
+        logger.error("Error getting status in realtime stream: %s", e)
+    
+    # Build event data
+    data = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "tools": status_all_tools,
+        "rates": realtime_buffer.rates(),
+        # Last 10 events of each kind from the last 60 seconds
+        "recent_events": realtime_buffer.get_recent_events(60, limit=10),
+        "buffer_stats": realtime_buffer.get_stats_summary(),
+        # Per-tool time-series data (server maintains history per tool, see app/realtime.py)
+        "tool_metrics": realtime_buffer.aggregate_tool_metrics(window_seconds=REALTIME_RETENTION_SECONDS)
+    }
+    return json.dumps(data)
+
+
+# One broadcaster per tenant shard (a single shared one without sharding);
+# borrows, returns and failures push an update to the tenant they ran for
+realtime_broadcasters = RealtimeBroadcasters(_realtime_snapshot)
+realtime_buffer.add_listener(lambda: realtime_broadcasters.notify(_realtime_key(current_tenant())))
+
+
 @app.get("/realtime/stream")
 async def realtime_stream(request: Request):
     """Server-Sent Events stream for real-time metrics"""
+    broadcaster = realtime_broadcasters.get(_realtime_key(request.state.tenant_id))
+
     async def event_generator():
-        last_sent = time.time()
-        
-        while True:
-            # Check if client disconnected
-            if await request.is_disconnected():
-                logger.info("realtime stream client disconnected")
-                break
-            
-            # Send update every 2 seconds
-            now = time.time()
-            if now - last_sent >= 2.0:
-                # Get current status for all tools
-                status_all_tools = []
+        queue = broadcaster.subscribe()
+        try:
+            while True:
                 try:
-                    tools = get_all_tools()
-                    for tool_data in tools:
-                        s = get_status(tool_data["tool"])
-                        if s:
-                            status_all_tools.append(s)
-                except Exception as e:
-                    logger.error(f"Error getting status in realtime stream: {e}")
-                
-                # Get recent events (last 60 seconds for rate calculation)
-                recent_60s = realtime_buffer.get_recent_events(60)
-                
-                # Calculate rates (per minute, based on last 60 seconds)
-                borrow_rate = len(recent_60s["borrows"])  # events in last 60s = per minute
-                return_rate = len(recent_60s["returns"])
-                failure_rate = len(recent_60s["failures"])
-                
-                # Calculate overage rate (from last 60s)
-                total_borrows = len(recent_60s["borrows"])
-                overage_borrows = sum(1 for b in recent_60s["borrows"] if b.get("is_overage"))
-                overage_rate = (overage_borrows / total_borrows * 100) if total_borrows > 0 else 0
-                
-                # Get per-tool aggregated metrics (for persistent charts)
-                # This is the key: server maintains history per tool
-                tool_metrics = realtime_buffer.aggregate_tool_metrics(window_seconds=REALTIME_RETENTION_SECONDS)
-                
-                # Build event data
-                data = {
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "tools": status_all_tools,
-                    "rates": {
-                        "borrow_per_min": borrow_rate,
-                        "return_per_min": return_rate,
-                        "failure_per_min": failure_rate,
-                        "overage_percent": round(overage_rate, 1)
-                    },
-                    "recent_events": {
-                        "borrows": recent_60s["borrows"][-10:],  # Last 10 from 60s window
-                        "returns": recent_60s["returns"][-10:],
-                        "failures": recent_60s["failures"][-10:]
-                    },
-                    "buffer_stats": realtime_buffer.get_stats_summary(),
-                    "tool_metrics": tool_metrics  # Add per-tool time-series data
-                }
-                
-                # Send as SSE
-                yield f"data: {json.dumps(data)}\n\n"
-                last_sent = now
-            
-            # Small sleep to prevent busy waiting
-            await asyncio.sleep(0.1)
+                    frame = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Check if client disconnected
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield frame
+        finally:
+            broadcaster.unsubscribe(queue)
+            logger.info("realtime stream client disconnected")
     
     return StreamingResponse(
         event_generator(),
@@ -937,23 +972,9 @@ def get_version() -> Dict[str, str]:
 @app.get("/config/budget")
 def get_budget_config():
     """Get budget configuration for all tools"""
-    tools = get_all_tools()
-    # Enrich with spend protection and month-to-date cost
-    from .db import get_customer_max_spend, get_month_to_date_overage_cost
-    enriched = []
-    for t in tools:
-        tool_name = t.get("tool")
-        max_spend = get_customer_max_spend(tool_name)
-        mtd_cost = get_month_to_date_overage_cost(tool_name)
-        remaining = None
-        if max_spend is not None:
-            remaining = max(0.0, float(max_spend) - float(mtd_cost))
-        item = dict(t)
-        item["customer_max_spend"] = max_spend
-        item["month_to_date_overage_cost"] = mtd_cost
-        item["remaining_spend"] = remaining
-        enriched.append(item)
-    return {"tools": enriched}
+    # Spend protection and month-to-date cost come from the same query (one ledger row per tool)
+    from .db import get_budget_overview
+    return {"tools": get_budget_overview()}
 
 
 @app.put("/config/budget")
@@ -996,19 +1017,6 @@ def customer_request_more(req: RequestMorePayload):
     try:
         with get_connection(False) as conn:
             cur = conn.cursor()
-            # Create table if not exists
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS request_more (
-                    id TEXT PRIMARY KEY,
-                    tool TEXT NOT NULL,
-                    message TEXT,
-                    requested_total INTEGER,
-                    requested_overage INTEGER,
-                    created_at TEXT NOT NULL
-                )
-                """
-            )
             rid = str(uuid.uuid4())
             created_at = datetime.now(timezone.utc).isoformat()
             cur.execute(
@@ -1068,12 +1076,15 @@ class CreateApiKeyRequest(BaseModel):
 
 
 @app.get("/api/keys")
-def list_api_keys_endpoint(tenant_id: Optional[str] = None):
+def list_api_keys_endpoint(response: Response, tenant_id: Optional[str] = None, page: PageParams = Depends()):
     """List API keys for the current customer (demo: tenant optional)."""
-    from .db import list_api_keys
+    from .db import list_api_keys_page
     try:
-        keys = list_api_keys(tenant_id)
-        return {"keys": keys}
+        keys, next_cursor = _fetch_page(list_api_keys_page, tenant_id, page=page)
+        _set_next_cursor(response, next_cursor)
+        return {"keys": keys, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error listing api keys: {e}")
         raise HTTPException(500, "Failed to list API keys")
@@ -1116,30 +1127,110 @@ def security_demo_page():
         return f.read()
 
 
-@app.get("/borrows", response_model=List[BorrowRecord])
-def list_borrows(user: Optional[str] = None):
-    # Simple listing of current borrows
-    from .db import get_connection, initialize_database
-    # ensure tables exist
-    initialize_database()
-    with get_connection(False) as conn:
-        cur = conn.cursor()
-        if user:
-            cur.execute(
-                "SELECT id, tool, user, borrowed_at FROM borrows WHERE user = ? ORDER BY borrowed_at DESC",
-                (user,),
-            )
-        else:
-            cur.execute("SELECT id, tool, user, borrowed_at FROM borrows ORDER BY borrowed_at DESC")
-        rows = cur.fetchall()
-        return [BorrowRecord(id=r["id"], tool=r["tool"], user=r["user"], borrowed_at=r["borrowed_at"]) for r in rows]
+@app.get("/borrows", response_model=List[BorrowRecord], response_model_exclude_unset=True)
+def list_borrows(response: Response, user: Optional[str] = None, page: PageParams = Depends()):
+    """Current borrows, newest first; the next page's cursor is in X-Next-Cursor"""
+    rows, next_cursor = _fetch_page(get_borrows_page, user, page=page)
+    _set_next_cursor(response, next_cursor)
+    return [BorrowRecord(**row) for row in rows]
 
 
 @app.get("/overage-charges")
-def list_overage_charges(tool: Optional[str] = None):
-    """Get all overage charges, optionally filtered by tool"""
-    charges = get_overage_charges(tool)
-    return {"charges": charges}
+def list_overage_charges(response: Response, tool: Optional[str] = None, page: PageParams = Depends()):
+    """Overage charges, newest first, optionally filtered by tool"""
+    charges, next_cursor = _fetch_page(get_overage_charges_page, tool, page=page)
+    _set_next_cursor(response, next_cursor)
+    return {"charges": charges, "next_cursor": next_cursor}
+
+
+_PERIOD_PATTERN = r"^\d{4}-\d{2}$"
+
+
+@app.get("/history/leases")
+def list_lease_history(
+    tool: Optional[str] = None,
+    from_period: Optional[str] = Query(None, pattern=_PERIOD_PATTERN),
+    to_period: Optional[str] = Query(None, pattern=_PERIOD_PATTERN),
+    limit: int = Query(1000, ge=1, le=10000),
+):
+    """Completed leases for billing months from_period..to_period (YYYY-MM), hot and archived"""
+    rows = list(itertools.islice(history.iter_rows("lease_history", from_period, to_period, tool), limit))
+    return {"leases": rows, "count": len(rows)}
+
+
+_EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _export_tenant(request: Request, tenant_id: Optional[str]) -> Optional[str]:
+    """
+    Tenant an export is scoped to: admins (API key) may export any tenant,
+    signed-in users only their own.
+    """
+    # Default to the tenant of the request's subdomain
+    request_tenant = getattr(request.state, "tenant_id", None)
+    if request.headers.get("Authorization", "").startswith("Bearer "):
+        verify_admin_api_key(request)
+        return tenant_id or request_tenant
+    user = get_current_user(request.cookies.get(SESSION_COOKIE_NAME))
+    if not user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    own_tenant = user.get("tenant_id") or request_tenant
+    if tenant_id and tenant_id != own_tenant:
+        raise HTTPException(status_code=403, detail="Cannot export another tenant's data")
+    return own_tenant
+
+
+def _export_response(request: Request, name: str, filename: str, fmt: str, tenant_id: Optional[str],
+                     tool: Optional[str], since: Optional[str], until: Optional[str]) -> StreamingResponse:
+    tenant_id = _export_tenant(request, tenant_id)
+    try:
+        exports.validate_time_range(since, until)
+        exports.check_tenant_filter(name, tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("export started name=%s format=%s tenant=%s tool=%s since=%s until=%s", name, fmt, tenant_id, tool, since, until)
+    return StreamingResponse(
+        exports.stream_export(name, fmt, tenant_id, tool, since, until),
+        media_type=_EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+
+@app.get("/export/overage-charges")
+def export_overage_charges(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    tenant_id: Optional[str] = None,
+    tool: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """Stream overage charges (archived months included), oldest first; since inclusive, until exclusive"""
+    return _export_response(request, "overage_charges", "overage-charges", format, tenant_id, tool, since, until)
+
+
+@app.get("/export/borrows")
+def export_borrows(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    state: Literal["active", "completed"] = "active",
+    tenant_id: Optional[str] = None,
+    tool: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """Stream active borrows or completed leases (lease history, archived months included), oldest first"""
+    name = "borrows" if state == "active" else "lease_history"
+    return _export_response(request, name, f"borrows-{state}", format, tenant_id, tool, since, until)
+
+
+@app.post("/api/admin/archive/compact")
+async def compact_archive(request: Request, before: Optional[str] = Query(None, pattern=_PERIOD_PATTERN)):
+    """Move closed months of lease history and overage charges into compressed cold files"""
+    verify_admin_api_key(request)
+    archived = await async_db.run_db(history.compact_closed_periods, before)
+    logger.info("archive compaction partitions=%d", len(archived))
+    return {"archived": archived}
 
 
 # ============================================================================
@@ -1157,20 +1248,6 @@ def vendor_portal_page():
 def get_customers():
     """Get all customers for the vendor (Vector)"""
     try:
-        # Check if multi-tenant tables exist
-        from .db import get_connection
-        with get_connection(True) as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='tenants'")
-            if not cur.fetchone():
-                # Multi-tenant tables don't exist yet, return demo data
-                return {
-                    "customers": [
-                        {"tenant_id": "demo", "company_name": "Demo Company", "domain": "demo.com", "crm_id": "CRM-DEMO-001", "active_licenses": 6, "status": "active"}
-                    ]
-                }
-        
-        # Multi-tenant tables exist, get real data
         customers = get_vendor_customers("techvendor")
         if not customers:
             # Fallback to demo data if none found
@@ -1198,9 +1275,6 @@ def add_customer(req: AddCustomerRequest):
     from .db import get_connection
     
     try:
-        # Ensure multi-tenant tables exist
-        initialize_database(enable_multitenant=True)
-        
         with get_connection(False) as conn:
             cur = conn.cursor()
             now = datetime.now(timezone.utc).isoformat()
@@ -1222,9 +1296,6 @@ def add_customer(req: AddCustomerRequest):
 def provision_license(req: ProvisionLicenseRequest):
     """Provision a new license to a customer"""
     try:
-        # Ensure multi-tenant tables exist
-        initialize_database(enable_multitenant=True)
-        
         package_id = provision_license_to_tenant(
             vendor_id="vector",
             tenant_id=req.tenant_id,
@@ -1292,7 +1363,7 @@ async def admin_create_tenant(req: CreateTenantRequest, request: Request):
     verify_admin_api_key(request)
     
     try:
-        result = create_tenant(
+        result = await async_db.create_tenant(
             company_name=req.company_name,
             contact_email=req.contact_email,
             tenant_id=req.tenant_id,
@@ -1308,14 +1379,57 @@ async def admin_create_tenant(req: CreateTenantRequest, request: Request):
         raise HTTPException(500, f"Failed to create tenant: {str(e)}")
 
 
+async def _iter_body_lines(request: Request):
+    """Yield (line number, text) from a streamed request body without buffering it whole."""
+    buf = b""
+    line_no = 0
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line.decode("utf-8", errors="replace").rstrip("\r")
+    if buf:
+        yield line_no + 1, buf.decode("utf-8", errors="replace").rstrip("\r")
+
+
+@app.post("/api/admin/bulk/provision")
+async def admin_bulk_provision(request: Request, vendor_id: str = "techvendor", format: Optional[Literal["ndjson", "csv"]] = None):
+    """Bulk-create tenants and provision packages/licenses from an NDJSON or CSV body (Admin API)"""
+    verify_admin_api_key(request)
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+    start = time.perf_counter()
+    provisioner = bulk.BulkProvisioner(vendor_id)
+    csv_records = bulk.CsvRecords()
+    async for line_no, line in _iter_body_lines(request):
+        parsed = csv_records.parse([(line_no, line)]) if format == "csv" else bulk.iter_ndjson([(line_no, line)])
+        for record_line, record in parsed:
+            if provisioner.add(record_line, record):
+                await async_db.run_db(provisioner.flush)
+    await async_db.run_db(provisioner.flush)
+
+    report = provisioner.report()
+    report["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(
+        "bulk provision rows=%d failed=%d tenants=%d packages=%d duration_ms=%.1f",
+        report["rows"], report["failed"], report["tenants_created"], report["packages_created"], report["duration_ms"],
+    )
+    return report
+
+
 @app.get("/api/admin/tenants")
-async def admin_list_tenants(request: Request):
-    """List all tenants (Admin API)"""
+async def admin_list_tenants(request: Request, response: Response, page: PageParams = Depends()):
+    """List tenants, one page at a time (Admin API)"""
     verify_admin_api_key(request)
     
     try:
-        tenants = get_all_tenants()
-        return {"tenants": tenants}
+        tenants, next_cursor = await async_db.get_tenants_page(page.limit, page.cursor, page.fields)
+        _set_next_cursor(response, next_cursor)
+        return {"tenants": tenants, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     except Exception as e:
         logger.error(f"Error listing tenants: {e}")
         raise HTTPException(500, f"Failed to list tenants: {str(e)}")
@@ -1327,7 +1441,7 @@ async def admin_get_tenant(tenant_id: str, request: Request):
     verify_admin_api_key(request)
     
     try:
-        tenants = get_all_tenants()
+        tenants = await async_db.get_all_tenants()
         tenant = next((t for t in tenants if t["tenant_id"] == tenant_id), None)
         if not tenant:
             raise HTTPException(404, f"Tenant {tenant_id} not found")
@@ -1345,7 +1459,7 @@ async def admin_create_vendor(req: CreateVendorRequest, request: Request):
     verify_admin_api_key(request)
     
     try:
-        result = create_vendor(
+        result = await async_db.create_vendor(
             vendor_name=req.vendor_name,
             contact_email=req.contact_email,
             vendor_id=req.vendor_id
@@ -1360,13 +1474,16 @@ async def admin_create_vendor(req: CreateVendorRequest, request: Request):
 
 
 @app.get("/api/admin/vendors")
-async def admin_list_vendors(request: Request):
-    """List all vendors (Admin API)"""
+async def admin_list_vendors(request: Request, response: Response, page: PageParams = Depends()):
+    """List vendors, one page at a time (Admin API)"""
     verify_admin_api_key(request)
     
     try:
-        vendors = get_all_vendors()
-        return {"vendors": vendors}
+        vendors, next_cursor = await async_db.get_vendors_page(page.limit, page.cursor, page.fields)
+        _set_next_cursor(response, next_cursor)
+        return {"vendors": vendors, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     except Exception as e:
         logger.error(f"Error listing vendors: {e}")
         raise HTTPException(500, f"Failed to list vendors: {str(e)}")
@@ -1378,7 +1495,7 @@ async def admin_get_vendor(vendor_id: str, request: Request):
     verify_admin_api_key(request)
     
     try:
-        vendors = get_all_vendors()
+        vendors = await async_db.get_all_vendors()
         vendor = next((v for v in vendors if v["vendor_id"] == vendor_id), None)
         if not vendor:
             raise HTTPException(404, f"Vendor {vendor_id} not found")
@@ -1396,60 +1513,32 @@ async def admin_platform_stats(request: Request):
     verify_admin_api_key(request)
     
     try:
-        initialize_database(enable_multitenant=True)
-        
-        with get_connection(True) as conn:
-            cur = conn.cursor()
-            
-            # Tenant stats
-            try:
-                cur.execute("SELECT COUNT(*) FROM tenants")
-                total_tenants = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM tenants WHERE status = 'active'")
-                active_tenants = cur.fetchone()[0]
-            except sqlite3.OperationalError:
-                total_tenants = 0
-                active_tenants = 0
-            
-            # Vendor stats
-            try:
-                cur.execute("SELECT COUNT(*) FROM vendors")
-                total_vendors = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM vendors WHERE status = 'active'")
-                active_vendors = cur.fetchone()[0]
-            except sqlite3.OperationalError:
-                total_vendors = 0
-                active_vendors = 0
-            
-            # License stats
-            try:
-                cur.execute("SELECT COUNT(*) FROM licenses")
-                total_licenses = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM borrows")
-                active_borrows = cur.fetchone()[0]
-            except sqlite3.OperationalError:
-                total_licenses = 0
-                active_borrows = 0
-        
-        return {
-            "tenants": {
-                "total": total_tenants,
-                "active": active_tenants
-            },
-            "vendors": {
-                "total": total_vendors,
-                "active": active_vendors
-            },
-            "licenses": {
-                "total_provisioned": total_licenses,
-                "active_borrows": active_borrows
-            }
-        }
+        return await async_db.get_platform_stats()
     except Exception as e:
         logger.error(f"Error getting platform stats: {e}")
         raise HTTPException(500, f"Failed to get platform stats: {str(e)}")
 
 
+def _accepted_job(job: dict) -> JSONResponse:
+    """202 response for a queued background job; poll status_url for progress."""
+    logger.info("Admin queued %s for %s job_id=%s", job["kind"], job["target_id"], job["job_id"])
+    return JSONResponse(
+        status_code=202,
+        content={**job, "status_url": f"/api/admin/jobs/{job['job_id']}"},
+        headers={"Location": f"/api/admin/jobs/{job['job_id']}"},
+    )
+
+
+@app.get("/api/admin/jobs/{job_id}")
+async def admin_get_job(job_id: str, request: Request):
+    """Status and progress of a background job (Admin API)"""
+    verify_admin_api_key(request)
+    job = await async_db.run_db(jobs.get_job, job_id)
+    if job is None:
+        raise HTTPException(404, f"Job {job_id} not found")
+    return job
+
+
 @app.delete("/api/admin/tenants/{tenant_id}")
 async def admin_delete_tenant(tenant_id: str, request: Request, hard_delete: bool = False):
     """Delete a tenant (Admin API)
@@ -1461,7 +1550,9 @@ async def admin_delete_tenant(tenant_id: str, request: Request, hard_delete: boo
     verify_admin_api_key(request)
     
     try:
-        result = delete_tenant(tenant_id, hard_delete=hard_delete)
+        if hard_delete:
+            return _accepted_job(await async_db.run_db(jobs.submit_hard_delete, "delete_tenant", tenant_id))
+        result = await async_db.delete_tenant(tenant_id, hard_delete=False)
         logger.info(f"Admin deleted tenant: {tenant_id} (hard_delete={hard_delete})")
         return result
     except ValueError as e:
@@ -1482,7 +1573,9 @@ async def admin_delete_vendor(vendor_id: str, request: Request, hard_delete: boo
     verify_admin_api_key(request)
     
     try:
-        result = delete_vendor(vendor_id, hard_delete=hard_delete)
+        if hard_delete:
+            return _accepted_job(await async_db.run_db(jobs.submit_hard_delete, "delete_vendor", vendor_id))
+        result = await async_db.delete_vendor(vendor_id, hard_delete=False)
         logger.info(f"Admin deleted vendor: {vendor_id} (hard_delete={hard_delete})")
         return result
     except ValueError as e:
@@ -1547,61 +1640,70 @@ def settings_page(user: dict = Depends(require_auth)):
         return f.read()
 
 
+# Reverse proxies (comma-separated addresses/CIDRs) whose X-Forwarded-For is believed,
+# e.g. Fly's proxy; without them every client behind the proxy shares one address
+TRUSTED_PROXIES = [ipaddress.ip_network(net.strip(), strict=False)
+                   for net in os.getenv("LICENSE_TRUSTED_PROXIES", "").split(",") if net.strip()]
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in net for net in TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """
+    Originating client address. X-Forwarded-For is read right to left, skipping
+    trusted proxies, and only when the peer itself is one, so clients cannot
+    spoof it by sending the header themselves.
+    """
+    peer = request.client.host if request.client else None
+    if peer is None or not _is_trusted_proxy(peer):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
 @app.post("/api/auth/login")
 async def login(
+    request: Request,
     username: str = Form(...),
     password: str = Form(...),
     response: Response = None
 ):
     """Login endpoint"""
-    if not verify_user_credentials(username, password):
+    retry_after = passwords.login_throttle.check(username, client_ip(request))
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts. Try again later.",
+            headers={"Retry-After": str(int(retry_after))}
+        )
+    if not await async_db.verify_user_credentials(username, password):
+        passwords.login_throttle.record_failure(username)
         raise HTTPException(status_code=401, detail="Invalid username or password")
+    passwords.login_throttle.record_success(username)
     
     # Get user details
-    with get_connection(True) as conn:
-        cur = conn.cursor()
-        # Try to get all columns, but handle missing columns gracefully
-        try:
-            cur.execute("""
-                SELECT username, tenant_id, vendor_id, role, status
-                FROM users WHERE username = ?
-            """, (username,))
-        except sqlite3.OperationalError:
-            # Fallback if columns don't exist yet
-            cur.execute("""
-                SELECT username
-                FROM users WHERE username = ?
-            """, (username,))
-        
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        user_data = dict(row)
-        
-        # Check if user is active (if status column exists)
-        if user_data.get("status") == "deleted":
-            raise HTTPException(status_code=403, detail="Account has been deleted")
-        
-        # Update last login (if column exists)
-        try:
-            with get_connection(False) as conn2:
-                cur2 = conn2.cursor()
-                # Try to add column if it doesn't exist
-                try:
-                    cur2.execute("ALTER TABLE users ADD COLUMN last_login_at TEXT")
-                except sqlite3.OperationalError:
-                    pass  # Column already exists
-                
-                try:
-                    cur2.execute("""
-                        UPDATE users SET last_login_at = ? WHERE username = ?
-                    """, (datetime.now(timezone.utc).isoformat(), username))
-                    conn2.commit()
-                except sqlite3.OperationalError:
-                    pass  # Column doesn't exist, skip
-        except Exception:
-            pass  # Non-critical
+    user_data = await async_db.get_login_user(username)
+    if not user_data:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    # Check if user is active
+    if user_data.get("status") == "deleted":
+        raise HTTPException(status_code=403, detail="Account has been deleted")
+    
+    # Update last login
+    try:
+        await async_db.record_user_login(username)
+    except Exception:
+        pass  # Non-critical
     
     # Create session token
     session_data = {
@@ -1643,32 +1745,13 @@ async def setup_password(
 ):
     """Setup password for first-time login"""
     # Verify setup token
-    with get_connection(True) as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT username, tenant_id, vendor_id, role, status
-            FROM users WHERE setup_token = ? AND status = 'pending_verification'
-        """, (setup_token,))
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=400, detail="Invalid or expired setup token")
-        
-        user_data = dict(row)
-        username = user_data["username"]
-    
-    # Hash password
-    pwd_context = get_password_context()
-    password_hash = pwd_context.hash(password)
+    user_data = await async_db.get_pending_user_by_setup_token(setup_token)
+    if not user_data:
+        raise HTTPException(status_code=400, detail="Invalid or expired setup token")
+    username = user_data["username"]
     
-    # Update user
-    with get_connection(False) as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE users 
-            SET password_hash = ?, status = 'active', setup_token = NULL
-            WHERE username = ?
-        """, (password_hash, username))
-        conn.commit()
+    # Hash password and activate the account
+    await async_db.activate_user(username, password)
     
     # Create session and redirect
     session_data = {
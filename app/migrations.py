@@ -0,0 +1,495 @@
+"""
+Versioned schema migrations for the license server database.
+
+Every schema change lives here as a numbered migration. Applied versions are
+recorded in the ``schema_version`` table, so the migration runner is cheap to
+call at startup and request handlers can assume the schema is in place.
+
+Migrations must be idempotent against databases created by older releases
+(which created tables and columns lazily), hence ``IF NOT EXISTS`` and
+``add_column_if_missing``.
+
+Run manually with:
+    python -m app.migrations [--db PATH] [--multitenant] [--status]
+"""
+
+import argparse
+import sqlite3
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple
+
+
+def table_exists(cur: sqlite3.Cursor, table: str) -> bool:
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cur.fetchone() is not None
+
+
+def table_columns(cur: sqlite3.Cursor, table: str) -> set:
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cur.fetchall()}
+
+
+def add_column_if_missing(cur: sqlite3.Cursor, table: str, column: str, ddl: str) -> None:
+    if column not in table_columns(cur, table):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+# ============================================================================
+# Migrations
+# ============================================================================
+
+def _001_baseline(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Core licensing tables (single-tenant or tenant-keyed flavour)."""
+    if multitenant:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS licenses (
+                id TEXT PRIMARY KEY,
+                tenant_id TEXT NOT NULL,
+                package_id TEXT,
+                tool TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                borrowed INTEGER NOT NULL DEFAULT 0,
+                commit_qty INTEGER DEFAULT 0,
+                max_overage INTEGER DEFAULT 0,
+                commit_price REAL DEFAULT 0.0,
+                overage_price_per_license REAL DEFAULT 0.0,
+                FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id),
+                FOREIGN KEY(package_id) REFERENCES license_packages(package_id),
+                UNIQUE(tenant_id, tool)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS borrows (
+                id TEXT PRIMARY KEY,
+                tenant_id TEXT NOT NULL,
+                tool TEXT NOT NULL,
+                user TEXT NOT NULL,
+                borrowed_at TEXT NOT NULL,
+                is_overage INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS overage_charges (
+                id TEXT PRIMARY KEY,
+                tenant_id TEXT NOT NULL,
+                tool TEXT NOT NULL,
+                borrow_id TEXT NOT NULL,
+                user TEXT NOT NULL,
+                charged_at TEXT NOT NULL,
+                amount REAL NOT NULL,
+                FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id),
+                FOREIGN KEY(borrow_id) REFERENCES borrows(id)
+            )
+            """
+        )
+    else:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS licenses (
+                tool TEXT PRIMARY KEY,
+                total INTEGER NOT NULL,
+                borrowed INTEGER NOT NULL DEFAULT 0,
+                commit_qty INTEGER DEFAULT 0,
+                max_overage INTEGER DEFAULT 0,
+                commit_price REAL DEFAULT 0.0,
+                overage_price_per_license REAL DEFAULT 0.0,
+                vendor_total INTEGER,
+                vendor_commit_qty INTEGER,
+                vendor_max_overage INTEGER,
+                customer_total INTEGER,
+                customer_commit_qty INTEGER,
+                customer_max_overage INTEGER
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS borrows (
+                id TEXT PRIMARY KEY,
+                tool TEXT NOT NULL,
+                user TEXT NOT NULL,
+                borrowed_at TEXT NOT NULL,
+                is_overage INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY(tool) REFERENCES licenses(tool)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS overage_charges (
+                id TEXT PRIMARY KEY,
+                tool TEXT NOT NULL,
+                borrow_id TEXT NOT NULL,
+                user TEXT NOT NULL,
+                charged_at TEXT NOT NULL,
+                amount REAL NOT NULL,
+                FOREIGN KEY(tool) REFERENCES licenses(tool),
+                FOREIGN KEY(borrow_id) REFERENCES borrows(id)
+            )
+            """
+        )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password_hash TEXT NOT NULL
+        )
+        """
+    )
+    # API Keys table (for tenant authentication)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS api_keys (
+            id TEXT PRIMARY KEY,
+            tenant_id TEXT,
+            key_hash TEXT NOT NULL UNIQUE,
+            name TEXT,
+            environment TEXT DEFAULT 'live',
+            created_at TEXT NOT NULL,
+            last_used_at TEXT,
+            expires_at TEXT,
+            status TEXT DEFAULT 'active',
+            scopes TEXT DEFAULT 'borrow,return,status',
+            FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_tenant ON api_keys(tenant_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_status ON api_keys(status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_hash ON api_keys(key_hash)")
+
+
+def _002_multitenant_catalog(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Tenants, vendors and license packages (used by the vendor portal and admin API)."""
+    # Tenants (customers like BMW, Mercedes, Audi)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tenants (
+            tenant_id TEXT PRIMARY KEY,
+            company_name TEXT NOT NULL,
+            domain TEXT,
+            crm_id TEXT UNIQUE,
+            status TEXT DEFAULT 'active',
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    # Vendors (like Vector, Greenhills)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS vendors (
+            vendor_id TEXT PRIMARY KEY,
+            vendor_name TEXT NOT NULL,
+            contact_email TEXT,
+            api_key_hash TEXT,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    # License packages (vendor → tenant)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS license_packages (
+            package_id TEXT PRIMARY KEY,
+            tenant_id TEXT NOT NULL,
+            vendor_id TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            product_name TEXT NOT NULL,
+            crm_opportunity_id TEXT,
+            status TEXT DEFAULT 'active',
+            provisioned_at TEXT NOT NULL,
+            FOREIGN KEY(tenant_id) REFERENCES tenants(tenant_id),
+            FOREIGN KEY(vendor_id) REFERENCES vendors(vendor_id)
+        )
+        """
+    )
+
+
+def _003_budget_columns(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Vendor limits, customer restrictions and spend protection on licenses."""
+    for column, ddl in (
+        ("vendor_total", "INTEGER"),
+        ("vendor_commit_qty", "INTEGER"),
+        ("vendor_max_overage", "INTEGER"),
+        ("customer_total", "INTEGER"),
+        ("customer_commit_qty", "INTEGER"),
+        ("customer_max_overage", "INTEGER"),
+        ("customer_max_spend", "REAL"),
+    ):
+        add_column_if_missing(cur, "licenses", column, ddl)
+
+
+def _004_user_account_columns(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Tenant/vendor ownership, role, onboarding state and login tracking for users."""
+    for column, ddl in (
+        ("tenant_id", "TEXT"),
+        ("role", "TEXT DEFAULT 'admin'"),
+        ("status", "TEXT DEFAULT 'pending_verification'"),
+        ("setup_token", "TEXT"),
+        ("created_at", "TEXT"),
+        ("last_login_at", "TEXT"),
+        ("vendor_id", "TEXT"),
+    ):
+        add_column_if_missing(cur, "users", column, ddl)
+
+
+def _005_admin_columns(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Admin user links and vendor status."""
+    add_column_if_missing(cur, "tenants", "admin_user_id", "TEXT")
+    add_column_if_missing(cur, "vendors", "status", "TEXT DEFAULT 'active'")
+    add_column_if_missing(cur, "vendors", "admin_user_id", "TEXT")
+
+
+def _006_request_more(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Customer requests for more capacity (vendor review queue)."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS request_more (
+            id TEXT PRIMARY KEY,
+            tool TEXT NOT NULL,
+            message TEXT,
+            requested_total INTEGER,
+            requested_overage INTEGER,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _007_overage_ledger(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Running overage totals per (tool, tenant, billing period), backfilled from charges."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS overage_ledger (
+            tool TEXT NOT NULL,
+            tenant_id TEXT NOT NULL DEFAULT '',
+            period TEXT NOT NULL,
+            charge_count INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (tool, tenant_id, period)
+        )
+        """
+    )
+    tenant_expr = "COALESCE(tenant_id, '')" if "tenant_id" in table_columns(cur, "overage_charges") else "''"
+    cur.execute(
+        f"""
+        INSERT OR REPLACE INTO overage_ledger(tool, tenant_id, period, charge_count, amount)
+        SELECT tool, {tenant_expr}, substr(charged_at, 1, 7), COUNT(*), COALESCE(SUM(amount), 0.0)
+        FROM overage_charges
+        GROUP BY tool, {tenant_expr}, substr(charged_at, 1, 7)
+        """
+    )
+
+
+def _008_engine_state(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Key/value bookkeeping for the in-memory allocation engine (last checkpointed journal seq)."""
+    cur.execute("CREATE TABLE IF NOT EXISTS engine_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+
+def _009_lease_expiry(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Lease TTL and owner columns on borrows, indexed for the expiry sweeper and bulk release."""
+    add_column_if_missing(cur, "borrows", "expires_at", "TEXT")
+    add_column_if_missing(cur, "borrows", "session_id", "TEXT")
+    add_column_if_missing(cur, "borrows", "host", "TEXT")
+    # Partial index: borrows without a TTL never show up in sweeper scans
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_borrows_expires_at ON borrows(expires_at) WHERE expires_at IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_borrows_session ON borrows(session_id) WHERE session_id IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_borrows_host ON borrows(host) WHERE host IS NOT NULL")
+
+
+def _010_lease_history(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Append-only history of completed leases, partitioned by month, plus the cold-tier catalog."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lease_history (
+            id TEXT PRIMARY KEY,
+            period TEXT NOT NULL,
+            tool TEXT NOT NULL,
+            user TEXT NOT NULL,
+            borrowed_at TEXT NOT NULL,
+            returned_at TEXT NOT NULL,
+            duration_seconds REAL,
+            is_overage INTEGER NOT NULL DEFAULT 0,
+            end_reason TEXT NOT NULL,
+            session_id TEXT,
+            host TEXT
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_lease_history_period_tool ON lease_history(period, tool)")
+    # (charged_at, id) serves both the archive range scans and keyset pages (migration 11)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_overage_charges_charged_at_id ON overage_charges(charged_at, id)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS archive_partitions (
+            table_name TEXT NOT NULL,
+            period TEXT NOT NULL,
+            part INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            archived_at TEXT NOT NULL,
+            PRIMARY KEY(table_name, period, part)
+        )
+        """
+    )
+
+
+def _011_keyset_indexes(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Composite (sort key, id) indexes backing keyset pagination of list endpoints."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_borrows_borrowed_at_id ON borrows(borrowed_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_borrows_user_borrowed_at_id ON borrows(user, borrowed_at, id)")
+    # overage_charges(charged_at, id) is created with the archive tables in migration 10
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_overage_charges_tool_charged_at_id ON overage_charges(tool, charged_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_created_at_id ON api_keys(created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_tenant_created_at_id ON api_keys(tenant_id, created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tenants_company_name_id ON tenants(company_name, tenant_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vendors_vendor_name_id ON vendors(vendor_name, vendor_id)")
+
+
+def _012_jobs(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Background jobs (chunked hard deletes) with resumable progress."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            target_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            step TEXT,
+            rows_deleted INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+
+
+def _013_charge_tenants(cur: sqlite3.Cursor, multitenant: bool) -> None:
+    """Borrowing tenant on overage charges (the tenant-keyed flavour has it already), so exports can be scoped."""
+    add_column_if_missing(cur, "overage_charges", "tenant_id", "TEXT NOT NULL DEFAULT ''")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_overage_charges_tenant_charged_at_id ON overage_charges(tenant_id, charged_at, id)"
+    )
+
+
+Migration = Tuple[int, str, Callable[[sqlite3.Cursor, bool], None]]
+
+MIGRATIONS: List[Migration] = [
+    (1, "baseline", _001_baseline),
+    (2, "multitenant_catalog", _002_multitenant_catalog),
+    (3, "budget_columns", _003_budget_columns),
+    (4, "user_account_columns", _004_user_account_columns),
+    (5, "admin_columns", _005_admin_columns),
+    (6, "request_more", _006_request_more),
+    (7, "overage_ledger", _007_overage_ledger),
+    (8, "engine_state", _008_engine_state),
+    (9, "lease_expiry", _009_lease_expiry),
+    (10, "lease_history", _010_lease_history),
+    (11, "keyset_indexes", _011_keyset_indexes),
+    (12, "jobs", _012_jobs),
+    (13, "charge_tenants", _013_charge_tenants),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ============================================================================
+# Runner
+# ============================================================================
+
+def current_version(conn: sqlite3.Connection) -> int:
+    cur = conn.cursor()
+    if not table_exists(cur, "schema_version"):
+        return 0
+    cur.execute("SELECT MAX(version) FROM schema_version")
+    row = cur.fetchone()
+    return int(row[0] or 0)
+
+
+def migrate(conn: sqlite3.Connection, enable_multitenant: bool = False) -> List[int]:
+    """
+    Apply all pending migrations, each in its own immediate transaction.
+
+    Args:
+        conn: Read-write connection
+        enable_multitenant: Create tenant-keyed licensing tables on a fresh database
+
+    Returns:
+        List of versions applied by this call (empty when already up to date)
+    """
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+
+    if conn.in_transaction:
+        conn.commit()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.commit()
+
+    applied = []
+    for version, name, apply in MIGRATIONS:
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock: another worker may have applied it
+            cur.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+            if cur.fetchone():
+                conn.rollback()
+                continue
+            apply(cur, enable_multitenant)
+            cur.execute(
+                "INSERT INTO schema_version(version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.now(timezone.utc).isoformat()),
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Apply license server schema migrations")
+    parser.add_argument("--db", help="Database path (defaults to LICENSE_DB_PATH or licenses.db)")
+    parser.add_argument("--multitenant", action="store_true", help="Use tenant-keyed licensing tables on a fresh database")
+    parser.add_argument("--status", action="store_true", help="Only print the current schema version")
+    args = parser.parse_args(argv)
+
+    from .db import get_db_path, get_pool
+
+    db_path = args.db or get_db_path()
+    pool = get_pool(db_path, readonly=False)
+    conn = pool.acquire()
+    try:
+        if args.status:
+            print(f"{db_path}: schema version {current_version(conn)} (latest {LATEST_VERSION})")
+            return 0
+        applied = migrate(conn, enable_multitenant=args.multitenant)
+        if applied:
+            print(f"{db_path}: applied migrations {', '.join(str(v) for v in applied)}")
+        else:
+            print(f"{db_path}: schema up to date (version {LATEST_VERSION})")
+        return 0
+    finally:
+        pool.release(conn)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
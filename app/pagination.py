@@ -0,0 +1,93 @@
+"""
+Keyset (cursor) pagination and sparse fieldsets for list endpoints.
+
+Pages are ordered by an indexed sort key that ends in a unique column, and the
+cursor is the last row's sort key (base64url JSON). The next page is selected
+with a row-value comparison, ``WHERE (sort_key, id) < (?, ?)``, which SQLite
+answers with an index range scan, so page N costs the same as page 1 and
+memory is bounded by the page size however many rows exist.
+
+``fields=`` projections are pushed down into the SELECT list; sort key
+columns are always fetched (for the cursor) but only returned if requested.
+"""
+
+import base64
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_PAGE_SIZE = int(os.getenv("LICENSE_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("LICENSE_PAGE_SIZE_MAX", "1000"))
+
+
+def encode_cursor(values: Sequence) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    # Only scalars can be bound as SQL parameters
+    if any(v is not None and not isinstance(v, (str, int, float)) for v in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_fields(fields: Optional[str], columns: Dict[str, str]) -> List[str]:
+    """Validate a comma-separated fields= projection (empty = every column)."""
+    if not fields:
+        return list(columns)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in columns]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)} (allowed: {', '.join(columns)})")
+    return list(dict.fromkeys(requested))
+
+
+def fetch_page(cur: sqlite3.Cursor, source: str, columns: Dict[str, str], sort: Sequence[str],
+               descending: bool = False, where: Optional[List[str]] = None, params: Optional[list] = None,
+               limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+               fields: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Fetch one page of rows.
+
+    Args:
+        source: FROM clause (table or join)
+        columns: public field name -> SQL expression
+        sort: field names forming a unique sort key (backed by an index)
+        descending: newest/highest first
+        where/params: extra filters
+        limit: page size
+        cursor: next_cursor from the previous page
+        fields: comma-separated projection
+
+    Returns:
+        (rows, next_cursor) - next_cursor is None on the last page
+
+    Raises:
+        ValueError: unknown field or malformed cursor
+    """
+    selected = parse_fields(fields, columns)
+    fetched = selected + [f for f in sort if f not in selected]
+    where = list(where or [])
+    params = list(params or [])
+    sort_exprs = [columns[f] for f in sort]
+    if cursor:
+        where.append(f"({', '.join(sort_exprs)}) {'<' if descending else '>'} ({', '.join('?' for _ in sort)})")
+        params.extend(decode_cursor(cursor, len(sort)))
+    direction = "DESC" if descending else "ASC"
+    cur.execute(
+        f"SELECT {', '.join(f'{columns[f]} AS {f}' for f in fetched)} FROM {source}"
+        f" WHERE {' AND '.join(where) or '1'}"
+        f" ORDER BY {', '.join(f'{expr} {direction}' for expr in sort_exprs)} LIMIT ?",
+        params + [limit + 1],
+    )
+    rows = cur.fetchall()
+    next_cursor = encode_cursor([rows[limit - 1][f] for f in sort]) if len(rows) > limit else None
+    return [{f: row[f] for f in selected} for row in rows[:limit]], next_cursor
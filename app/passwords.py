@@ -0,0 +1,191 @@
+"""
+Password hashing off the event loop, and login throttling.
+
+pbkdf2_sha256 verification costs tens of milliseconds of pure CPU. Run on the
+worker that also serves borrows (or on a thread, where it still competes for
+the GIL), every login stalls licensing traffic. Hashing and verification
+therefore run in a small, bounded process pool (LICENSE_PASSWORD_WORKERS,
+default 2; 0 hashes in the calling thread) with async wrappers for route
+handlers.
+
+``LoginThrottle`` is a sliding-window limiter on login attempts per username
+and per client IP, checked before any hashing is done, so password spraying
+gets 429s instead of saturating the pool.
+"""
+
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Dict, Optional
+
+from passlib.context import CryptContext
+from prometheus_client import Counter
+
+logger = logging.getLogger("license-server")
+
+PASSWORD_WORKERS = int(os.getenv("LICENSE_PASSWORD_WORKERS", "2"))
+LOGIN_WINDOW_SECONDS = float(os.getenv("LICENSE_LOGIN_WINDOW_SECONDS", "300"))
+LOGIN_MAX_PER_USER = int(os.getenv("LICENSE_LOGIN_MAX_PER_USER", "10"))
+LOGIN_MAX_PER_IP = int(os.getenv("LICENSE_LOGIN_MAX_PER_IP", "50"))
+# Bounds the throttle's memory under a flood of distinct usernames/IPs
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LICENSE_LOGIN_THROTTLE_MAX_KEYS", "10000"))
+
+login_throttled_total = Counter(
+    "license_login_throttled_total",
+    "Login attempts rejected by the throttle",
+    ["scope"],
+)
+
+_context: Optional[CryptContext] = None
+
+
+def _get_context() -> CryptContext:
+    global _context
+    if _context is None:
+        _context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+    return _context
+
+
+# Run inside the pool's worker processes (module-level so they can be pickled)
+def _hash(password: str) -> str:
+    return _get_context().hash(password)
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    try:
+        return _get_context().verify(password, password_hash)
+    except ValueError:
+        return False  # e.g. the "pending" placeholder of users who never set a password
+
+
+# ============================================================================
+# Process pool
+# ============================================================================
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """The hashing pool, or None when LICENSE_PASSWORD_WORKERS is 0."""
+    global _pool
+    if PASSWORD_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: forking a process that runs the writer/sweeper threads is unsafe
+                _pool = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+# The blocking helpers hash in the calling thread: they serve seeding and scripts,
+# where spawning pool workers would re-import an unguarded __main__.
+def hash_password(password: str) -> str:
+    """Hash a password (blocking; from async code use hash_password_async)."""
+    return _hash(password)
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Check a password against its hash (blocking; see verify_password_async)."""
+    return _verify(password, password_hash)
+
+
+async def _run_in_pool(fn, *args):
+    pool = get_pool()
+    if pool is None:
+        return await asyncio.to_thread(fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool(_hash, password)
+
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    return await _run_in_pool(_verify, password, password_hash)
+
+
+# ============================================================================
+# Login throttle
+# ============================================================================
+
+class LoginThrottle:
+    """
+    Sliding-window limit on login attempts per username and per client IP.
+
+    Every attempt counts against its IP; only failed attempts are kept
+    against the username (a successful login clears them), so a user who
+    mistypes a few times is not locked out by their own later success.
+    """
+
+    def __init__(self, window: float = LOGIN_WINDOW_SECONDS, max_per_user: int = LOGIN_MAX_PER_USER,
+                 max_per_ip: int = LOGIN_MAX_PER_IP, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.window = window
+        self.limits = {"user": max_per_user, "ip": max_per_ip}
+        self.max_keys = max(1, max_keys)
+        self._attempts: Dict[tuple, Deque[float]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key: tuple, now: float) -> Deque[float]:
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return collections.deque()
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        return attempts
+
+    def _record(self, key: tuple, now: float) -> None:
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            if len(self._attempts) >= self.max_keys:
+                self._attempts.popitem(last=False)  # least recently attempted key
+            attempts = self._attempts[key] = collections.deque()
+        else:
+            self._attempts.move_to_end(key)
+        attempts.append(now)
+
+    def check(self, username: str, ip: Optional[str]) -> Optional[float]:
+        """
+        Admit a login attempt and count it against the IP.
+
+        Returns None if the attempt may proceed, otherwise the seconds until
+        it would be allowed (for a Retry-After header).
+        """
+        now = time.monotonic()
+        keys = [("user", username)] + ([("ip", ip)] if ip else [])
+        with self._lock:
+            for key in keys:
+                attempts = self._recent(key, now)
+                if len(attempts) >= self.limits[key[0]]:
+                    login_throttled_total.labels(scope=key[0]).inc()
+                    logger.warning("login throttled %s=%s attempts=%d", key[0], key[1], len(attempts))
+                    return max(attempts[0] + self.window - now, 1.0)
+            if ip:
+                self._record(("ip", ip), now)
+        return None
+
+    def record_failure(self, username: str) -> None:
+        with self._lock:
+            self._record(("user", username), time.monotonic())
+
+    def record_success(self, username: str) -> None:
+        with self._lock:
+            self._attempts.pop(("user", username), None)
+
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,604 @@
+"""
+Real-time metrics buffer behind /realtime/stats and /realtime/stream.
+
+Raw borrow/return/failure events are kept for REALTIME_RETENTION_HOURS for
+the recent-event lists, in columns rather than one dict per event
+(``EventColumns``): float epoch timestamps, tool/user/reason strings
+interned to integer ids, borrow ids packed as 16-byte UUIDs. That is a few
+dozen bytes per event instead of several hundred. The columns together are
+capped at LICENSE_REALTIME_MEMORY_BYTES (oldest events are evicted first).
+The string table is rebuilt from the ids still referenced by live rows and
+minute buckets whenever it has doubled since the last rebuild, so users that
+only appear in evicted events do not accumulate. Since timestamps only grow, windows and retention cutoffs are found with
+``bisect`` instead of a scan.
+
+The dashboard's charts and rates are not computed from raw events: every
+``add_*`` call also updates, in O(1),
+
+- a per-tool ring of one-minute buckets covering the retention window
+  (borrow count, overage count, distinct users), read by
+  ``aggregate_tool_metrics``;
+- exponentially weighted one-minute rate meters for borrows, returns,
+  failures and overage borrows, read by ``rates``.
+
+So an SSE tick costs O(tools x minutes) however many events were recorded.
+
+``RealtimeBroadcaster`` runs one task for all /realtime/stream clients: it
+builds and serializes a snapshot every LICENSE_REALTIME_INTERVAL_SECONDS, or
+sooner when the buffer records an event, and hands the same frame to every
+subscriber's bounded queue. A client that falls behind loses its oldest
+undelivered frame rather than holding memory or the loop. With no
+subscribers the task exits. ``RealtimeBroadcasters`` keeps one broadcaster
+per key (the tenant, when the database is sharded), so each tenant's stream
+is built from its own data.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger("license-server")
+
+# Real-time metrics buffer (keeps last 6 hours)
+# Each event is stored with timestamp for time-based retention
+REALTIME_RETENTION_HOURS = 6
+REALTIME_RETENTION_SECONDS = REALTIME_RETENTION_HOURS * 3600
+REALTIME_RETENTION_MINUTES = REALTIME_RETENTION_SECONDS // 60
+# Raw event storage budget, split between borrows, returns and failures 10:10:1
+REALTIME_MEMORY_BYTES = int(os.getenv("LICENSE_REALTIME_MEMORY_BYTES", str(8 * 1024 * 1024)))
+# SSE snapshots: at least every INTERVAL, at most every MIN_INTERVAL when events arrive
+REALTIME_INTERVAL_SECONDS = float(os.getenv("LICENSE_REALTIME_INTERVAL_SECONDS", "2"))
+REALTIME_MIN_INTERVAL_SECONDS = float(os.getenv("LICENSE_REALTIME_MIN_INTERVAL_SECONDS", "0.25"))
+REALTIME_SUBSCRIBER_QUEUE = int(os.getenv("LICENSE_REALTIME_SUBSCRIBER_QUEUE", "2"))
+# Interned strings are not pruned below this many
+INTERNER_MIN_COMPACT = 1024
+
+realtime_subscribers = Gauge(
+    "license_realtime_subscribers",
+    "Open /realtime/stream connections",
+)
+realtime_frames_dropped_total = Counter(
+    "license_realtime_frames_dropped_total",
+    "Realtime frames discarded because a subscriber fell behind",
+)
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def _minute_iso(minute: int) -> str:
+    return _iso(minute * 60)
+
+
+class Interner:
+    """Maps repeated strings (tools, users, failure reasons) to small ints; None is -1."""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.values: List[str] = []
+        self.value_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def nbytes(self) -> int:
+        return self.value_bytes + sys.getsizeof(self.ids) + sys.getsizeof(self.values)
+
+    def id(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+            self.value_bytes += sys.getsizeof(value)
+        return value_id
+
+    def value(self, value_id: int) -> Optional[str]:
+        return None if value_id < 0 else self.values[value_id]
+
+    def compact(self, live: Set[int]) -> List[int]:
+        """Keep only the live ids; returns old id -> new id (-1 for dropped ids and for -1 itself)."""
+        mapping = [-1] * (len(self.values) + 1)  # the extra slot makes mapping[-1] == -1
+        values, self.ids, self.values, self.value_bytes = self.values, {}, [], 0
+        for old_id, value in enumerate(values):
+            if old_id in live:
+                mapping[old_id] = self.id(value)
+        return mapping
+
+
+class MinuteBucket:
+    __slots__ = ("minute", "count", "overage_count", "users")  # users: interned ids
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.count = 0
+        self.overage_count = 0
+        self.users = set()
+
+
+class MinuteRing:
+    """Borrow counts for one tool in one-minute buckets; the slot for a minute is reused once it expires."""
+
+    def __init__(self, minutes: int = REALTIME_RETENTION_MINUTES + 1):
+        self.slots: List[Optional[MinuteBucket]] = [None] * minutes
+
+    def add(self, minute: int, user: int, is_overage: bool) -> None:
+        index = minute % len(self.slots)
+        bucket = self.slots[index]
+        if bucket is None or bucket.minute != minute:
+            bucket = self.slots[index] = MinuteBucket(minute)
+        bucket.count += 1
+        bucket.users.add(user)
+        if is_overage:
+            bucket.overage_count += 1
+
+    def expire(self, oldest_minute: int) -> Set[int]:
+        """Clear buckets before oldest_minute; returns the user ids the others reference."""
+        users = set()
+        for index, bucket in enumerate(self.slots):
+            if bucket is None:
+                continue
+            if bucket.minute < oldest_minute:
+                self.slots[index] = None
+            else:
+                users |= bucket.users
+        return users
+
+    def remap(self, mapping: List[int]) -> None:
+        for bucket in self.slots:
+            if bucket is not None:
+                bucket.users = {mapping[user] for user in bucket.users}
+
+    def series(self, first_minute: int, last_minute: int, names: Interner) -> List[dict]:
+        """Non-empty buckets from first_minute to last_minute, oldest first."""
+        first_minute = max(first_minute, last_minute - len(self.slots) + 1)
+        points = []
+        for minute in range(first_minute, last_minute + 1):
+            bucket = self.slots[minute % len(self.slots)]
+            if bucket is not None and bucket.minute == minute:
+                points.append({
+                    "timestamp": _minute_iso(minute),
+                    "count": bucket.count,
+                    "users": [names.value(user) for user in bucket.users],
+                    "overage_count": bucket.overage_count,
+                })
+        return points
+
+
+class EventColumns:
+    """
+    One kind of event in parallel arrays, oldest first, in at most
+    ``budget_rows`` rows. Rows before ``head`` are evicted; they are
+    reclaimed in bulk once they make up an eighth of the budget, so
+    eviction is amortized O(1) and live plus evicted rows fit the budget.
+    """
+
+    ROW_BYTES = 8 + 4 + 4 + 4 + 16  # ts, tool, user, code, packed id
+
+    def __init__(self, budget_rows: int, interned_code: bool = False):
+        budget_rows = max(2, budget_rows)
+        self.interned_code = interned_code
+        self.slack = max(1, budget_rows // 9)
+        self.max_rows = budget_rows - self.slack
+        self.ts = array("d")
+        self.tool = array("i")
+        self.user = array("i")
+        self.code = array("i")  # borrows: is_overage; failures: interned reason
+        self.ids = bytearray()
+        self.head = 0
+        self.offset = 0  # rows reclaimed so far (row numbers of other_ids are absolute)
+        self.other_ids: Dict[int, str] = {}  # ids that are not canonical UUID strings
+
+    def __len__(self) -> int:
+        return len(self.ts) - self.head
+
+    def nbytes(self) -> int:
+        return len(self.ts) * self.ROW_BYTES
+
+    def append(self, ts: float, tool: int, user: int, code: int, event_id: Optional[str]) -> None:
+        if len(self.ts) > self.head and ts < self.ts[-1]:
+            ts = self.ts[-1]  # keep the column sorted if the wall clock steps back
+        packed = None
+        if event_id is not None:
+            try:
+                value = uuid.UUID(event_id)
+                if str(value) == event_id:
+                    packed = value.bytes
+            except ValueError:
+                pass
+            if packed is None:
+                self.other_ids[self.offset + len(self.ts)] = event_id
+        self.ts.append(ts)
+        self.tool.append(tool)
+        self.user.append(user)
+        self.code.append(code)
+        self.ids += packed or bytes(16)
+        if len(self) > self.max_rows:
+            self.head += 1
+            self._compact()
+
+    def evict_before(self, cutoff: float) -> None:
+        if len(self) and self.ts[self.head] < cutoff:
+            self.head = bisect_left(self.ts, cutoff, self.head)
+            self._compact()
+
+    def _compact(self, force: bool = False) -> None:
+        if self.head < self.slack and not (force and self.head):
+            return
+        head = self.head
+        del self.ts[:head], self.tool[:head], self.user[:head], self.code[:head]
+        del self.ids[:head * 16]
+        self.offset += head
+        self.head = 0
+        if self.other_ids:
+            self.other_ids = {row: value for row, value in self.other_ids.items() if row >= self.offset}
+
+    def interned_columns(self) -> tuple:
+        return (self.tool, self.user, self.code) if self.interned_code else (self.tool, self.user)
+
+    def live_names(self) -> Set[int]:
+        """Interned ids referenced by rows that have not been evicted."""
+        live = set()
+        for column in self.interned_columns():
+            live.update(column[self.head:])
+        return live
+
+    def remap(self, mapping: List[int]) -> None:
+        """Rewrite interned ids after ``Interner.compact`` (evicted rows are reclaimed first)."""
+        self._compact(force=True)
+        for column in self.interned_columns():
+            column[:] = array("i", [mapping[value_id] for value_id in column])
+
+    def start(self, cutoff: float) -> int:
+        """Index of the first row at or after cutoff."""
+        return bisect_left(self.ts, cutoff, self.head)
+
+    def event_id(self, index: int) -> Optional[str]:
+        other = self.other_ids.get(self.offset + index)
+        if other is not None:
+            return other
+        packed = bytes(self.ids[index * 16:(index + 1) * 16])
+        return None if packed == bytes(16) else str(uuid.UUID(bytes=packed))
+
+
+class RateMeter:
+    """
+    Events per minute as an exponentially weighted moving average over about
+    one minute (the Unix load-average scheme: the rate is updated every
+    TICK_SECONDS from the events counted since the previous tick).
+    """
+
+    TICK_SECONDS = 5.0
+
+    def __init__(self, window_seconds: float = 60.0, clock: Callable[[], float] = time.time):
+        self.alpha = 1 - math.exp(-self.TICK_SECONDS / window_seconds)
+        self.clock = clock
+        self.rate = 0.0  # per second
+        self.uncounted = 0
+        self.initialized = False
+        self.last_tick = clock()
+
+    def _tick(self) -> None:
+        elapsed = self.clock() - self.last_tick
+        ticks = int(elapsed // self.TICK_SECONDS)
+        if ticks <= 0:
+            return
+        self.last_tick += ticks * self.TICK_SECONDS
+        instant = self.uncounted / self.TICK_SECONDS
+        self.uncounted = 0
+        if self.initialized:
+            self.rate += self.alpha * (instant - self.rate)
+        else:
+            self.rate = instant
+            self.initialized = True
+        # Remaining ticks saw no events: decay in closed form
+        self.rate *= (1 - self.alpha) ** (ticks - 1)
+
+    def mark(self, count: int = 1) -> None:
+        self._tick()
+        self.uncounted += count
+
+    def per_minute(self) -> float:
+        self._tick()
+        return self.rate * 60
+
+
+class RealtimeMetricsBuffer:
+    """Thread-safe buffer for real-time metrics with 6-hour retention"""
+    def __init__(self, clock: Callable[[], float] = time.time, memory_bytes: int = REALTIME_MEMORY_BYTES):
+        self.clock = clock
+        self.lock = threading.Lock()
+        rows = memory_bytes // EventColumns.ROW_BYTES
+        self.borrows = EventColumns(rows * 10 // 21)
+        self.returns = EventColumns(rows * 10 // 21)
+        self.failures = EventColumns(rows // 21, interned_code=True)
+        self.names = Interner()
+        self.names_limit = INTERNER_MIN_COMPACT
+
+        # Per-tool aggregated metrics (for charting), maintained as events arrive
+        self.tool_metrics: Dict[str, MinuteRing] = {}
+        self.meters = {name: RateMeter(clock=clock) for name in ("borrow", "return", "failure", "overage")}
+        self.listeners: List[Callable[[], None]] = []
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Call listener (from the recording thread) after every event."""
+        self.listeners.append(listener)
+
+    def _notify(self) -> None:
+        for listener in self.listeners:
+            listener()
+
+    def add_borrow(self, tool: str, user: str, is_overage: bool, borrow_id: str):
+        """Record a borrow event"""
+        now = self.clock()
+        with self.lock:
+            user_id = self.names.id(user)
+            self.borrows.append(now, self.names.id(tool), user_id, int(bool(is_overage)), borrow_id)
+            ring = self.tool_metrics.get(tool)
+            if ring is None:
+                ring = self.tool_metrics[tool] = MinuteRing()
+            ring.add(int(now // 60), user_id, is_overage)
+            self.meters["borrow"].mark()
+            if is_overage:
+                self.meters["overage"].mark()
+            self._cleanup_old_events(now)
+        self._notify()
+
+    def add_return(self, borrow_id: str, user: str = None):
+        """Record a return event"""
+        now = self.clock()
+        with self.lock:
+            self.returns.append(now, -1, self.names.id(user), 0, borrow_id)
+            self.meters["return"].mark()
+            self._cleanup_old_events(now)
+        self._notify()
+
+    def add_failure(self, tool: str, user: str, reason: str):
+        """Record a failure event"""
+        now = self.clock()
+        with self.lock:
+            self.failures.append(now, self.names.id(tool), self.names.id(user), self.names.id(reason), None)
+            self.meters["failure"].mark()
+            self._cleanup_old_events(now)
+        self._notify()
+
+    def _cleanup_old_events(self, now: float):
+        """Remove events older than 6 hours"""
+        cutoff = now - REALTIME_RETENTION_SECONDS
+        for columns in (self.borrows, self.returns, self.failures):
+            columns.evict_before(cutoff)
+        if len(self.names) > self.names_limit:
+            self._compact_names(now)
+
+    def _compact_names(self, now: float):
+        """Drop interned strings that no live row or minute bucket references (amortized O(1))"""
+        oldest_minute = int(now // 60) - REALTIME_RETENTION_MINUTES
+        live = set()
+        for columns in (self.borrows, self.returns, self.failures):
+            live |= columns.live_names()
+        for tool, ring in list(self.tool_metrics.items()):
+            users = ring.expire(oldest_minute)
+            if not any(ring.slots):
+                del self.tool_metrics[tool]
+            live |= users
+        mapping = self.names.compact(live)
+        for columns in (self.borrows, self.returns, self.failures):
+            columns.remap(mapping)
+        for ring in self.tool_metrics.values():
+            ring.remap(mapping)
+        self.names_limit = max(INTERNER_MIN_COMPACT, 2 * len(self.names))
+
+    def _borrow_event(self, i: int) -> dict:
+        columns = self.borrows
+        return {"timestamp": _iso(columns.ts[i]), "type": "borrow", "tool": self.names.value(columns.tool[i]),
+                "user": self.names.value(columns.user[i]), "is_overage": bool(columns.code[i]),
+                "id": columns.event_id(i)}
+
+    def _return_event(self, i: int) -> dict:
+        columns = self.returns
+        return {"timestamp": _iso(columns.ts[i]), "type": "return", "id": columns.event_id(i),
+                "user": self.names.value(columns.user[i])}
+
+    def _failure_event(self, i: int) -> dict:
+        columns = self.failures
+        return {"timestamp": _iso(columns.ts[i]), "type": "failure", "tool": self.names.value(columns.tool[i]),
+                "user": self.names.value(columns.user[i]), "reason": self.names.value(columns.code[i])}
+
+    def get_recent_events(self, seconds: int = 60, limit: Optional[int] = None):
+        """Get events from the last N seconds (max 6 hours), at most the newest `limit` of each kind"""
+        # Limit to retention period
+        seconds = min(seconds, REALTIME_RETENTION_SECONDS)
+        cutoff = self.clock() - seconds
+
+        result = {}
+        with self.lock:
+            for key, columns, build in (("borrows", self.borrows, self._borrow_event),
+                                        ("returns", self.returns, self._return_event),
+                                        ("failures", self.failures, self._failure_event)):
+                start = columns.start(cutoff)
+                if limit is not None:
+                    start = max(start, len(columns.ts) - limit)
+                result[key] = [build(i) for i in range(start, len(columns.ts))]
+        return result
+
+    def get_stats_summary(self):
+        """Get summary statistics"""
+        with self.lock:
+            borrows, returns, failures = len(self.borrows), len(self.returns), len(self.failures)
+            oldest = _iso(self.borrows.ts[self.borrows.head]) if borrows else None
+            memory = sum(c.nbytes() for c in (self.borrows, self.returns, self.failures)) + self.names.nbytes()
+        return {
+            "total_events": borrows + returns + failures,
+            "borrow_count": borrows,
+            "return_count": returns,
+            "failure_count": failures,
+            "retention_hours": REALTIME_RETENTION_HOURS,
+            "oldest_event": oldest,
+            "memory_bytes": memory
+        }
+
+    def rates(self):
+        """Borrow/return/failure rates per minute (EWMA) and the share of borrows that were overage"""
+        with self.lock:
+            per_minute = {name: meter.per_minute() for name, meter in self.meters.items()}
+        borrow_rate = per_minute["borrow"]
+        return {
+            "borrow_per_min": round(borrow_rate, 1),
+            "return_per_min": round(per_minute["return"], 1),
+            "failure_per_min": round(per_minute["failure"], 1),
+            "overage_percent": round(per_minute["overage"] / borrow_rate * 100, 1) if borrow_rate > 0 else 0
+        }
+
+    def aggregate_tool_metrics(self, window_seconds: int = 60):
+        """Per-tool, per-minute data points for charting
+
+        This creates time-series data that persists when users switch tool views.
+        Reads the minute buckets maintained by add_borrow.
+        """
+        now = self.clock()
+        first_minute = int((now - min(window_seconds, REALTIME_RETENTION_SECONDS)) // 60)
+        last_minute = int(now // 60)
+        with self.lock:
+            result = {tool: ring.series(first_minute, last_minute, self.names)
+                      for tool, ring in self.tool_metrics.items()}
+        return {tool: points for tool, points in result.items() if points}
+
+    def get_tool_history(self, tool: str, window_seconds: int = 1800):
+        """Get aggregated history for a specific tool
+
+        Returns time-series data suitable for charting
+        """
+        ring = self.tool_metrics.get(tool)
+        if ring is None:
+            return []
+        now = self.clock()
+        with self.lock:
+            return ring.series(int((now - window_seconds) // 60), int(now // 60), self.names)
+
+
+class RealtimeBroadcaster:
+    """One snapshot per tick, serialized once and shared by every /realtime/stream client."""
+
+    def __init__(self, snapshot: Callable[[], Awaitable[str]], interval: float = REALTIME_INTERVAL_SECONDS,
+                 min_interval: float = REALTIME_MIN_INTERVAL_SECONDS, queue_size: int = REALTIME_SUBSCRIBER_QUEUE):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.min_interval = min_interval
+        self.queue_size = max(1, queue_size)
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_frame: Optional[str] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        """Register a client; its SSE frames arrive on the returned queue."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First subscriber, or the app was restarted on a new event loop
+            realtime_subscribers.dec(len(self._subscribers))
+            self._loop, self._wakeup, self._task = loop, asyncio.Event(), None
+            self._subscribers, self._last_frame = set(), None
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        realtime_subscribers.inc()
+        if self._task is None or self._task.done():
+            self._wakeup.set()  # first frame right away
+            # Own context: the task must not inherit the first subscriber's request/tenant scope
+            self._task = loop.create_task(self._run(), context=contextvars.Context())
+        elif self._last_frame is not None:
+            queue.put_nowait(self._last_frame)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._subscribers:
+            self._subscribers.discard(queue)
+            realtime_subscribers.dec()
+        if not self._subscribers and self._wakeup is not None:
+            self._wakeup.set()  # let the task notice it is idle and exit
+
+    def notify(self) -> None:
+        """Ask for a fresh snapshot soon; safe to call from any thread."""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is None or not self._subscribers:
+            return
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            pass  # loop closed
+
+    def publish(self, frame: str) -> None:
+        self._last_frame = frame
+        for queue in list(self._subscribers):
+            if queue.full():
+                # Slow client: it skips to the newest frame instead of queueing stale ones
+                queue.get_nowait()
+                realtime_frames_dropped_total.inc()
+            queue.put_nowait(frame)
+
+    async def _run(self) -> None:
+        last_built = 0.0
+        while self._subscribers:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Coalesce bursts of events into one snapshot per min_interval
+            delay = self.min_interval - (time.monotonic() - last_built)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not self._subscribers:
+                break
+            last_built = time.monotonic()
+            try:
+                payload = await self.snapshot()
+            except Exception as e:
+                logger.error("realtime snapshot failed: %s", e)
+                continue
+            self.publish(f"data: {payload}\n\n")
+
+
+class RealtimeBroadcasters:
+    """
+    One RealtimeBroadcaster per key, created on first subscribe.
+
+    snapshot(key) builds that key's payload; only keys with subscribers run
+    a task, and notify(key) wakes just that key's broadcaster.
+    """
+
+    def __init__(self, snapshot: Callable[[Optional[str]], Awaitable[str]], **options):
+        self.snapshot = snapshot
+        self.options = options
+        self._broadcasters: Dict[Optional[str], RealtimeBroadcaster] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Optional[str]) -> RealtimeBroadcaster:
+        broadcaster = self._broadcasters.get(key)
+        if broadcaster is None:
+            with self._lock:
+                broadcaster = self._broadcasters.get(key)
+                if broadcaster is None:
+                    broadcaster = RealtimeBroadcaster(functools.partial(self.snapshot, key), **self.options)
+                    self._broadcasters[key] = broadcaster
+        return broadcaster
+
+    def notify(self, key: Optional[str]) -> None:
+        broadcaster = self._broadcasters.get(key)
+        if broadcaster is not None:
+            broadcaster.notify()
@@ -53,33 +53,60 @@ def generate_signature(tool: str, user: str, timestamp: str, api_key: str = "",
         hashlib.sha256
     ).hexdigest()
     
-    logger.debug(f"Generated signature for payload: {payload}")
+    logger.debug("Generated signature for payload: %s", payload)
     return signature
 
 
-def validate_signature(
-    request: Request,
-    tool: str,
-    user: str,
-    api_key: str = "",
-    require: bool = None
-) -> tuple[bool, Optional[str]]:
+def batch_signature_payload(items: list, mode: str, timestamp: str, api_key: str = "",
+                            ttl_seconds: Optional[int] = None, session_id: Optional[str] = None,
+                            host: Optional[str] = None) -> str:
     """
-    Validate HMAC signature on incoming request.
-    
-    Args:
-        request: FastAPI request object
-        tool: The tool being borrowed
-        user: The user requesting the license
-        api_key: API key from Authorization header
-        require: Override global REQUIRE_SIGNATURES setting
-    
-    Returns:
-        (is_valid, error_message)
+    Canonical payload signed for batch borrows: a "ttl_seconds|session_id|host"
+    lease line (empty for unset values) after the mode, then one
+    "tool|user|quantity" line per item before the timestamp/API key, so the
+    whole batch (order and lease parameters included) is covered by a single
+    signature.
     """
-    # Determine if we should enforce signatures
-    enforce = require if require is not None else REQUIRE_SIGNATURES
-    
+    lease = "|".join("" if value is None else str(value) for value in (ttl_seconds, session_id, host))
+    lines = [f"{tool}|{user}|{quantity}" for tool, user, quantity in items]
+    return "\n".join(["batch", mode, lease] + lines + [timestamp, api_key])
+
+
+def generate_batch_signature(items: list, mode: str, timestamp: str, api_key: str = "", vendor_id: str = "techvendor",
+                             ttl_seconds: Optional[int] = None, session_id: Optional[str] = None,
+                             host: Optional[str] = None) -> str:
+    """Generate the HMAC signature for a batch borrow (see batch_signature_payload)."""
+    if vendor_id not in VENDOR_SECRETS:
+        raise ValueError(f"Unknown vendor: {vendor_id}")
+    return hmac.new(
+        VENDOR_SECRETS[vendor_id].encode('utf-8'),
+        batch_signature_payload(items, mode, timestamp, api_key, ttl_seconds, session_id, host).encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+
+
+def lease_signature_payload(operation: str, fields: list, timestamp: str, api_key: str = "") -> str:
+    """
+    Canonical payload signed for lease calls (heartbeat, release): the operation
+    name, one line per field (empty for unset values), then the timestamp/API key.
+    """
+    lines = ["" if value is None else str(value) for value in fields]
+    return "\n".join([operation] + lines + [timestamp, api_key])
+
+
+def generate_lease_signature(operation: str, fields: list, timestamp: str, api_key: str = "", vendor_id: str = "techvendor") -> str:
+    """Generate the HMAC signature for a lease call (see lease_signature_payload)."""
+    if vendor_id not in VENDOR_SECRETS:
+        raise ValueError(f"Unknown vendor: {vendor_id}")
+    return hmac.new(
+        VENDOR_SECRETS[vendor_id].encode('utf-8'),
+        lease_signature_payload(operation, fields, timestamp, api_key).encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+
+
+def _validate_signed_payload(request: Request, build_payload, label: str, enforce: bool) -> tuple[bool, Optional[str]]:
+    """Shared header/vendor/timestamp checks; build_payload(timestamp) returns the signed string."""
     # Extract security headers
     signature = request.headers.get("X-Signature")
     timestamp = request.headers.get("X-Timestamp")
@@ -88,7 +115,7 @@ def validate_signature(
     # If headers are missing
     if not signature or not timestamp:
         if enforce:
-            logger.warning(f"Missing security headers from {request.client.host}")
+            logger.warning("Missing security headers from %s", request.client.host)
             return False, "Missing X-Signature or X-Timestamp headers"
         else:
             logger.debug("Security headers missing, but not required")
@@ -96,7 +123,7 @@ def validate_signature(
     
     # Validate vendor
     if vendor_id not in VENDOR_SECRETS:
-        logger.warning(f"Unknown vendor ID: {vendor_id}")
+        logger.warning("Unknown vendor ID: %s", vendor_id)
         return False, f"Unknown vendor: {vendor_id}"
     
     # Validate timestamp (prevent replay attacks)
@@ -106,30 +133,114 @@ def validate_signature(
         time_diff = abs(current_time - request_time)
         
         if time_diff > SIGNATURE_VALID_WINDOW:
-            logger.warning(f"Request timestamp too old: {time_diff}s (max {SIGNATURE_VALID_WINDOW}s)")
+            logger.warning("Request timestamp too old: %ss (max %ss)", time_diff, SIGNATURE_VALID_WINDOW)
             return False, f"Request expired (timestamp difference: {time_diff}s)"
     except ValueError:
-        logger.warning(f"Invalid timestamp format: {timestamp}")
+        logger.warning("Invalid timestamp format: %s", timestamp)
         return False, "Invalid timestamp format"
     
-    # Reconstruct expected signature (now includes API key)
-    payload = f"{tool}|{user}|{timestamp}|{api_key}"
+    # Reconstruct expected signature (includes API key)
     expected_signature = hmac.new(
         VENDOR_SECRETS[vendor_id].encode('utf-8'),
-        payload.encode('utf-8'),
+        build_payload(timestamp).encode('utf-8'),
         hashlib.sha256
     ).hexdigest()
     
     # Compare signatures (constant-time to prevent timing attacks)
     if not hmac.compare_digest(signature, expected_signature):
-        logger.warning(f"Invalid signature from {request.client.host} for {vendor_id}")
-        logger.debug(f"Expected: {expected_signature}, Got: {signature}")
+        logger.warning("Invalid signature from %s for %s", request.client.host, vendor_id)
+        logger.debug("Expected: %s, Got: %s", expected_signature, signature)
         return False, "Invalid signature"
     
-    logger.info(f"Valid signature from {request.client.host} for {vendor_id}/{tool}")
+    logger.info("Valid signature from %s for %s/%s", request.client.host, vendor_id, label, extra={"routine": True})
     return True, None
 
 
+def validate_signature(
+    request: Request,
+    tool: str,
+    user: str,
+    api_key: str = "",
+    require: bool = None
+) -> tuple[bool, Optional[str]]:
+    """
+    Validate HMAC signature on incoming request.
+    
+    Args:
+        request: FastAPI request object
+        tool: The tool being borrowed
+        user: The user requesting the license
+        api_key: API key from Authorization header
+        require: Override global REQUIRE_SIGNATURES setting
+    
+    Returns:
+        (is_valid, error_message)
+    """
+    # Determine if we should enforce signatures
+    enforce = require if require is not None else REQUIRE_SIGNATURES
+    return _validate_signed_payload(
+        request, lambda timestamp: f"{tool}|{user}|{timestamp}|{api_key}", tool, enforce
+    )
+
+
+def validate_batch_signature(
+    request: Request,
+    items: list,
+    mode: str,
+    api_key: str = "",
+    require: bool = None,
+    ttl_seconds: Optional[int] = None,
+    session_id: Optional[str] = None,
+    host: Optional[str] = None
+) -> tuple[bool, Optional[str]]:
+    """
+    Validate the single HMAC signature covering a batch borrow.
+    
+    Args:
+        request: FastAPI request object
+        items: (tool, user, quantity) tuples in request order
+        mode: "all_or_nothing" or "partial"
+        api_key: API key from Authorization header
+        require: Override global REQUIRE_SIGNATURES setting
+        ttl_seconds/session_id/host: Lease parameters of the batch
+    
+    Returns:
+        (is_valid, error_message)
+    """
+    enforce = require if require is not None else REQUIRE_SIGNATURES
+    return _validate_signed_payload(
+        request,
+        lambda timestamp: batch_signature_payload(items, mode, timestamp, api_key, ttl_seconds, session_id, host),
+        "batch", enforce
+    )
+
+
+def validate_lease_signature(
+    request: Request,
+    operation: str,
+    fields: list,
+    api_key: str = "",
+    require: bool = None
+) -> tuple[bool, Optional[str]]:
+    """
+    Validate the HMAC signature of a heartbeat or session release.
+    
+    Args:
+        request: FastAPI request object
+        operation: "heartbeat" or "release"
+        fields: Signed request fields in canonical order
+        api_key: API key from Authorization header
+        require: Override global REQUIRE_SIGNATURES setting
+    
+    Returns:
+        (is_valid, error_message)
+    """
+    enforce = require if require is not None else REQUIRE_SIGNATURES
+    return _validate_signed_payload(
+        request, lambda timestamp: lease_signature_payload(operation, fields, timestamp, api_key), operation, enforce
+    )
+
+
 def get_vendor_secret(vendor_id: str) -> Optional[str]:
     """
     Get vendor secret for client library usage.
@@ -0,0 +1,136 @@
+"""
+Per-tenant SQLite shards (optional).
+
+Enable with LICENSE_DB_SHARDING=tenant. Each tenant's licensing tables
+(licenses, borrows, overage charges and the ledger) live in their own
+database file, so one tenant's borrow storm only contends for that tenant's
+write lock. The main database (LICENSE_DB_PATH) stays the global catalog for
+tenants, vendors, packages, users and API keys, and serves requests that
+carry no tenant.
+
+The tenant comes from a context variable set per request by
+``tenant_middleware``; db.get_connection() routes through it. Shard files
+are opened lazily, migrated on first open and kept in an LRU of at most
+LICENSE_DB_MAX_OPEN_SHARDS connection pools.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional
+
+SHARDING_MODE = os.getenv("LICENSE_DB_SHARDING", "none").lower()
+MAX_OPEN_SHARDS = int(os.getenv("LICENSE_DB_MAX_OPEN_SHARDS", "64"))
+SHARD_FANOUT_WORKERS = int(os.getenv("LICENSE_DB_SHARD_FANOUT_WORKERS", "8"))
+
+# Tenant ids become file names, so only slug-style ids are routable
+_TENANT_ID_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+_current_tenant: ContextVar[Optional[str]] = ContextVar("license_db_tenant", default=None)
+
+
+def sharding_enabled() -> bool:
+    return SHARDING_MODE == "tenant"
+
+
+def current_tenant() -> Optional[str]:
+    return _current_tenant.get()
+
+
+@contextmanager
+def tenant_scope(tenant_id: Optional[str]) -> Iterator[None]:
+    """Route db helpers in this context to tenant_id's shard (None = catalog)."""
+    token = _current_tenant.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+def shard_dir(catalog_path: str) -> str:
+    env_dir = os.getenv("LICENSE_DB_SHARD_DIR")
+    if env_dir:
+        return env_dir
+    root, _ = os.path.splitext(catalog_path)
+    return f"{root}.shards"
+
+
+def shard_path(catalog_path: str, tenant_id: str) -> str:
+    if not _TENANT_ID_RE.match(tenant_id):
+        raise ValueError(f"Invalid tenant id for sharding: {tenant_id!r}")
+    return os.path.join(shard_dir(catalog_path), f"{tenant_id}.db")
+
+
+def list_shard_tenants(catalog_path: str) -> List[str]:
+    """Tenants that have a shard file on disk."""
+    directory = shard_dir(catalog_path)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-3] for name in os.listdir(directory) if name.endswith(".db"))
+
+
+class ShardRouter:
+    """
+    LRU of open shard connection pools.
+
+    open_pool(path) creates (and migrates) the pool for a shard file. When
+    more than max_open shards are open the least recently used pool is
+    closed; connections still checked out are closed on release.
+    """
+
+    def __init__(self, open_pool: Callable[[str], object], max_open: int = MAX_OPEN_SHARDS):
+        self._open_pool = open_pool
+        self.max_open = max(1, max_open)
+        self._pools: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pool_for(self, path: str):
+        with self._lock:
+            pool = self._pools.get(path)
+            if pool is not None:
+                self._pools.move_to_end(path)
+                return pool
+            pool = self._open_pool(path)
+            self._pools[path] = pool
+            while len(self._pools) > self.max_open:
+                _, evicted = self._pools.popitem(last=False)
+                evicted.close()
+            return pool
+
+    def is_open(self, path: str) -> bool:
+        return path in self._pools
+
+    def drop(self, path: str) -> None:
+        """Close a shard and delete its files (tenant hard delete)."""
+        with self._lock:
+            pool = self._pools.pop(path, None)
+            if pool is not None:
+                pool.close()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+    def close_all(self) -> None:
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+
+def fan_out(fn: Callable[[], object], tenant_ids: List[str]) -> Dict[str, object]:
+    """Run fn() once per tenant shard in parallel; returns {tenant_id: result}."""
+    if not tenant_ids:
+        return {}
+
+    def run(tenant_id: str):
+        with tenant_scope(tenant_id):
+            return fn()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(SHARD_FANOUT_WORKERS, len(tenant_ids))), thread_name_prefix="shard") as pool:
+        return dict(zip(tenant_ids, pool.map(run, tenant_ids)))
@@ -10,6 +10,21 @@ function toggleOverageCharges() {
   }
 }
 
+// List endpoints are paginated: follow X-Next-Cursor / next_cursor and concatenate the pages
+async function fetchAllPages(url, items = data => data) {
+  const all = [];
+  let cursor = null;
+  do {
+    const sep = url.includes('?') ? '&' : '?';
+    const r = await fetch(cursor ? `${url}${sep}cursor=${encodeURIComponent(cursor)}` : url);
+    if (!r.ok) throw new Error(`Load ${url} failed`);
+    const data = await r.json();
+    all.push(...items(data));
+    cursor = r.headers.get('X-Next-Cursor') || data.next_cursor || null;
+  } while (cursor);
+  return all;
+}
+
 async function borrow(e) {
   e.preventDefault();
   const tool = document.getElementById('borrow-tool').value;
@@ -21,16 +36,24 @@ async function borrow(e) {
     const r = await fetch('/licenses/borrow', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ tool, user })
+      body: JSON.stringify({ tool, user, include_status: true })
     });
     if (!r.ok) throw new Error((await r.json()).detail || 'Failed');
     const data = await r.json();
     out.classList.add('success');
     out.textContent = `Borrowed ${tool} for ${user}. ID: ${data.id}`;
     document.getElementById('return-id').value = data.id;
-    await refreshStatusAll();
+    // The borrow response carries the tool's new status; no need to refetch all tools
+    const i = statusList.findIndex(s => s.tool === data.status.tool);
+    if (i >= 0) {
+      statusList[i] = data.status;
+      renderStatus(statusList);
+      renderCosts(statusList);
+    } else {
+      await refreshStatusAll();
+      await refreshCosts();
+    }
     await refreshBorrows();
-    await refreshCosts();
   } catch (err) {
     out.classList.add('error');
     out.textContent = String(err.message || err);
@@ -62,75 +85,82 @@ async function returnLicense(e) {
   }
 }
 
+// Last /licenses/status result, patched in place by borrow responses
+let statusList = [];
+
 async function refreshStatusAll() {
   const out = document.getElementById('status');
   try {
     const r = await fetch('/licenses/status');
     if (!r.ok) throw new Error('Status fetch failed');
     const list = await r.json();
-    if (!Array.isArray(list) || list.length === 0) {
-      out.textContent = 'No tools found';
-      return;
-    }
-    // Render pies
-    out.classList.remove('status');
-    out.classList.add('status-pies');
-    out.innerHTML = '';
-    const frag = document.createDocumentFragment();
-    list.forEach(s => {
-      const pctBorrowed = s.total > 0 ? Math.round((s.borrowed / s.total) * 100) : 0;
-      const pieCard = document.createElement('div');
-      pieCard.className = 'pie-card';
-      const pie = document.createElement('div');
-      pie.className = 'pie';
-      // Create SVG donut pie
-      const size = 64; const r = 26; const cx = 32; const cy = 32;
-      const circumference = 2 * Math.PI * r;
-      const borrowedLen = (pctBorrowed / 100) * circumference;
-      const svg = document.createElementNS('http://www.w3.org/2000/svg', 'svg');
-      svg.setAttribute('viewBox', '0 0 64 64');
-      const bg = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
-      bg.setAttribute('cx', cx); bg.setAttribute('cy', cy); bg.setAttribute('r', r);
-      bg.setAttribute('fill', 'none'); bg.setAttribute('stroke', 'var(--mb-gray-300)'); bg.setAttribute('stroke-width', '12');
-      const arc = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
-      arc.setAttribute('cx', cx); arc.setAttribute('cy', cy); arc.setAttribute('r', r);
-      arc.setAttribute('fill', 'none'); arc.setAttribute('stroke', 'var(--mb-blue)'); arc.setAttribute('stroke-width', '12');
-      arc.setAttribute('stroke-dasharray', `${borrowedLen} ${circumference - borrowedLen}`);
-      arc.setAttribute('stroke-linecap', 'butt');
-      svg.appendChild(bg); svg.appendChild(arc);
-      const pct = document.createElement('div'); pct.className = 'pct'; pct.textContent = `${pctBorrowed}%`;
-      pie.appendChild(svg); pie.appendChild(pct);
-      const legend = document.createElement('div');
-      legend.className = 'pie-legend';
-      const tool = document.createElement('div');
-      tool.className = 'tool';
-      tool.textContent = s.tool;
-      const meta = document.createElement('div');
-      meta.className = 'meta';
-      const overageInfo = s.overage > 0 ? ` • ${s.overage} overage` : '';
-      const budgetInfo = s.commit > 0 ? ` (commit: ${s.commit}, max overage: ${s.max_overage})` : '';
-      meta.textContent = `borrowed ${s.borrowed}/${s.total}${overageInfo}${budgetInfo}`;
-      if (s.overage > 0) {
-        meta.style.color = '#c62828';
-        meta.style.fontWeight = '600';
-      }
-      legend.appendChild(tool);
-      legend.appendChild(meta);
-      pieCard.appendChild(pie);
-      pieCard.appendChild(legend);
-      frag.appendChild(pieCard);
-    });
-    out.appendChild(frag);
+    statusList = Array.isArray(list) ? list : [];
+    renderStatus(statusList);
   } catch (err) {
     out.textContent = 'Unable to load status';
   }
 }
 
+function renderStatus(list) {
+  const out = document.getElementById('status');
+  if (list.length === 0) {
+    out.textContent = 'No tools found';
+    return;
+  }
+  // Render pies
+  out.classList.remove('status');
+  out.classList.add('status-pies');
+  out.innerHTML = '';
+  const frag = document.createDocumentFragment();
+  list.forEach(s => {
+    const pctBorrowed = s.total > 0 ? Math.round((s.borrowed / s.total) * 100) : 0;
+    const pieCard = document.createElement('div');
+    pieCard.className = 'pie-card';
+    const pie = document.createElement('div');
+    pie.className = 'pie';
+    // Create SVG donut pie
+    const size = 64; const r = 26; const cx = 32; const cy = 32;
+    const circumference = 2 * Math.PI * r;
+    const borrowedLen = (pctBorrowed / 100) * circumference;
+    const svg = document.createElementNS('http://www.w3.org/2000/svg', 'svg');
+    svg.setAttribute('viewBox', '0 0 64 64');
+    const bg = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
+    bg.setAttribute('cx', cx); bg.setAttribute('cy', cy); bg.setAttribute('r', r);
+    bg.setAttribute('fill', 'none'); bg.setAttribute('stroke', 'var(--mb-gray-300)'); bg.setAttribute('stroke-width', '12');
+    const arc = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
+    arc.setAttribute('cx', cx); arc.setAttribute('cy', cy); arc.setAttribute('r', r);
+    arc.setAttribute('fill', 'none'); arc.setAttribute('stroke', 'var(--mb-blue)'); arc.setAttribute('stroke-width', '12');
+    arc.setAttribute('stroke-dasharray', `${borrowedLen} ${circumference - borrowedLen}`);
+    arc.setAttribute('stroke-linecap', 'butt');
+    svg.appendChild(bg); svg.appendChild(arc);
+    const pct = document.createElement('div'); pct.className = 'pct'; pct.textContent = `${pctBorrowed}%`;
+    pie.appendChild(svg); pie.appendChild(pct);
+    const legend = document.createElement('div');
+    legend.className = 'pie-legend';
+    const tool = document.createElement('div');
+    tool.className = 'tool';
+    tool.textContent = s.tool;
+    const meta = document.createElement('div');
+    meta.className = 'meta';
+    const overageInfo = s.overage > 0 ? ` • ${s.overage} overage` : '';
+    const budgetInfo = s.commit > 0 ? ` (commit: ${s.commit}, max overage: ${s.max_overage})` : '';
+    meta.textContent = `borrowed ${s.borrowed}/${s.total}${overageInfo}${budgetInfo}`;
+    if (s.overage > 0) {
+      meta.style.color = '#c62828';
+      meta.style.fontWeight = '600';
+    }
+    legend.appendChild(tool);
+    legend.appendChild(meta);
+    pieCard.appendChild(pie);
+    pieCard.appendChild(legend);
+    frag.appendChild(pieCard);
+  });
+  out.appendChild(frag);
+}
+
 async function refreshBorrows() {
   try {
-    const r = await fetch('/borrows');
-    if (!r.ok) throw new Error('Load borrows failed');
-    const list = await r.json();
+    const list = await fetchAllPages('/borrows');
     const out = document.getElementById('borrows');
     out.textContent = list.map(b => `${b.borrowed_at}  ${b.user} -> ${b.tool}  (${b.id})`).join('\n') || 'No current borrows';
   } catch (e) {
@@ -147,69 +177,73 @@ async function refreshCosts() {
     const r = await fetch('/licenses/status');
     if (!r.ok) throw new Error('Load costs failed');
     const list = await r.json();
-    if (!Array.isArray(list) || list.length === 0) {
-      out.textContent = 'No tools found';
-      return;
-    }
-    console.log('List:', list);
-    let totalCommitCost = 0;
-    let totalOverageCost = 0;
-    let grandTotal = 0;
-    const items = [];
-    list.forEach(s => {
-      totalCommitCost += s.commit_price || 0;
-      totalOverageCost += s.current_overage_cost || 0;
-      grandTotal += s.total_cost || 0;
-      items.push({
-        tool: s.tool,
-        commit: s.commit_price || 0,
-        overage: s.current_overage_cost || 0,
-        total: s.total_cost || 0,
-        overageCount: s.overage || 0
-      });
-    });
-    out.innerHTML = '';
-    const frag = document.createDocumentFragment();
-    items.forEach(item => {
-      const row = document.createElement('div');
-      row.style.display = 'grid';
-      row.style.gridTemplateColumns = '2fr 1fr 1fr 1fr';
-      row.style.gap = '8px';
-      row.style.padding = '8px';
-      row.style.borderBottom = '1px solid var(--mb-gray-200)';
-      row.style.fontSize = '13px';
-      row.innerHTML = `
-        <div style="font-weight:600">${item.tool}</div>
-        <div>Commit: $${item.commit.toFixed(2)}</div>
-        <div>${item.overageCount > 0 ? `<span style="color:#c62828">Overage: $${item.overage.toFixed(2)}</span>` : 'Overage: $0.00'}</div>
-        <div style="font-weight:600;color:var(--mb-blue)">Total: $${item.total.toFixed(2)}</div>
-      `;
-      frag.appendChild(row);
-    });
-    const summary = document.createElement('div');
-    summary.style.display = 'grid';
-    summary.style.gridTemplateColumns = '2fr 1fr 1fr 1fr';
-    summary.style.gap = '8px';
-    summary.style.padding = '12px 8px';
-    summary.style.marginTop = '8px';
-    summary.style.borderTop = '2px solid var(--mb-gray-400)';
-    summary.style.fontWeight = '600';
-    summary.style.fontSize = '14px';
-    summary.style.backgroundColor = 'var(--mb-gray-50)';
-    summary.innerHTML = `
-      <div>Total</div>
-      <div>Commit: $${totalCommitCost.toFixed(2)}</div>
-      <div>${totalOverageCost > 0 ? `<span style="color:#c62828">Overage: $${totalOverageCost.toFixed(2)}</span>` : 'Overage: $0.00'}</div>
-      <div style="color:var(--mb-blue);font-size:16px">$${grandTotal.toFixed(2)}</div>
-    `;
-    frag.appendChild(summary);
-    out.appendChild(frag);
+    renderCosts(Array.isArray(list) ? list : []);
   } catch (e) {
     console.error('Error loading costs:', e);
     out.textContent = 'Unable to load costs: ' + e.message;
   }
 }
 
+function renderCosts(list) {
+  const out = document.getElementById('costs');
+  if (list.length === 0) {
+    out.textContent = 'No tools found';
+    return;
+  }
+  let totalCommitCost = 0;
+  let totalOverageCost = 0;
+  let grandTotal = 0;
+  const items = [];
+  list.forEach(s => {
+    totalCommitCost += s.commit_price || 0;
+    totalOverageCost += s.current_overage_cost || 0;
+    grandTotal += s.total_cost || 0;
+    items.push({
+      tool: s.tool,
+      commit: s.commit_price || 0,
+      overage: s.current_overage_cost || 0,
+      total: s.total_cost || 0,
+      overageCount: s.overage || 0
+    });
+  });
+  out.innerHTML = '';
+  const frag = document.createDocumentFragment();
+  items.forEach(item => {
+    const row = document.createElement('div');
+    row.style.display = 'grid';
+    row.style.gridTemplateColumns = '2fr 1fr 1fr 1fr';
+    row.style.gap = '8px';
+    row.style.padding = '8px';
+    row.style.borderBottom = '1px solid var(--mb-gray-200)';
+    row.style.fontSize = '13px';
+    row.innerHTML = `
+      <div style="font-weight:600">${item.tool}</div>
+      <div>Commit: $${item.commit.toFixed(2)}</div>
+      <div>${item.overageCount > 0 ? `<span style="color:#c62828">Overage: $${item.overage.toFixed(2)}</span>` : 'Overage: $0.00'}</div>
+      <div style="font-weight:600;color:var(--mb-blue)">Total: $${item.total.toFixed(2)}</div>
+    `;
+    frag.appendChild(row);
+  });
+  const summary = document.createElement('div');
+  summary.style.display = 'grid';
+  summary.style.gridTemplateColumns = '2fr 1fr 1fr 1fr';
+  summary.style.gap = '8px';
+  summary.style.padding = '12px 8px';
+  summary.style.marginTop = '8px';
+  summary.style.borderTop = '2px solid var(--mb-gray-400)';
+  summary.style.fontWeight = '600';
+  summary.style.fontSize = '14px';
+  summary.style.backgroundColor = 'var(--mb-gray-50)';
+  summary.innerHTML = `
+    <div>Total</div>
+    <div>Commit: $${totalCommitCost.toFixed(2)}</div>
+    <div>${totalOverageCost > 0 ? `<span style="color:#c62828">Overage: $${totalOverageCost.toFixed(2)}</span>` : 'Overage: $0.00'}</div>
+    <div style="color:var(--mb-blue);font-size:16px">$${grandTotal.toFixed(2)}</div>
+  `;
+  frag.appendChild(summary);
+  out.appendChild(frag);
+}
+
 async function refreshMyBorrows() {
   const user = document.getElementById('my-user').value.trim();
   const out = document.getElementById('my-borrows');
@@ -218,9 +252,7 @@ async function refreshMyBorrows() {
       out.textContent = 'Enter a user to view borrows';
       return;
     }
-    const r = await fetch(`/borrows?user=${encodeURIComponent(user)}`);
-    if (!r.ok) throw new Error('Load my borrows failed');
-    const list = await r.json();
+    const list = await fetchAllPages(`/borrows?user=${encodeURIComponent(user)}`);
     if (!Array.isArray(list) || list.length === 0) {
       out.textContent = 'No current borrows for this user';
       return;
@@ -305,10 +337,7 @@ async function loadOverageCharges() {
   list.innerHTML = '<div style="text-align:center;color:var(--mb-gray-700);padding:20px">Loading...</div>';
   
   try {
-    const r = await fetch('/overage-charges');
-    if (!r.ok) throw new Error('Failed to load charges');
-    const data = await r.json();
-    const charges = data.charges || [];
+    const charges = await fetchAllPages('/overage-charges', data => data.charges || []);
     
     if (charges.length === 0) {
       list.innerHTML = '<div style="text-align:center;color:var(--mb-gray-700);padding:12px;background:var(--mb-gray-100);border-radius:6px">No overage charges yet</div>';
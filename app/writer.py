@@ -0,0 +1,270 @@
+"""
+Single-writer database actor with group commit.
+
+Enable with LICENSE_DB_WRITE_MODE=actor. Instead of every request thread
+opening its own write transaction (and contending for SQLite's write lock),
+write commands are queued to one writer thread per database file. The writer
+drains whatever is queued (up to the profile's batch size), runs each command
+inside its own SAVEPOINT and commits the whole batch with a single fsync.
+Callers block on a Future that resolves only after the batch is committed, so
+a successful result is as durable as the configured profile promises. If the
+writer cannot open its connection or dies, every queued and later command
+fails with that error (the next get_writer starts a fresh writer), and
+execute() gives up after LICENSE_DB_WRITER_TIMEOUT_SECONDS.
+
+Durability profiles (LICENSE_DB_DURABILITY):
+
+* ``strict``     - synchronous=FULL, one command per commit
+* ``balanced``   - synchronous=NORMAL, batches of up to 64 (default)
+* ``throughput`` - synchronous=NORMAL, batches of up to 256 with a short
+                   linger so bursts coalesce into fewer commits
+"""
+
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, NamedTuple, Optional
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger("license-server")
+
+
+class DurabilityProfile(NamedTuple):
+    synchronous: str
+    max_batch: int
+    linger_ms: float
+
+
+DURABILITY_PROFILES: Dict[str, DurabilityProfile] = {
+    "strict": DurabilityProfile("FULL", 1, 0.0),
+    "balanced": DurabilityProfile("NORMAL", 64, 0.0),
+    "throughput": DurabilityProfile("NORMAL", 256, 2.0),
+}
+
+WRITE_MODE = os.getenv("LICENSE_DB_WRITE_MODE", "direct").lower()
+WRITER_MAX_BUSY_RETRIES = int(os.getenv("LICENSE_DB_WRITER_MAX_BUSY_RETRIES", "5"))
+WRITER_TIMEOUT_SECONDS = float(os.getenv("LICENSE_DB_WRITER_TIMEOUT_SECONDS", "30"))
+
+
+def get_durability_profile() -> DurabilityProfile:
+    name = os.getenv("LICENSE_DB_DURABILITY", "balanced").lower()
+    return DURABILITY_PROFILES.get(name, DURABILITY_PROFILES["balanced"])
+
+
+db_writer_batch_size = Histogram(
+    "license_db_writer_batch_size",
+    "Write commands committed per group commit",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+db_writer_busy_total = Counter(
+    "license_db_writer_busy_total",
+    "SQLITE_BUSY/locked errors seen by the writer actor",
+)
+db_writer_retries_total = Counter(
+    "license_db_writer_retries_total",
+    "Group commits retried after a busy error",
+)
+db_writer_commits_total = Counter(
+    "license_db_writer_commits_total",
+    "Group commits by outcome",
+    ["outcome"],
+)
+
+
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+
+class _WriteCommand:
+    __slots__ = ("fn", "args", "future")
+
+    def __init__(self, fn: Callable, args: tuple):
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+
+
+_STOP = object()
+
+
+class DbWriter:
+    """Writer thread owning the only write connection for one database file."""
+
+    def __init__(self, db_path: str, connect: Callable[[], sqlite3.Connection],
+                 profile: Optional[DurabilityProfile] = None):
+        self.db_path = db_path
+        self.profile = profile or get_durability_profile()
+        self._connect = connect
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._error: Optional[BaseException] = None  # set once the writer no longer accepts work
+        self._thread = threading.Thread(target=self._run, name=f"db-writer:{os.path.basename(db_path)}", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queue fn(cursor, *args) for the next group commit."""
+        cmd = _WriteCommand(fn, args)
+        self._queue.put(cmd)
+        if self._error is not None:
+            self._fail_pending()  # the writer may have drained the queue before this put
+        return cmd.future
+
+    def execute(self, fn: Callable, *args, timeout: Optional[float] = WRITER_TIMEOUT_SECONDS):
+        """
+        submit() and wait for the commit. Raises concurrent.futures.TimeoutError
+        after timeout seconds (the command may still be committed later).
+        """
+        return self.submit(fn, *args).result(timeout=timeout)
+
+    def stop(self) -> None:
+        self._queue.put(_STOP)
+        self._thread.join(timeout=10)
+
+    def _next_batch(self, first: _WriteCommand) -> tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.profile.linger_ms / 1000.0
+        while len(batch) < self.profile.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        conn = None
+        error: BaseException = RuntimeError(f"db writer for {self.db_path} is stopped")
+        try:
+            conn = self._connect()
+            conn.execute(f"PRAGMA synchronous={self.profile.synchronous}")
+            while True:
+                first = self._queue.get()
+                if first is _STOP:
+                    return
+                batch, stopping = self._next_batch(first)
+                try:
+                    self._commit_batch(conn, batch)
+                except BaseException as e:
+                    for cmd in batch:
+                        if not cmd.future.done():
+                            cmd.future.set_exception(e)
+                    raise
+                if stopping:
+                    return
+        except BaseException as e:
+            error = e
+            logger.error("db writer for %s failed: %s", self.db_path, e)
+        finally:
+            # Unregister before publishing the error, so a caller that sees it
+            # gets a fresh writer from get_writer
+            _unregister(self)
+            self._error = error
+            self._fail_pending()
+            if conn is not None:
+                conn.close()
+
+    def _fail_pending(self) -> None:
+        """Fail every queued command with the writer's error."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and not item.future.done():
+                item.future.set_exception(self._error)
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list) -> None:
+        attempt = 0
+        while True:
+            try:
+                results = self._apply(conn, batch)
+                break
+            except Exception as e:
+                if conn.in_transaction:
+                    try:
+                        conn.rollback()
+                    except sqlite3.Error:
+                        pass
+                busy = isinstance(e, sqlite3.OperationalError) and _is_busy(e)
+                if not busy or attempt >= WRITER_MAX_BUSY_RETRIES:
+                    db_writer_commits_total.labels(outcome="error").inc()
+                    logger.error("db writer batch failed size=%d attempts=%d: %s", len(batch), attempt + 1, e)
+                    for cmd in batch:
+                        cmd.future.set_exception(e)
+                    return
+                db_writer_busy_total.inc()
+                db_writer_retries_total.inc()
+                attempt += 1
+                # Exponential backoff with jitter on top of busy_timeout
+                time.sleep(min(0.01 * (2 ** attempt), 0.5) * (0.5 + random.random()))
+        db_writer_commits_total.labels(outcome="ok").inc()
+        db_writer_batch_size.observe(len(batch))
+        for cmd, (ok, value) in zip(batch, results):
+            if ok:
+                cmd.future.set_result(value)
+            else:
+                cmd.future.set_exception(value)
+
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, batch: list) -> list:
+        """Run every command in its own savepoint inside one transaction and commit."""
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        results = []
+        for cmd in batch:
+            cur.execute("SAVEPOINT cmd")
+            try:
+                value = cmd.fn(cur, *cmd.args)
+            except sqlite3.OperationalError as e:
+                if _is_busy(e):
+                    raise
+                cur.execute("ROLLBACK TO cmd")
+                results.append((False, e))
+            except Exception as e:
+                # A failing command only discards its own savepoint
+                cur.execute("ROLLBACK TO cmd")
+                results.append((False, e))
+            else:
+                results.append((True, value))
+            cur.execute("RELEASE cmd")
+        conn.commit()
+        return results
+
+
+_writers: Dict[str, DbWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path: str, connect: Callable[[], sqlite3.Connection]) -> DbWriter:
+    writer = _writers.get(db_path)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(db_path)
+            if writer is None:
+                writer = DbWriter(db_path, connect)
+                _writers[db_path] = writer
+    return writer
+
+
+def _unregister(writer: DbWriter) -> None:
+    with _writers_lock:
+        if _writers.get(writer.db_path) is writer:
+            del _writers[writer.db_path]
+
+
+def stop_all_writers() -> None:
+    """Drain and stop every writer thread (used on shutdown)."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
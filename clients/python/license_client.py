@@ -136,13 +136,17 @@ class LicenseClient:
         ).hexdigest()
         return signature
     
-    def borrow(self, tool: str, user: str) -> LicenseHandle:
+    def borrow(self, tool: str, user: str, ttl_seconds: Optional[int] = None,
+               session_id: Optional[str] = None, host: Optional[str] = None) -> LicenseHandle:
         """
         Borrow a license for a specific tool.
         
         Args:
             tool: Tool name (e.g., "cad_tool")
             user: Username
+            ttl_seconds: Lease length (server default if omitted, 0 = never expires)
+            session_id: Session owning the lease (see release_session)
+            host: Host owning the lease (see release_session)
         
         Returns:
             LicenseHandle that can be used as a context manager
@@ -156,7 +160,7 @@ class LicenseClient:
                 print(f"Got license: {license.id}")
         """
         url = f"{self.base_url}/licenses/borrow"
-        payload = {"tool": tool, "user": user}
+        payload = {"tool": tool, "user": user, **self._lease_options(ttl_seconds, session_id, host)}
         
         # Add security headers if enabled
         headers = {}
@@ -210,6 +214,186 @@ class LicenseClient:
         except requests.exceptions.RequestException as e:
             raise LicenseError(f"Failed to return license: {e}") from e
     
+    @staticmethod
+    def _lease_options(ttl_seconds: Optional[int], session_id: Optional[str], host: Optional[str]) -> dict:
+        """Lease fields to send (unset ones are left to the server defaults)"""
+        options = {"ttl_seconds": ttl_seconds, "session_id": session_id, "host": host}
+        return {key: value for key, value in options.items() if value is not None}
+    
+    def _lease_call_headers(self, operation: str, fields: list) -> dict:
+        """Signature headers for heartbeat/release"""
+        if not self.enable_security:
+            return {}
+        timestamp = str(int(time.time()))
+        # Must match lease_signature_payload() on the server
+        lines = ["" if value is None else str(value) for value in fields]
+        payload = "\n".join([operation] + lines + [timestamp, self.api_key or ""])
+        headers = {
+            "X-Signature": hmac.new(self.VENDOR_SECRET.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest(),
+            "X-Timestamp": timestamp,
+            "X-Vendor-ID": self.VENDOR_ID
+        }
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+    
+    def _generate_batch_signature(self, items: List[tuple], mode: str, timestamp: str,
+                                  ttl_seconds: Optional[int] = None, session_id: Optional[str] = None,
+                                  host: Optional[str] = None) -> str:
+        """Generate the single HMAC signature covering a batch borrow"""
+        # Must match batch_signature_payload() on the server
+        lease = "|".join("" if value is None else str(value) for value in (ttl_seconds, session_id, host))
+        lines = [f"{tool}|{user}|{quantity}" for tool, user, quantity in items]
+        payload = "\n".join(["batch", mode, lease] + lines + [timestamp, self.api_key or ""])
+        return hmac.new(
+            self.VENDOR_SECRET.encode('utf-8'),
+            payload.encode('utf-8'),
+            hashlib.sha256
+        ).hexdigest()
+    
+    def borrow_many(self, items: List[tuple], mode: str = "all_or_nothing", ttl_seconds: Optional[int] = None,
+                    session_id: Optional[str] = None, host: Optional[str] = None) -> List[LicenseHandle]:
+        """
+        Borrow many licenses in one request (one signature, one server transaction).
+        
+        Args:
+            items: (tool, user) or (tool, user, quantity) tuples
+            mode: "all_or_nothing" (default) or "partial" to accept whatever is available
+            ttl_seconds: Lease length for every seat (server default if omitted)
+            session_id: Session owning the leases (see release_session)
+            host: Host owning the leases (see release_session)
+        
+        Returns:
+            List of LicenseHandle, one per granted seat
+        
+        Raises:
+            NoLicensesAvailableError: If an all-or-nothing batch cannot be satisfied
+            LicenseError: On other errors
+        
+        Example:
+            handles = client.borrow_many([("cad_tool", "ci-runner", 8)])
+            try:
+                run_build()
+            finally:
+                client.return_many(handles)
+        """
+        normalized = [(item[0], item[1], item[2] if len(item) > 2 else 1) for item in items]
+        url = f"{self.base_url}/licenses/borrow:batch"
+        payload = {
+            "mode": mode,
+            "items": [{"tool": tool, "user": user, "quantity": quantity} for tool, user, quantity in normalized],
+            **self._lease_options(ttl_seconds, session_id, host)
+        }
+        
+        headers = {}
+        if self.enable_security:
+            timestamp = str(int(time.time()))
+            headers = {
+                "X-Signature": self._generate_batch_signature(normalized, mode, timestamp, ttl_seconds, session_id, host),
+                "X-Timestamp": timestamp,
+                "X-Vendor-ID": self.VENDOR_ID
+            }
+            if self.api_key:
+                headers["Authorization"] = f"Bearer {self.api_key}"
+        
+        try:
+            response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+            
+            if response.status_code == 409:
+                failures = response.json().get("detail", {}).get("failures", [])
+                raise NoLicensesAvailableError(failures[0]["tool"] if failures else normalized[0][0])
+            
+            response.raise_for_status()
+            data = response.json()
+            
+            return [
+                LicenseHandle(license_id=b["id"], tool=b["tool"], user=b["user"], client=self)
+                for b in data["borrows"]
+            ]
+        
+        except requests.exceptions.RequestException as e:
+            raise LicenseError(f"Failed to borrow licenses: {e}") from e
+    
+    def return_many(self, handles: List[LicenseHandle]) -> None:
+        """
+        Return many borrowed licenses in one request.
+        
+        Args:
+            handles: License handles to return (already returned handles are skipped)
+        
+        Raises:
+            LicenseError: On error
+        """
+        pending = [h for h in handles if not h._returned]
+        if not pending:
+            return
+        url = f"{self.base_url}/licenses/return:batch"
+        payload = {"ids": [h.id for h in pending]}
+        
+        try:
+            response = self.session.post(url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        
+        except requests.exceptions.RequestException as e:
+            raise LicenseError(f"Failed to return licenses: {e}") from e
+        
+        for h in pending:
+            h._returned = True
+    
+    def heartbeat(self, handles: List[LicenseHandle], ttl_seconds: Optional[int] = None) -> List[str]:
+        """
+        Renew the leases of many borrowed licenses in one request.
+        
+        Args:
+            handles: License handles to keep alive
+            ttl_seconds: New lease length (server default if omitted)
+        
+        Returns:
+            IDs whose lease had already expired or been returned
+        
+        Raises:
+            LicenseError: On error
+        """
+        pending = [h for h in handles if not h._returned]
+        if not pending:
+            return []
+        url = f"{self.base_url}/licenses/heartbeat"
+        payload = {"ids": [h.id for h in pending]}
+        if ttl_seconds is not None:
+            payload["ttl_seconds"] = ttl_seconds
+        headers = self._lease_call_headers("heartbeat", [ttl_seconds] + payload["ids"])
+        
+        try:
+            response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json().get("expired", [])
+        
+        except requests.exceptions.RequestException as e:
+            raise LicenseError(f"Failed to renew leases: {e}") from e
+    
+    def release_session(self, session_id: Optional[str] = None, host: Optional[str] = None) -> int:
+        """
+        Release every license held by a session and/or host (e.g. after a crash),
+        as passed to borrow()/borrow_many().
+        
+        Returns:
+            Number of licenses released
+        
+        Raises:
+            LicenseError: On error
+        """
+        url = f"{self.base_url}/licenses/release"
+        payload = {"session_id": session_id, "host": host}
+        headers = self._lease_call_headers("release", [session_id, host])
+        
+        try:
+            response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            return len(response.json().get("released", []))
+        
+        except requests.exceptions.RequestException as e:
+            raise LicenseError(f"Failed to release session: {e}") from e
+    
     def get_status(self, tool: str) -> LicenseStatus:
         """
         Get status for a specific tool.
@@ -0,0 +1,522 @@
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+os.environ["LICENSE_DB_SEED"] = "false"
+
+
+@contextmanager
+def temp_db():
+    with tempfile.TemporaryDirectory() as td:
+        db_path = os.path.join(td, "test.db")
+        os.environ["LICENSE_DB_PATH"] = db_path
+        yield db_path
+
+
+def seed(tools=None):
+    from app.db import initialize_database
+
+    initialize_database(tools or [{"tool": "cad_tool", "total": 2, "commit_qty": 1, "max_overage": 1}])
+
+
+def test_pooled_connections_use_wal_and_are_reused():
+    from app.db import get_connection, unit_of_work
+
+    with temp_db():
+        seed()
+        with get_connection(False) as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            first = conn
+        with get_connection(False) as conn:
+            assert conn is first
+
+        with unit_of_work():
+            with get_connection(True) as a, get_connection(False) as b:
+                assert a is b
+
+        # Helpers nesting on the shared connection keep the caller's transaction
+        with unit_of_work():
+            with get_connection(False) as conn:
+                conn.execute("UPDATE licenses SET total = 7 WHERE tool = 'cad_tool'")
+                with get_connection(True) as nested:
+                    nested.execute("SELECT COUNT(*) FROM borrows").fetchone()
+                assert conn.in_transaction
+                conn.commit()
+        with get_connection(True) as conn:
+            assert conn.execute("SELECT total FROM licenses WHERE tool = 'cad_tool'").fetchone()[0] == 7
+
+
+def test_borrow_is_atomic_and_reports_failure_reason():
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    from app.db import borrow_license, get_status
+
+    with temp_db():
+        seed([{"tool": "cad_tool", "total": 10, "commit_qty": 2, "max_overage": 3}])
+
+        def attempt(i):
+            return borrow_license("cad_tool", f"user{i}", str(uuid.uuid4()), "2025-01-01T00:00:00+00:00")
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(attempt, range(20)))
+
+        ok = [r for r in results if r[0]]
+        assert len(ok) == 5
+        assert sum(1 for r in ok if r[1]) == 3
+        assert {r[2] for r in results if not r[0]} == {"max_overage"}
+        assert get_status("cad_tool")["borrowed"] == 5
+
+        assert attempt(99)[2] == "max_overage"
+        assert borrow_license("nope", "u", str(uuid.uuid4()), "2025-01-01T00:00:00+00:00") == (False, False, "unknown_tool")
+
+
+def test_migrations_upgrade_legacy_database_once():
+    import sqlite3
+    from app.db import get_connection
+    from app.migrations import LATEST_VERSION, current_version, migrate, table_columns
+
+    with temp_db() as db_path:
+        # Database as created by releases that added columns lazily
+        legacy = sqlite3.connect(db_path)
+        legacy.execute("CREATE TABLE licenses (tool TEXT PRIMARY KEY, total INTEGER NOT NULL, borrowed INTEGER NOT NULL DEFAULT 0, commit_qty INTEGER DEFAULT 0, max_overage INTEGER DEFAULT 0, commit_price REAL DEFAULT 0.0, overage_price_per_license REAL DEFAULT 0.0)")
+        legacy.execute("CREATE TABLE users (username TEXT PRIMARY KEY, password_hash TEXT NOT NULL)")
+        legacy.commit()
+        legacy.close()
+
+        seed()
+        with get_connection(False) as conn:
+            assert current_version(conn) == LATEST_VERSION
+            cur = conn.cursor()
+            assert "customer_max_spend" in table_columns(cur, "licenses")
+            assert {"tenant_id", "vendor_id", "last_login_at"} <= table_columns(cur, "users")
+            assert migrate(conn) == []
+
+
+def test_overage_ledger_tracks_period_totals_and_enforces_max_spend():
+    import uuid
+    from datetime import datetime, timezone
+    from app.db import borrow_license, get_all_status, get_month_to_date_overage_cost, get_status, set_customer_max_spend
+
+    with temp_db():
+        seed([{"tool": "cad_tool", "total": 10, "commit_qty": 1, "max_overage": 5, "overage_price_per_license": 100.0}])
+        set_customer_max_spend("cad_tool", 250.0)
+        now = datetime.now(timezone.utc).isoformat()
+
+        results = [borrow_license("cad_tool", "alice", str(uuid.uuid4()), now) for _ in range(4)]
+        assert [r[0] for r in results] == [True, True, True, False]
+        assert results[-1][2] == "max_spend"
+
+        assert get_month_to_date_overage_cost("cad_tool") == 200.0
+        assert get_status("cad_tool")["overage_borrows"] == 2
+        assert get_all_status()[0]["current_overage_cost"] == 200.0
+
+        # Ledger rows (and the spend cap) are per tenant on a shared licenses table
+        from app.sharding import tenant_scope
+        with tenant_scope("acme"):
+            assert get_month_to_date_overage_cost("cad_tool") == 0.0
+            results = [borrow_license("cad_tool", "bob", str(uuid.uuid4()), now) for _ in range(3)]
+            assert [r[0] for r in results] == [True, True, False] and results[-1][2] == "max_spend"
+            assert get_month_to_date_overage_cost("cad_tool") == 200.0
+        assert get_month_to_date_overage_cost("cad_tool") == 200.0
+
+        from app.db import get_budget_overview
+        [row] = get_budget_overview()
+        assert (row["tool"], row["borrowed"], row["customer_max_spend"]) == ("cad_tool", 5, 250.0)
+        assert row["month_to_date_overage_cost"] == 200.0 and row["remaining_spend"] == 50.0
+
+
+def test_memory_engine_journals_and_checkpoints_to_sqlite():
+    import uuid
+    from app import db
+    from app.engine import AllocationEngine
+
+    with temp_db() as db_path:
+        seed([{"tool": "cad_tool", "total": 3, "commit_qty": 1, "max_overage": 1, "overage_price_per_license": 50.0}])
+        engine = AllocationEngine(db_path, checkpoint_seconds=3600)
+        engine.start()
+        db.set_allocation_engine(engine)
+        try:
+            ids = [str(uuid.uuid4()) for _ in range(3)]
+            results = [db.borrow_license("cad_tool", "alice", i, "2025-01-01T00:00:00+00:00") for i in ids]
+            assert [r[0] for r in results] == [True, True, False]
+            assert results[-1][2] == "max_overage"
+            assert db.return_license(ids[0]) == "cad_tool"
+            assert db.return_license(ids[0]) is None
+            assert db.get_status("cad_tool")["borrowed"] == 1
+            assert db.get_all_status()[0]["overage_borrows"] == 1
+        finally:
+            db.set_allocation_engine(None)
+            engine._stopping.set()
+            engine._wakeup.set()
+            for t in engine._threads:
+                t.join()
+            engine._journal.close()
+
+        # Simulate a crash: nothing checkpointed yet, journal replayed on restart
+        assert db.get_status("cad_tool")["borrowed"] == 0
+        restarted = AllocationEngine(db_path, checkpoint_seconds=3600)
+        restarted.start()
+        restarted.stop()
+        with db.get_connection(True) as conn:
+            rows = conn.execute("SELECT id FROM borrows").fetchall()
+            assert [r["id"] for r in rows] == [ids[1]]
+        status = db.get_status("cad_tool")
+        assert status["borrowed"] == 1 and status["overage_borrows"] == 1
+        assert not os.path.exists(db_path + ".journal.ckpt")
+
+
+def test_writer_actor_group_commits_and_isolates_failures(monkeypatch):
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    from app import db, writer
+
+    with temp_db() as db_path:
+        seed([{"tool": "cad_tool", "total": 50, "commit_qty": 50, "max_overage": 0}])
+        monkeypatch.setattr(writer, "WRITE_MODE", "actor")
+        try:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                results = list(pool.map(
+                    lambda i: db.borrow_license("cad_tool", f"user{i}", str(uuid.uuid4()), "2025-01-01T00:00:00+00:00"),
+                    range(60),
+                ))
+            assert sum(1 for r in results if r[0]) == 50
+            assert {r[2] for r in results if not r[0]} == {"exhausted"}
+
+            def boom(cur):
+                cur.execute("UPDATE licenses SET total = 0")
+                raise ValueError("boom")
+
+            w = writer.get_writer(db_path, lambda: db._open_connection(db_path, False))
+            bad = w.submit(boom)
+            good = w.submit(db._return_in_txn, "missing")
+            assert good.result() is None
+            try:
+                bad.result()
+                assert False, "expected ValueError"
+            except ValueError:
+                pass
+            assert db.get_status("cad_tool")["total"] == 50
+
+            # Non-OperationalError at commit fails the batch, not the writer thread
+            def bad_commit(conn_factory):
+                conn = conn_factory()
+                real_commit = conn.commit
+                calls = []
+
+                class Conn:
+                    def __getattr__(self, name):
+                        return getattr(conn, name)
+
+                    def commit(self):
+                        calls.append(1)
+                        if len(calls) == 1:
+                            raise sqlite3.IntegrityError("deferred constraint failed")
+                        real_commit()
+                return Conn()
+
+            flaky = writer.DbWriter(db_path + ".flaky", lambda: bad_commit(lambda: db._open_connection(db_path, False)))
+            try:
+                flaky.execute(db._return_in_txn, "missing", timeout=5)
+                assert False, "expected IntegrityError"
+            except sqlite3.IntegrityError:
+                pass
+            assert flaky.execute(db._return_in_txn, "missing", timeout=5) is None
+            flaky.stop()
+
+            # A writer that cannot connect fails queued and later commands instead of hanging
+            def no_connect():
+                raise sqlite3.OperationalError("unable to open database file")
+
+            dead = writer.get_writer(db_path + ".dead", no_connect)
+            for _ in range(2):
+                try:
+                    dead.execute(db._return_in_txn, "missing", timeout=5)
+                    assert False, "expected OperationalError"
+                except sqlite3.OperationalError:
+                    pass
+            assert writer.get_writer(db_path + ".dead", no_connect) is not dead
+        finally:
+            writer.stop_all_writers()
+
+
+def test_async_db_runs_helpers_off_the_event_loop():
+    import asyncio
+    import threading
+    from app import async_db
+    from app.db import get_connection, unit_of_work
+
+    with temp_db():
+        seed()
+
+        async def main():
+            loop_thread = threading.get_ident()
+            with unit_of_work():
+                with get_connection(True) as conn:
+                    request_conn = conn
+
+                def probe():
+                    with get_connection(True) as conn:
+                        return threading.get_ident(), conn
+
+                worker_thread, worker_conn = await async_db.run_db(probe)
+                assert worker_thread != loop_thread
+                assert worker_conn is request_conn
+
+            stats = await async_db.get_platform_stats()
+            assert stats["licenses"]["total_provisioned"] == 1
+            assert await async_db.get_login_user("nobody") is None
+
+        asyncio.run(main())
+        async_db.shutdown_executor()
+
+
+def test_memory_engine_batch_borrow_is_all_or_nothing():
+    from app import db
+    from app.engine import AllocationEngine
+
+    with temp_db() as db_path:
+        seed([{"tool": "cad_tool", "total": 3, "commit_qty": 3, "max_overage": 0}, {"tool": "sim", "total": 1, "commit_qty": 1, "max_overage": 0}])
+        engine = AllocationEngine(db_path, checkpoint_seconds=3600)
+        engine.start()
+        db.set_allocation_engine(engine)
+        try:
+            ts = "2025-01-01T00:00:00+00:00"
+            results = db.borrow_licenses_batch([("cad_tool", "ci", 2), ("sim", "ci", 2)], ts)
+            assert [len(r["granted"]) for r in results] == [0, 0]
+            assert results[1]["reason"] == "exhausted"
+            assert db.get_status("cad_tool")["borrowed"] == 0
+
+            results = db.borrow_licenses_batch([("cad_tool", "ci", 2), ("sim", "ci", 2)], ts, all_or_nothing=False)
+            assert [len(r["granted"]) for r in results] == [2, 1]
+            ids = [g["id"] for r in results for g in r["granted"]]
+            assert db.return_licenses_batch(ids + ["missing"]) == ["cad_tool", "cad_tool", "sim", None]
+        finally:
+            db.set_allocation_engine(None)
+            engine.stop()
+
+
+def test_tenant_shards_route_licensing_data_and_fan_out(monkeypatch):
+    import uuid
+    from app import db, sharding
+
+    with temp_db() as db_path:
+        seed()
+        monkeypatch.setattr(sharding, "SHARDING_MODE", "tenant")
+        try:
+            tenant_id = db.create_tenant("Acme", "admin@acme.test")["tenant_id"]
+            db.provision_license_to_tenant("techvendor", tenant_id, {
+                "product_id": "cad", "product_name": "cad_tool", "total": 5, "commit_qty": 5, "max_overage": 0
+            })
+            shard = sharding.shard_path(db_path, tenant_id)
+            assert os.path.exists(shard)
+
+            borrow_id = str(uuid.uuid4())
+            with sharding.tenant_scope(tenant_id):
+                assert db.borrow_license("cad_tool", "alice", borrow_id, "2025-01-01T00:00:00+00:00")[0]
+                assert db.get_status("cad_tool")["total"] == 5
+            # Catalog's own cad_tool is untouched
+            assert db.get_status("cad_tool")["borrowed"] == 0
+            assert db.get_tenant_licenses(tenant_id)[0]["borrowed"] == 1
+            assert db.get_platform_stats()["licenses"]["active_borrows"] == 1
+
+            try:
+                db.delete_tenant(tenant_id, hard_delete=True)
+                assert False, "expected ValueError"
+            except ValueError:
+                pass
+            with sharding.tenant_scope(tenant_id):
+                assert db.return_license(borrow_id) == "cad_tool"
+            db.delete_tenant(tenant_id, hard_delete=True)
+            assert not os.path.exists(shard)
+        finally:
+            db.close_all_connections()
+
+
+def test_lease_sweep_renew_and_session_release():
+    from app import db
+    from app.engine import AllocationEngine
+
+    def exercise():
+        ts = "2025-01-01T00:00:00+00:00"
+        assert db.borrow_license("cad_tool", "a", "old", ts, "2025-01-01T00:01:00+00:00", "s1", "h1")[0]
+        assert db.borrow_license("cad_tool", "b", "kept", ts, "2025-01-01T00:01:00+00:00", "s2", "h2")[0]
+        assert db.borrow_license("cad_tool", "c", "forever", ts)[0]
+
+        assert db.renew_leases(["kept", "missing"], "2025-01-01T01:00:00+00:00") == ["kept"]
+        assert db.sweep_expired_leases("2025-01-01T00:30:00+00:00") == [("old", "cad_tool")]
+        assert db.get_status("cad_tool")["borrowed"] == 2
+        assert db.sweep_expired_leases("2025-01-01T00:30:00+00:00") == []
+
+        assert db.release_session(host="h2") == [("kept", "cad_tool")]
+        assert db.get_status("cad_tool")["borrowed"] == 1
+        assert db.sweep_expired_leases("2030-01-01T00:00:00+00:00") == []
+        assert db.return_license("forever") == "cad_tool"
+
+    tools = [{"tool": "cad_tool", "total": 5, "commit_qty": 5, "max_overage": 0}]
+    with temp_db():
+        seed(tools)
+        exercise()
+        try:
+            db.release_session()
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+
+    with temp_db() as db_path:
+        seed(tools)
+        engine = AllocationEngine(db_path, checkpoint_seconds=3600)
+        engine.start()
+        db.set_allocation_engine(engine)
+        try:
+            exercise()
+        finally:
+            db.set_allocation_engine(None)
+            engine.stop()
+        with db.get_connection(True) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM borrows").fetchone()[0] == 0
+
+
+def test_lease_history_compacts_closed_months_into_cold_files():
+    import gzip
+    from app import db, history
+
+    with temp_db() as db_path:
+        seed([{"tool": "cad_tool", "total": 5, "commit_qty": 1, "max_overage": 4, "overage_price_per_license": 10.0}])
+        assert db.borrow_license("cad_tool", "a", "b1", "2025-01-01T00:00:00+00:00")[0]
+        assert db.borrow_license("cad_tool", "b", "b2", "2025-01-01T00:00:00+00:00")[0]
+        assert db.return_license("b1") == "cad_tool"
+        assert db.return_license("b2") == "cad_tool"
+        with db.get_connection(False) as conn:
+            conn.execute("UPDATE lease_history SET period = '2025-01', returned_at = '2025-01-01T01:00:00+00:00' WHERE id = 'b1'")
+            conn.commit()
+
+        archived = history.compact_closed_periods()
+        assert {(a["table"], a["period"], a["rows"]) for a in archived} == {("lease_history", "2025-01", 1), ("overage_charges", "2025-01", 1)}
+        assert history.compact_closed_periods() == []
+
+        with db.get_connection(True) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM lease_history").fetchone()[0] == 1
+            assert conn.execute("SELECT COUNT(*) FROM overage_charges").fetchone()[0] == 0
+        cold = os.path.join(history.archive_dir(db_path), "lease_history", "2025-01.0.ndjson.gz")
+        with gzip.open(cold, "rt") as f:
+            assert '"id":"b1"' in f.read()
+
+        leases = list(history.iter_rows("lease_history"))
+        assert [r["id"] for r in leases] == ["b1", "b2"]
+        assert leases[0]["end_reason"] == "returned" and leases[0]["duration_seconds"] > 0
+        assert [r["id"] for r in history.iter_rows("lease_history", "2025-01", "2025-01")] == ["b1"]
+        assert [r["borrow_id"] for r in history.iter_rows("overage_charges", tool="cad_tool")] == ["b2"]
+        assert db.get_all_status()[0]["overage_borrows"] == 1
+
+
+def test_hard_delete_job_runs_in_chunks_and_resumes(monkeypatch):
+    import time
+    from types import SimpleNamespace
+    from app import db, jobs, ledger
+
+    with temp_db():
+        seed()
+        db.create_tenant("Acme Corp", "admin@acme.example", tenant_id="acme")
+        for i in range(7):
+            db.generate_api_key(tenant_id="acme", name=f"k{i}")
+        with db.get_connection(False) as conn:
+            ledger.add_to_ledger(conn.cursor(), "cad_tool", "2025-01", 1, 10.0, "acme")
+            conn.commit()
+        monkeypatch.setattr(jobs, "DELETE_CHUNK_ROWS", 3)
+
+        # Queue without a worker (as if the process died right after the 202), then resume
+        get_runner = jobs.get_runner
+        monkeypatch.setattr(jobs, "get_runner", lambda: SimpleNamespace(enqueue=lambda job_id: None))
+        with db.unit_of_work():  # as from a request: the borrow check shares the request connection
+            job = jobs.submit_hard_delete("delete_tenant", "acme")
+        assert job["status"] == "queued"
+        with db.get_connection(True) as conn:
+            assert conn.execute("SELECT status FROM tenants WHERE tenant_id = 'acme'").fetchone()[0] == "deleting"
+        monkeypatch.setattr(jobs, "get_runner", get_runner)
+
+        try:
+            assert jobs.resume_jobs() == 1
+            for _ in range(200):
+                if jobs.get_job(job["job_id"])["status"] == "succeeded":
+                    break
+                time.sleep(0.01)
+        finally:
+            jobs.stop_runner()
+        done = jobs.get_job(job["job_id"])
+        assert done["status"] == "succeeded" and done["rows_deleted"] == 1 + 7 + 1 + 1  # ledger, keys, admin user, tenant
+        with db.get_connection(True) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM api_keys WHERE tenant_id = 'acme'").fetchone()[0] == 0
+            assert conn.execute("SELECT COUNT(*) FROM overage_ledger WHERE tenant_id = 'acme'").fetchone()[0] == 0
+            assert conn.execute("SELECT COUNT(*) FROM tenants").fetchone()[0] == 0
+
+        try:
+            jobs.submit_hard_delete("delete_tenant", "acme")
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+
+
+def test_api_key_validation_is_cached_filtered_and_batches_last_used(monkeypatch):
+    from app import apikeys
+    from app import db
+
+    with temp_db():
+        seed()
+        api_key, key_id = db.generate_api_key("acme", "CI")
+        other_key, other_id = db.generate_api_key("acme", "Ops")
+        assert db.validate_api_key(api_key)["key_id"] == key_id
+
+        # Cached keys and bogus keys are answered without a key lookup or a write:
+        # a filter miss only re-reads the api_keys stamp
+        real_get_connection = db.get_connection
+        executed = []
+
+        @contextmanager
+        def traced(*args, **kwargs):
+            with real_get_connection(*args, **kwargs) as conn:
+                conn.set_trace_callback(executed.append)
+                try:
+                    yield conn
+                finally:
+                    conn.set_trace_callback(None)
+
+        monkeypatch.setattr(db, "get_connection", traced)
+        for _ in range(100):
+            assert db.validate_api_key(api_key)["tenant_id"] == "acme"
+            assert db.validate_api_key("acme_live_pk_bogus") is None
+        monkeypatch.setattr(db, "get_connection", real_get_connection)
+        assert executed and all(sql.startswith("SELECT (SELECT MAX(rowid) FROM api_keys)") for sql in executed)
+
+
+        with db.get_connection(True, catalog=True) as conn:
+            assert conn.execute("SELECT last_used_at FROM api_keys WHERE id = ?", (key_id,)).fetchone()[0] is None
+        assert db.validate_api_key(other_key)["key_id"] == other_id
+        assert apikeys.flush() == 2
+        with db.get_connection(True, catalog=True) as conn:
+            used = dict(conn.execute("SELECT id, last_used_at FROM api_keys").fetchall())
+            assert used[key_id] and used[other_id]
+
+        # Revocation takes effect immediately despite the cache
+        assert db.revoke_api_key(key_id)
+        assert db.validate_api_key(api_key) is None
+        assert db.validate_api_key(other_key)["key_id"] == other_id
+
+        # Keys created by another process are accepted at once (no add_key here)
+        monkeypatch.setattr(apikeys, "add_key", lambda key_hash: None)
+        remote_key, remote_id = db.generate_api_key("acme", "Remote")
+        monkeypatch.undo()
+        assert db.validate_api_key(remote_key)["key_id"] == remote_id
+
+        # A key added while the filter is being reloaded survives the swap
+        index = apikeys._current_index()
+        real_stamp = apikeys._filter_stamp
+
+        def stamp_with_concurrent_add(cur):
+            apikeys.add_key("f" * 64)
+            return real_stamp(cur)
+
+        monkeypatch.setattr(apikeys, "_filter_stamp", stamp_with_concurrent_add)
+        apikeys._load_filter(index)
+        monkeypatch.undo()
+        assert "f" * 64 in index.filter
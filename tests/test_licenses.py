@@ -69,3 +69,602 @@ def test_metrics_endpoint_present():
         assert b"license_borrow_attempts_total" in m.content
 
 
+def test_license_gauges_are_collected_at_scrape_time_and_cached(monkeypatch):
+    from app import db, main
+
+    monkeypatch.setattr(main.metrics_cache, "interval", 60)
+    monkeypatch.setattr(main.metrics_cache, "_rendered_at", None)
+    with temp_db():
+        app = make_app_with_seed()
+        client = TestClient(app)
+        # State changed outside any request handler (e.g. before a restart) still shows up
+        assert db.borrow_license("cad_tool", "alice", "b1", "2025-01-01T00:00:00+00:00")[0]
+        body = client.get("/metrics").text
+        assert 'licenses_borrowed{tool="cad_tool"} 1.0' in body
+        assert 'licenses_total{tool="cad_tool"} 2.0' in body
+        assert 'licenses_at_max_overage{tool="cad_tool"} 0.0' in body
+
+        # Within the cache interval scrapes share one rendering
+        assert db.borrow_license("cad_tool", "bob", "b2", "2025-01-01T00:00:00+00:00")[0]
+        assert client.get("/metrics").text == body
+        monkeypatch.setattr(main.metrics_cache, "interval", 0)
+        assert 'licenses_borrowed{tool="cad_tool"} 2.0' in client.get("/metrics").text
+
+
+def test_metric_labels_use_route_templates_and_bounded_cardinality(monkeypatch):
+    import time
+    from app import collectors, main
+    from app.security import generate_signature
+
+    limiter = collectors.LabelLimiter(default_limit=3, limits={"route": 50})
+    monkeypatch.setattr(collectors, "label_limiter", limiter)
+    monkeypatch.setattr(main.metrics_cache, "interval", 0)
+    with temp_db():
+        app = make_app_with_seed()
+        client = TestClient(app)
+        # Borrows of tools that do not exist never take a tool label slot
+        ts = str(int(time.time()))
+        headers = {"X-Signature": generate_signature("bogus", "alice", ts), "X-Timestamp": ts}
+        assert client.post("/licenses/borrow", json={"tool": "bogus", "user": "alice"}, headers=headers).status_code == 409
+        assert "bogus" not in limiter._seen.get("tool", set())
+        for tool in ("t1", "t2", "t3", "t4"):
+            client.get(f"/licenses/{tool}/status")
+        for tool in ("t1", "t2", "t3", "t4", "t5"):
+            assert limiter("tool", tool) == (tool if tool in ("t1", "t2", "t3") else collectors.OTHER_LABEL)
+        body = client.get("/metrics").text
+        assert 'route="/licenses/{tool}/status"' in body
+        assert 'route="/licenses/t1/status"' not in body
+
+    top = collectors.TopKCounter("test_top_users", "test", "user", k=2)
+    for i in range(100):
+        top.inc(f"user{i}")
+        top.inc("heavy", 3)
+    top.inc("second", 50)
+    assert [user for user, _ in top.top()] == ["heavy", "second"]
+    assert len(top._counts) <= top.capacity
+
+
+def test_borrow_returns_post_borrow_status_from_one_transaction():
+    import time
+    from app import db
+    from app.engine import AllocationEngine
+    from app.security import generate_signature
+
+    def borrow(client, user, **extra):
+        ts = str(int(time.time()))
+        headers = {"X-Signature": generate_signature("cad_tool", user, ts), "X-Timestamp": ts}
+        return client.post("/licenses/borrow", json={"tool": "cad_tool", "user": user, **extra}, headers=headers)
+
+    def exercise(client):
+        r = borrow(client, "alice")
+        assert r.status_code == 200 and "status" not in r.json()
+        r = borrow(client, "bob", include_status=True)
+        assert r.status_code == 200
+        status = r.json()["status"]
+        assert (status["borrowed"], status["available"], status["overage"]) == (2, 0, 1)
+        assert status == client.get("/licenses/cad_tool/status").json()
+        assert borrow(client, "carol").status_code == 409
+
+        result = db.borrow_license_with_status("cad_tool", "dave", "x", "2025-01-01T00:00:00+00:00")
+        assert (result["ok"], result["reason"], result["status"]["borrowed"]) == (False, "exhausted", 2)
+        assert db.borrow_license_with_status("nope", "dave", "y", "2025-01-01T00:00:00+00:00")["status"] is None
+
+    with temp_db():
+        exercise(TestClient(make_app_with_seed()))
+    with temp_db() as db_path:
+        app = make_app_with_seed()
+        engine = AllocationEngine(db_path, checkpoint_seconds=3600)
+        engine.start()
+        db.set_allocation_engine(engine)
+        try:
+            exercise(TestClient(app))
+        finally:
+            db.set_allocation_engine(None)
+            engine.stop()
+
+
+def test_batch_borrow_and_return():
+    import time
+    from app.security import generate_batch_signature, generate_lease_signature
+
+    def signed(items, mode, **lease):
+        ts = str(int(time.time()))
+        return {"X-Signature": generate_batch_signature(items, mode, ts, **lease), "X-Timestamp": ts}
+
+    with temp_db():
+        app = make_app_with_seed()
+        client = TestClient(app)
+
+        # all-or-nothing: 3 seats of a 2-seat tool grants nothing
+        items = [("cad_tool", "ci", 3)]
+        body = {"items": [{"tool": "cad_tool", "user": "ci", "quantity": 3}], "mode": "all_or_nothing"}
+        r = client.post("/licenses/borrow:batch", json=body, headers=signed(items, "all_or_nothing"))
+        assert r.status_code == 409
+        assert r.json()["detail"]["failures"][0]["reason"] == "exhausted"
+        assert client.get("/licenses/cad_tool/status").json()["borrowed"] == 0
+
+        # signature covers the whole batch
+        r = client.post("/licenses/borrow:batch", json={**body, "mode": "partial"}, headers=signed(items, "all_or_nothing"))
+        assert r.status_code == 403
+        # ... including the lease parameters
+        lease = {"ttl_seconds": 60, "session_id": "ci-42", "host": "runner-1"}
+        r = client.post("/licenses/borrow:batch", json={**body, "ttl_seconds": 86400, "session_id": "ci-42", "host": "runner-1"},
+                        headers=signed(items, "all_or_nothing", **lease))
+        assert r.status_code == 403
+
+        # partial: grants what is available
+        r = client.post("/licenses/borrow:batch", json={**body, "mode": "partial"}, headers=signed(items, "partial"))
+        assert r.status_code == 200
+        data = r.json()
+        assert len(data["borrows"]) == 2
+        assert data["failures"][0]["granted"] == 2
+
+        ids = [b["id"] for b in data["borrows"]]
+        r = client.post("/licenses/return:batch", json={"ids": ids + ["missing"]})
+        assert r.status_code == 200
+        assert len(r.json()["returned"]) == 2
+        assert r.json()["not_found"] == ["missing"]
+        assert client.get("/licenses/cad_tool/status").json()["borrowed"] == 0
+
+        # Heartbeat and session release are signed like borrows
+        items = [("cad_tool", "ci", 2)]
+        lease = {"ttl_seconds": 300, "session_id": "ci-42", "host": "runner-1"}
+        body = {"items": [{"tool": "cad_tool", "user": "ci", "quantity": 2}], **lease}
+        ids = [b["id"] for b in client.post("/licenses/borrow:batch", json=body,
+                                            headers=signed(items, "all_or_nothing", **lease)).json()["borrows"]]
+        assert client.post("/licenses/heartbeat", json={"ids": ids, "ttl_seconds": 300}).status_code == 403
+        ts = str(int(time.time()))
+        r = client.post("/licenses/heartbeat", json={"ids": ids, "ttl_seconds": 300}, headers={
+            "X-Signature": generate_lease_signature("heartbeat", [300] + ids, ts), "X-Timestamp": ts})
+        assert r.status_code == 200 and r.json()["renewed"] == ids
+        assert client.post("/licenses/release", json={"host": "runner-1"}).status_code == 403
+        r = client.post("/licenses/release", json={"host": "runner-1"}, headers={
+            "X-Signature": generate_lease_signature("release", [None, "runner-1"], ts), "X-Timestamp": ts})
+        assert r.status_code == 200 and len(r.json()["released"]) == 2
+
+
+def test_list_endpoints_use_keyset_pagination_and_fields():
+    import base64
+    import uuid
+    from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+    from app.db import borrow_license
+
+    with temp_db():
+        app = make_app_with_seed()
+        from app.db import initialize_database
+        initialize_database([{"tool": "sim", "total": 10, "commit_qty": 0, "max_overage": 10, "overage_price_per_license": 5.0}])
+        for i in range(5):
+            assert borrow_license("sim", f"u{i}", str(uuid.uuid4()), f"2025-01-0{i + 1}T00:00:00+00:00")[0]
+        client = TestClient(app)
+
+        r = client.get("/borrows", params={"limit": 2, "fields": "user"})
+        assert r.status_code == 200
+        assert r.json() == [{"user": "u4"}, {"user": "u3"}]
+        seen = [row["user"] for row in r.json()]
+        while "X-Next-Cursor" in r.headers:
+            r = client.get("/borrows", params={"limit": 2, "fields": "user", "cursor": r.headers["X-Next-Cursor"]})
+            seen += [row["user"] for row in r.json()]
+        assert seen == ["u4", "u3", "u2", "u1", "u0"]
+
+        r = client.get("/overage-charges", params={"tool": "sim", "limit": 3})
+        body = r.json()
+        assert len(body["charges"]) == 3 and body["charges"][0]["amount"] == 5.0
+        r = client.get("/overage-charges", params={"tool": "sim", "limit": 3, "cursor": body["next_cursor"]})
+        assert len(r.json()["charges"]) == 2 and r.json()["next_cursor"] is None
+
+        assert client.get("/borrows", params={"fields": "password"}).status_code == 400
+        assert client.get("/borrows", params={"cursor": "not-a-cursor"}).status_code == 400
+        non_scalar = base64.urlsafe_b64encode(b"[{},[]]").decode("ascii")
+        assert client.get("/borrows", params={"cursor": non_scalar}).status_code == 400
+
+        # Callers that send no limit (the dashboard) still get bounded pages
+        params = client.get("/openapi.json").json()["paths"]["/borrows"]["get"]["parameters"]
+        limit = next(p for p in params if p["name"] == "limit")["schema"]
+        assert limit["default"] == DEFAULT_PAGE_SIZE and limit["maximum"] == MAX_PAGE_SIZE
+
+
+def test_streaming_exports_cover_live_and_archived_rows(monkeypatch):
+    import csv
+    import io
+    import json
+    import uuid
+    from app import exports, history, main
+    from app.db import borrow_license, return_license
+    from app.sharding import tenant_scope
+
+    monkeypatch.setenv("PERMETRIX_ADMIN_API_KEY", "admin-secret")
+    with temp_db():
+        app = make_app_with_seed()
+        from app.db import initialize_database
+        initialize_database([{"tool": "sim", "total": 10, "commit_qty": 0, "max_overage": 10, "overage_price_per_license": 5.0}])
+        ids = [str(uuid.uuid4()) for _ in range(4)]
+        for i, borrow_id in enumerate(ids):
+            assert borrow_license("sim", f"u{i}", borrow_id, f"2025-0{i + 1}-15T00:00:00+00:00")[0]
+        with tenant_scope("acme"):
+            assert borrow_license("sim", "acme-user", str(uuid.uuid4()), "2025-01-20T00:00:00+00:00")[0]
+        assert history.compact_closed_periods("2025-03")  # Jan + Feb charges go cold
+        return_license(ids[0])
+        client = TestClient(app, headers={"Authorization": "Bearer admin-secret"})
+
+        r = client.get("/export/overage-charges", params={"tool": "sim"})
+        assert r.status_code == 200 and r.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in r.text.splitlines()]
+        assert [row["borrow_id"] for row in rows if row["tenant_id"] == ""] == ids
+        # Archived and live charges carry their tenant, and exports filter on it
+        r = client.get("/export/overage-charges", params={"tenant_id": "acme"})
+        assert [json.loads(line)["user"] for line in r.text.splitlines()] == ["acme-user"]
+
+        r = client.get("/export/overage-charges", params={"format": "csv", "since": "2025-02-01", "until": "2025-04-01"})
+        parsed = list(csv.DictReader(io.StringIO(r.text)))
+        assert [row["user"] for row in parsed] == ["u1", "u2"]
+
+        exports.EXPORT_CHUNK_ROWS, chunk = 1, exports.EXPORT_CHUNK_ROWS
+        try:
+            r = client.get("/export/borrows", params={"tool": "sim"})
+        finally:
+            exports.EXPORT_CHUNK_ROWS = chunk
+        assert [json.loads(line)["user"] for line in r.text.splitlines()] == ["acme-user", "u1", "u2", "u3"]
+        r = client.get("/export/borrows", params={"state": "completed"})
+        assert [json.loads(line)["id"] for line in r.text.splitlines()] == [ids[0]]
+
+        assert client.get("/export/borrows", params={"since": "yesterday"}).status_code == 400
+        # borrows are not tenant-keyed here: a tenant export is refused, not widened
+        assert client.get("/export/borrows", params={"tenant_id": "acme"}).status_code == 400
+
+        # Exports need the admin key or a session, which only sees its own tenant
+        anonymous = TestClient(app)
+        assert anonymous.get("/export/overage-charges").status_code == 401
+        acme = TestClient(app, cookies={main.SESSION_COOKIE_NAME: main.serializer.dumps({"username": "a", "tenant_id": "acme"})})
+        assert acme.get("/export/overage-charges", params={"tenant_id": "globex"}).status_code == 403
+        assert [json.loads(line)["user"] for line in acme.get("/export/overage-charges").text.splitlines()] == ["acme-user"]
+
+        # Compaction moves data out of SQLite: admin only
+        assert anonymous.post("/api/admin/archive/compact").status_code == 401
+        r = client.post("/api/admin/archive/compact", headers={"Authorization": "Bearer wrong"})
+        assert r.status_code == 403
+        r = client.post("/api/admin/archive/compact", headers={"Authorization": "Bearer admin-secret"})
+        assert r.status_code == 200 and "archived" in r.json()
+
+
+def test_bulk_provision_streams_rows_and_reports_errors(monkeypatch):
+    from app import bulk
+    from app.db import create_vendor, get_connection
+
+    monkeypatch.setenv("PERMETRIX_ADMIN_API_KEY", "admin-secret")
+    monkeypatch.setattr(bulk, "BULK_CHUNK_ROWS", 2)
+    with temp_db():
+        app = make_app_with_seed()
+        create_vendor("TechVendor", "ops@techvendor.example", vendor_id="techvendor")
+        client = TestClient(app)
+        body = "\n".join([
+            "tenant_id,company_name,contact_email,product_id,product_name,total,commit_qty,max_overage",
+            "acme,Acme Corp,admin@acme.example,p1,tool_a,10,5,2",
+            ",Globex Industries,,p2,tool_b,4,2,1",
+            "acme,,,p3,tool_c,3,1,1",
+            "initech,,,p4,tool_d,3,1,1",
+            "hooli,Hooli,,p5,tool_e,1,2,0",
+            "umbrella,Umbrella,,p6,cad_tool,1,1,0",
+        ])
+        r = client.post(
+            "/api/admin/bulk/provision",
+            content=body,
+            headers={"Authorization": "Bearer admin-secret", "Content-Type": "text/csv"},
+        )
+        assert r.status_code == 200
+        report = r.json()
+        assert report["rows"] == 6 and report["failed"] == 3
+        assert {t["tenant_id"] for t in report["tenants"]} == {"acme", "globex-industries"}
+        assert report["tenants"][0]["setup_link"].startswith("https://acme.")
+        assert {e["line"] for e in report["errors"]} == {5, 6, 7}
+        assert report["packages_created"] == 3
+
+        with get_connection(True) as conn:
+            tools = {row[0] for row in conn.execute("SELECT tool FROM licenses")}
+            assert {"tool_a", "tool_b", "tool_c"} <= tools and "tool_e" not in tools
+
+        r = client.post("/api/admin/bulk/provision", content='{"tenant_id": "x"}', headers={"Authorization": "Bearer nope"})
+        assert r.status_code == 403
+
+
+def test_login_hashes_off_loop_and_throttles_attempts(monkeypatch):
+    import ipaddress
+    from app import passwords
+    from app.db import create_tenant, get_password_hash
+
+    monkeypatch.setattr(passwords, "login_throttle", passwords.LoginThrottle(max_per_user=3, max_per_ip=100))
+    with temp_db():
+        app = make_app_with_seed()
+        tenant = create_tenant("Acme Corp", "admin@acme.example", tenant_id="acme")
+        client = TestClient(app)
+
+        r = client.post("/api/auth/setup", data={"setup_token": tenant["setup_token"], "password": "s3cret-pw"},
+                        follow_redirects=False)
+        assert r.status_code == 302
+        assert get_password_hash("admin@acme.example").startswith("$pbkdf2-sha256$")
+
+        login = {"username": "admin@acme.example", "password": "s3cret-pw"}
+        r = client.post("/api/auth/login", data=login, follow_redirects=False)
+        assert r.status_code == 302
+
+        # A successful login clears earlier failures; three new ones lock the account for the window
+        for _ in range(3):
+            r = client.post("/api/auth/login", data=dict(login, password="wrong"), follow_redirects=False)
+            assert r.status_code == 401
+        r = client.post("/api/auth/login", data=login, follow_redirects=False)
+        assert r.status_code == 429
+        assert int(r.headers["Retry-After"]) > 0
+
+        # Per-IP limit applies across usernames (password spraying)
+        monkeypatch.setattr(passwords, "login_throttle", passwords.LoginThrottle(max_per_user=100, max_per_ip=2))
+        codes = [client.post("/api/auth/login", data={"username": f"user{i}", "password": "x"}).status_code
+                 for i in range(3)]
+        assert codes == [401, 401, 429]
+    passwords.shutdown_pool()
+
+    # Behind a trusted proxy the throttle keys on the forwarded client, which the client cannot spoof
+    from types import SimpleNamespace
+    from app import main
+    monkeypatch.setattr(main, "TRUSTED_PROXIES", [ipaddress.ip_network("172.16.0.0/12")])
+
+    def request(peer, forwarded):
+        return SimpleNamespace(client=SimpleNamespace(host=peer), headers={"X-Forwarded-For": forwarded})
+
+    assert main.client_ip(request("172.16.3.4", "6.6.6.6, 203.0.113.7")) == "203.0.113.7"
+    assert main.client_ip(request("172.16.3.4", "203.0.113.7, 172.16.9.9")) == "203.0.113.7"
+    assert main.client_ip(request("198.51.100.2", "203.0.113.7")) == "198.51.100.2"
+
+
+def test_logging_pipeline_samples_routine_lines_and_keeps_errors():
+    import logging
+    import logging.handlers
+    import queue
+    from app import logpipeline
+
+    def record(level=logging.INFO, **extra):
+        rec = logging.LogRecord("license-server", level, __file__, 1, "request path=%s", ("/x",), None)
+        rec.__dict__.update(extra)
+        return rec
+
+    sampling = logpipeline.SamplingFilter(sample_rate=0.0, rate_per_second=2, slow_ms=500)
+    assert not sampling.filter(record(routine=True, status_code=200, duration_ms=3.0))
+    # Errors, 4xx/5xx and slow requests are always kept, even past the rate limit
+    assert sampling.filter(record(routine=True, status_code=503, duration_ms=3.0))
+    assert sampling.filter(record(routine=True, status_code=200, duration_ms=900.0))
+    assert sampling.filter(record(logging.WARNING))
+    # Non-routine INFO lines are rate limited per logger
+    kept = [sampling.filter(record()) for _ in range(10)]
+    assert 2 <= sum(kept) < 10
+
+    # Producers only enqueue; the listener formats and fans out
+    seen = []
+
+    class Collect(logging.Handler):
+        def emit(self, rec):
+            seen.append(self.format(rec))
+
+    handler = logpipeline.NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    listener = logging.handlers.QueueListener(handler.queue, Collect())
+    handler.handle(record())
+    handler.handle(record())  # queue full: dropped, never blocks
+    assert handler.queue.qsize() == 1
+    listener.start()
+    listener.stop()
+    assert seen == ["request path=/x"]
+
+
+def test_logs_endpoint_reads_incrementally_by_sequence_number(monkeypatch):
+    import json
+    import logging
+    from app import logpipeline
+    from app import main
+    from app.main import app
+
+    # A private buffer, so request lines logged by the pipeline meanwhile don't interfere
+    log_buffer = logpipeline.LogBuffer(max_size=1000)
+    monkeypatch.setattr(main, "log_buffer", log_buffer)
+
+    def record(msg, **extra):
+        rec = logging.LogRecord("license-server", logging.INFO, __file__, 1, msg, (), None)
+        rec.__dict__.update(extra)
+        return rec
+
+    with temp_db():
+        client = TestClient(app)
+        start = log_buffer.last_seq
+        log_buffer.append(record("first", request_id="r1"))
+        log_buffer.append(record("second"))
+
+        r = client.get(f"/logs?after={start}")
+        assert r.text.splitlines()[0].endswith("INFO license-server first request_id=r1")
+        assert r.headers["X-Log-Entries"] == "2"
+        cursor = int(r.headers["X-Log-Last-Seq"])
+        assert cursor == start + 2
+
+        # Nothing new: empty body, cursor unchanged
+        r = client.get(f"/logs?after={cursor}")
+        assert r.text == "" and r.headers["X-Log-Last-Seq"] == str(cursor)
+
+        log_buffer.append(record("third", trace_id="t1"))
+        r = client.get(f"/logs?after={cursor}&format=ndjson")
+        assert r.headers["content-type"].startswith("application/x-ndjson")
+        [entry] = [json.loads(line) for line in r.text.splitlines()]
+        assert entry["seq"] == cursor + 1 and entry["message"] == "third" and entry["trace_id"] == "t1"
+
+    # A cursor that fell off the ring reports how many entries were missed
+    ring = logpipeline.LogBuffer(max_size=3)
+    for i in range(5):
+        ring.append(record(f"m{i}"))
+    entries, cursor, missed = ring.read(after=0, limit=2)
+    assert [e.message for e in entries] == ["m2", "m3"] and cursor == 4 and missed == 2
+    entries, cursor, missed = ring.read(after=cursor)
+    assert [e.message for e in entries] == ["m4"] and missed == 0
+    # Cursor from before a restart (ahead of the buffer) starts over
+    assert ring.read(after=99)[0][0].message == "m2"
+
+
+def test_realtime_buffer_keeps_minute_buckets_and_rate_meters():
+    from app.realtime import RateMeter, RealtimeMetricsBuffer
+
+    clock = [1_800_000_000.0]  # on a minute boundary
+    buffer = RealtimeMetricsBuffer(clock=lambda: clock[0])
+    for i in range(6):
+        buffer.add_borrow("cad_tool", f"user{i % 2}", is_overage=(i == 5), borrow_id=str(i))
+    clock[0] += 90
+    buffer.add_borrow("cad_tool", "user9", is_overage=False, borrow_id="6")
+    buffer.add_failure("cad_tool", "user9", "no licenses available")
+
+    series = buffer.aggregate_tool_metrics(window_seconds=3600)["cad_tool"]
+    assert [p["count"] for p in series] == [6, 1]
+    assert sorted(series[0]["users"]) == ["user0", "user1"] and series[0]["overage_count"] == 1
+    assert series[0]["timestamp"].endswith(":00+00:00")
+    assert buffer.aggregate_tool_metrics(window_seconds=30)["cad_tool"][0]["count"] == 1
+    assert buffer.get_tool_history("cad_tool", 3600) == series
+
+    clock[0] += 5
+    rates = buffer.rates()
+    assert rates["borrow_per_min"] > 0 and rates["failure_per_min"] > 0 and rates["return_per_min"] == 0
+    assert 0 < rates["overage_percent"] < 100
+
+    # EWMA rates: the first completed tick sets the rate, idle time decays it
+    meter = RateMeter(clock=lambda: clock[0])
+    meter.mark(10)
+    clock[0] += 5
+    assert meter.per_minute() == 120.0
+    meter.mark(5)
+    clock[0] += 5
+    assert 60.0 < meter.per_minute() < 120.0
+    clock[0] += 300
+    assert meter.per_minute() < 1.0
+
+    # Buckets older than the retention window are not reported
+    clock[0] += 7 * 3600
+    assert buffer.aggregate_tool_metrics(window_seconds=6 * 3600) == {}
+
+
+def test_realtime_buffer_stores_events_in_bounded_columns():
+    import uuid
+    from app.realtime import EventColumns, RealtimeMetricsBuffer
+
+    clock = [1_800_000_000.0]
+    buffer = RealtimeMetricsBuffer(clock=lambda: clock[0], memory_bytes=EventColumns.ROW_BYTES * 21 * 225)
+    ids = [str(uuid.uuid4()) for _ in range(3000)]
+    for i, borrow_id in enumerate(ids):
+        clock[0] += 1
+        buffer.add_borrow("cad_tool", f"user{i % 3}", is_overage=(i % 2 == 1), borrow_id=borrow_id)
+    buffer.add_return("not-a-uuid", user="user1")
+    buffer.add_failure("cad_tool", "user2", "no licenses available")
+
+    # The memory budget caps stored rows; the oldest are evicted first
+    stats = buffer.get_stats_summary()
+    assert stats["borrow_count"] == 2000 and stats["total_events"] == 2002
+    assert stats["memory_bytes"] <= EventColumns.ROW_BYTES * 21 * 225
+
+    # Windows are cut by timestamp; events are rebuilt with their original fields
+    recent = buffer.get_recent_events(9)  # one borrow per second, the newest at "now"
+    assert [e["id"] for e in recent["borrows"]] == ids[-10:]
+    assert recent["borrows"][-1] == {"timestamp": recent["borrows"][-1]["timestamp"], "type": "borrow",
+                                     "tool": "cad_tool", "user": "user2", "is_overage": True, "id": ids[-1]}
+    assert recent["returns"] == [{"timestamp": recent["returns"][0]["timestamp"], "type": "return",
+                                  "id": "not-a-uuid", "user": "user1"}]
+    assert recent["failures"][0]["reason"] == "no licenses available"
+    assert [e["id"] for e in buffer.get_recent_events(60, limit=3)["borrows"]] == ids[-3:]
+
+    # Events past the retention window are dropped on the next append
+    clock[0] += 6 * 3600 + 1
+    buffer.add_borrow("cad_tool", "user0", is_overage=False, borrow_id=ids[0])
+    assert buffer.get_stats_summary()["borrow_count"] == 1
+    assert buffer.get_recent_events(21600)["returns"] == []
+
+
+def test_realtime_buffer_prunes_interned_names_of_expired_events():
+    from app.realtime import INTERNER_MIN_COMPACT, EventColumns, RealtimeMetricsBuffer
+
+    clock = [1_800_000_000.0]
+    buffer = RealtimeMetricsBuffer(clock=lambda: clock[0], memory_bytes=EventColumns.ROW_BYTES * 21 * 10)
+    for i in range(3000):
+        clock[0] += 60
+        buffer.add_borrow("cad_tool", f"user{i}", is_overage=False, borrow_id=None)
+        if i % 50 == 0:
+            buffer.add_failure("cad_tool", f"user{i}", f"reason{i}")
+
+    # Only names still referenced by stored rows or retained minute buckets are kept
+    assert len(buffer.names) <= INTERNER_MIN_COMPACT
+    recent = buffer.get_recent_events(60)
+    assert recent["borrows"][-1]["user"] == "user2999" and recent["borrows"][-1]["tool"] == "cad_tool"
+    assert recent["failures"] == [] and buffer.get_recent_events(21600)["failures"][-1]["reason"] == "reason2950"
+    assert buffer.get_tool_history("cad_tool", 120)[-1]["users"] == ["user2999"]
+    columns = sum(c.nbytes() for c in (buffer.borrows, buffer.returns, buffer.failures))
+    assert buffer.get_stats_summary()["memory_bytes"] == columns + buffer.names.nbytes()
+
+def test_realtime_broadcaster_shares_one_snapshot_per_tick():
+    import asyncio
+    import threading
+    from app.realtime import RealtimeBroadcaster
+
+    builds = []
+
+    async def snapshot():
+        builds.append(len(builds) + 1)
+        return f'{{"n": {builds[-1]}}}'
+
+    async def main():
+        broadcaster = RealtimeBroadcaster(snapshot, interval=60, min_interval=0.01, queue_size=1)
+        fast, slow = broadcaster.subscribe(), broadcaster.subscribe()
+        assert await asyncio.wait_for(fast.get(), 1) == 'data: {"n": 1}\n\n'
+        assert len(builds) == 1  # one build serves every subscriber
+
+        # Events push a new frame without waiting for the interval (even from another thread)
+        for _ in range(3):
+            threading.Thread(target=broadcaster.notify).start()
+            assert await asyncio.wait_for(fast.get(), 1) == f'data: {{"n": {len(builds)}}}\n\n'
+        # The slow subscriber never read: it holds only the newest frame
+        assert slow.qsize() == 1 and slow.get_nowait() == fast_frame(len(builds))
+
+        # A late subscriber gets the current frame immediately
+        late = broadcaster.subscribe()
+        assert late.get_nowait() == fast_frame(len(builds))
+
+        # With nobody subscribed the broadcaster task finishes
+        for queue in (fast, slow, late):
+            broadcaster.unsubscribe(queue)
+        await asyncio.wait_for(broadcaster._task, 1)
+
+    def fast_frame(n):
+        return f'data: {{"n": {n}}}\n\n'
+
+    asyncio.run(main())
+
+
+def test_realtime_streams_are_built_per_tenant_shard(monkeypatch):
+    import asyncio
+    import json
+    from app import db, main, sharding
+
+    with temp_db():
+        make_app_with_seed()
+        monkeypatch.setattr(sharding, "SHARDING_MODE", "tenant")
+        try:
+            tenant_id = db.create_tenant("Acme", "admin@acme.test")["tenant_id"]
+            db.provision_license_to_tenant("techvendor", tenant_id, {
+                "product_id": "sim", "product_name": "sim_tool", "total": 5, "commit_qty": 5, "max_overage": 0
+            })
+
+            async def stream():
+                broadcasters = main.realtime_broadcasters
+                tenant = broadcasters.get(main._realtime_key(tenant_id))
+                catalog = broadcasters.get(main._realtime_key(None))
+                assert tenant is not catalog and tenant is broadcasters.get(tenant_id)
+                queues = {tenant: tenant.subscribe(), catalog: catalog.subscribe()}
+                tools = {}
+                for broadcaster, queue in queues.items():
+                    frame = await asyncio.wait_for(queue.get(), 5)
+                    tools[broadcaster] = [row["tool"] for row in json.loads(frame[len("data: "):])["tools"]]
+                for broadcaster, queue in queues.items():
+                    broadcaster.unsubscribe(queue)
+                    await asyncio.wait_for(broadcaster._task, 5)
+                return tools[tenant], tools[catalog]
+
+            # Each tenant's stream reads its own shard, not the catalog
+            assert asyncio.run(stream()) == (["sim_tool"], ["cad_tool"])
+        finally:
+            db.close_all_connections()